@@ -34,6 +34,21 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 1209600  # 2 semanas
 SESSION_SAVE_EVERY_REQUEST = True
 
+# Carritos anónimos: 'database' (Cart por sesión) o 'cache' (sin sesión ni filas
+# hasta el login o el checkout, ver products/carts.py)
+ANONYMOUS_CART_STORE = config('ANONYMOUS_CART_STORE', default='database')
+ANONYMOUS_CART_COOKIE = 'cart_token'
+ANONYMOUS_CART_TIMEOUT = SESSION_COOKIE_AGE
+CART_CACHE_ALIAS = 'carts'
+
+# Segundos que un carrito registrado aparta el stock de sus líneas (0 desactiva las
+# reservas). Las vencidas se liberan con el comando release_expired_reservations.
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=900, cast=int)
+
+# Retención de carritos abandonados (comando cleanup_carts, programarlo con cron)
+ANONYMOUS_CART_RETENTION_DAYS = config('ANONYMOUS_CART_RETENTION_DAYS', default=14, cast=int)
+USER_CART_RETENTION_DAYS = config('USER_CART_RETENTION_DAYS', default=0, cast=int)  # 0 = nunca
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -52,6 +67,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'products.metrics.RequestMetricsMiddleware',
+    'products.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -86,13 +103,75 @@ WSGI_APPLICATION = 'biblioteca.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Perfil de SQLite: WAL opcional (los lectores no bloquean al escritor ni al
+# revés), synchronous=NORMAL con WAL (no corrompe; ante un corte de luz se
+# puede perder la última transacción) y FULL sin él, lecturas por mmap y
+# tablas temporales en memoria. journal_mode=WAL queda escrito en el archivo:
+# se activa con SQLITE_WAL en los despliegues para no reescribir el
+# db.sqlite3 del repositorio.
+# BEGIN IMMEDIATE toma el bloqueo de escritura al empezar la transacción: sin
+# eso dos transacciones que leen y luego escriben fallan con "database is
+# locked" en lugar de esperar `timeout` segundos.
+SQLITE_WAL = config('SQLITE_WAL', default=False, cast=bool)
+SQLITE_OPTIONS = {
+    'init_command': ';'.join([
+        *(['PRAGMA journal_mode=WAL'] if SQLITE_WAL else []),
+        f"PRAGMA synchronous={config('SQLITE_SYNCHRONOUS', default='NORMAL' if SQLITE_WAL else 'FULL')}",
+        f"PRAGMA mmap_size={config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)}",
+        'PRAGMA temp_store=MEMORY',
+    ]),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_OPTIONS,
     }
 }
 
+# Réplica de solo lectura para el catálogo (ver products/routers.py): ruta a
+# la copia de la base que mantiene la herramienta de replicación (Litestream,
+# rsync de un backup, ...). Sin valor todo se lee de 'default'.
+DATABASE_REPLICA_NAME = config('DATABASE_REPLICA_NAME', default='')
+if DATABASE_REPLICA_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{DATABASE_REPLICA_NAME}?mode=ro',
+        'OPTIONS': {**SQLITE_OPTIONS, 'transaction_mode': None},
+        # En las pruebas la réplica es la misma base que 'default'
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['products.routers.ReplicaRouter']
+# Segundos que un cliente lee de la primaria después de escribir
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+
+# Caché (locmem en desarrollo; en producción usar un backend compartido entre procesos)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='biblioteca'),
+    },
+    # Carritos anónimos (ANONYMOUS_CART_STORE = 'cache'). Para desarrollo sirve
+    # locmem o FileBasedCache; con varios procesos usar Redis/Memcached.
+    'carts': {
+        'BACKEND': config('CART_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CART_CACHE_LOCATION', default='biblioteca-carts'),
+    },
+}
+
+# Segundos que se conserva una respuesta del catálogo (0 desactiva la caché).
+# Guardar/eliminar productos o categorías invalida todo antes de que venza.
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=300, cast=int)
+
+# Copia estática del catálogo (`manage.py export_catalog_snapshot`, ver products/snapshots.py):
+# directorio donde se escribe y URL desde la que se sirve (enlaces next/previous)
+CATALOG_SNAPSHOT_DIR = config('CATALOG_SNAPSHOT_DIR', default=str(BASE_DIR / 'snapshot'))
+CATALOG_SNAPSHOT_URL = config('CATALOG_SNAPSHOT_URL', default='/snapshot/')
+
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -110,6 +189,33 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Búsqueda: 'auto' usa FTS5 (SQLite) o tsvector/GIN (PostgreSQL); 'icontains' usa SearchFilter de DRF
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='auto')
+
+# Listas precalculadas de destacados y más vendidos (ver products/rankings.py).
+# Cambiar la vida media requiere `manage.py rebuild_rankings`.
+RANKING_SIZE = config('RANKING_SIZE', default=10, cast=int)
+RANKING_HALF_LIFE_DAYS = config('RANKING_HALF_LIFE_DAYS', default=7, cast=float)
+
+# Feed de cambios del catálogo (ver products/changes.py): margen para transacciones
+# sin confirmar y días que se guardan las bajas (un cursor más viejo responde 410)
+CHANGE_FEED_SETTLE_SECONDS = config('CHANGE_FEED_SETTLE_SECONDS', default=5, cast=int)
+CHANGE_FEED_RETENTION_DAYS = config('CHANGE_FEED_RETENTION_DAYS', default=30, cast=int)
+
+# Listados de solo lectura desde values_list() sin serializers (ver products/rows.py).
+# Con JSON más rápido: agregar 'products.renderers.FastJSONRenderer' al principio de
+# REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] (no es idéntico con floats, ver renderers.py)
+FAST_ROWS = config('FAST_ROWS', default=False, cast=bool)
+
+# Estadísticas de órdenes: leer la fila resumen en lugar de agregar en cada petición
+ORDER_STATISTICS_MATERIALIZED = config('ORDER_STATISTICS_MATERIALIZED', default=True, cast=bool)
+
+# Métricas por petición (Server-Timing y /api/metrics/ en formato Prometheus).
+# Opcional: agrega un wrapper a cada consulta y un poco de trabajo por petición
+REQUEST_METRICS = config('REQUEST_METRICS', default=False, cast=bool)
+# Token que debe enviar el scraper (Authorization: Bearer ...); sin token solo responde con DEBUG
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
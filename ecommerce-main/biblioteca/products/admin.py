@@ -1,8 +1,9 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from .models import (
     Category, Product, Cart, CartItem,
-    Order, OrderItem
+    Order, OrderItem, OrderStatistics
 )
+from .services import transition_orders
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -18,6 +19,7 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ['order_number', 'user__username', 'user__email']
     readonly_fields = ['order_number', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
+    actions = ['mark_processing', 'mark_shipped', 'mark_delivered', 'cancel_orders']
     
     fieldsets = (
         ('Información General', {
@@ -35,6 +37,34 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
 
+    def apply_transition(self, request, queryset, new_status):
+        selected = queryset.count()
+        changed = transition_orders(queryset, new_status)
+        label = dict(Order.STATUS_CHOICES)[new_status]
+        self.message_user(request, f'{changed} orden(es) marcadas como "{label}".', messages.SUCCESS)
+        if changed < selected:
+            self.message_user(
+                request,
+                f'{selected - changed} orden(es) omitidas: su estado no permite pasar a "{label}".',
+                messages.WARNING
+            )
+
+    @admin.action(description='Marcar como Procesando')
+    def mark_processing(self, request, queryset):
+        self.apply_transition(request, queryset, 'processing')
+
+    @admin.action(description='Marcar como Enviado')
+    def mark_shipped(self, request, queryset):
+        self.apply_transition(request, queryset, 'shipped')
+
+    @admin.action(description='Marcar como Entregado')
+    def mark_delivered(self, request, queryset):
+        self.apply_transition(request, queryset, 'delivered')
+
+    @admin.action(description='Cancelar y devolver stock')
+    def cancel_orders(self, request, queryset):
+        self.apply_transition(request, queryset, 'cancelled')
+
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
@@ -43,6 +73,12 @@ class OrderItemAdmin(admin.ModelAdmin):
     search_fields = ['product_title', 'order__order_number']
     readonly_fields = ['subtotal', 'created_at']
 
+@admin.register(OrderStatistics)
+class OrderStatisticsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'total_orders', 'total_spent', 'pending_count', 'cancelled_count', 'updated_at']
+    search_fields = ['user__username']
+    readonly_fields = [field.name for field in OrderStatistics._meta.fields]
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['name', 'slug', 'created_at']
@@ -56,7 +92,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ['category', 'is_active', 'language', 'created_at']
     search_fields = ['title', 'author', 'isbn']
     list_editable = ['price', 'stock', 'is_active']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['reserved_stock', 'created_at', 'updated_at']
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -73,6 +109,9 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at', 'total_items', 'subtotal', 'total']
     inlines = [CartItemInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
     def total_items(self, obj):
         return obj.total_items
     total_items.short_description = 'Items'
@@ -3,4 +3,14 @@ from django.apps import AppConfig
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
-    verbose_name = 'Gestión de Productos'
\ No newline at end of file
+    verbose_name = 'Gestión de Productos'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        from django.conf import settings
+        if getattr(settings, 'REQUEST_METRICS', False):
+            from django.db.backends.signals import connection_created
+            from .metrics import install_query_wrapper, install_serializer_timing
+            connection_created.connect(install_query_wrapper)
+            install_serializer_timing()
@@ -0,0 +1,167 @@
+"""
+Lecturas del catálogo como vistas async, para servir bajo ASGI sin ocupar un
+hilo del pool de sync_to_async durante toda la petición.
+
+Replican ProductViewSet (list, retrieve, featured, by_category) y
+CategoryViewSet.list: mismos filtros, búsqueda, orden, paginación por cursor,
+?fields=/?omit=, caché y JSON. Se publican en /api/async/... junto a los viewsets, que siguen
+atendiendo todo lo demás (escrituras, API navegable, autenticación).
+
+Diferencias con los viewsets:
+- Solo JSON y sin autenticación: son lecturas públicas.
+- ?category=N no comprueba que la categoría exista (devuelve una lista vacía
+  en lugar de 400), así filtrar no cuesta una consulta extra.
+- ?page=N (PageNumberPagination, con COUNT) se ejecuta con sync_to_async.
+
+El ORM async de Django 5.2 todavía ejecuta cada consulta en un hilo; lo que
+se ahorra es el puente por petición (middleware, vista y serialización corren
+en el event loop). benchmark_asgi mide la diferencia.
+"""
+from django import forms
+from django.http import HttpResponse
+from django.views import View
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache import acache_catalog_response
+from .fieldsets import Fieldset
+from .models import Category, Product, ProductRanking
+from .rankings import ranking
+from .serializers import CategoryListSerializer, ProductListSerializer, ProductSerializer
+from .views import CategoryViewSet, ProductViewSet
+
+
+class AsyncCatalogView(View):
+    """
+    Base de las vistas async. `viewset` aporta la configuración (filtros,
+    campos de búsqueda y orden, paginación) para no duplicarla.
+    """
+    viewset = None
+    read_replica = True
+    http_method_names = ['get', 'head', 'options']
+
+    async def dispatch(self, request, *args, **kwargs):
+        # El mismo renderer JSON que los viewsets (DEFAULT_RENDERER_CLASSES)
+        self.renderer = next(
+            renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES if renderer.format == 'json'
+        )
+        # Request de DRF solo como envoltorio: query_params y lo que usan los
+        # filtros, la paginación y la caché. No autentica ni parsea el cuerpo.
+        request = Request(request)
+        request.accepted_renderer = self.renderer
+        request.accepted_media_type = self.renderer.media_type
+        self.request = request
+        self.config = self.viewset(request=request, format_kwarg=None, args=args, kwargs=kwargs)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return self.render(detail, status=exc.status_code)
+
+    def render(self, data, status=200):
+        return HttpResponse(self.renderer.render(data), status=status,
+                            content_type=self.renderer.media_type)
+
+    def filter_queryset(self, queryset):
+        queryset = self.filter_fields(queryset)
+        for backend in self.viewset.filter_backends:
+            # DjangoFilterBackend valida ModelChoiceFilter consultando la base
+            if backend is not DjangoFilterBackend:
+                queryset = backend().filter_queryset(self.request, queryset, self.config)
+        return queryset
+
+    def filter_fields(self, queryset):
+        """Filtros exactos de `filterset_fields`, como DjangoFilterBackend"""
+        params = self.request.query_params
+        for name in getattr(self.viewset, 'filterset_fields', []):
+            value = params.get(name)
+            if value in (None, ''):
+                continue
+            field = queryset.model._meta.get_field(name)
+            if field.is_relation:
+                if not value.isdigit():
+                    raise ValidationError({
+                        name: [forms.ModelChoiceField.default_error_messages['invalid_choice']]
+                    })
+                name = field.attname
+            queryset = queryset.filter(**{name: value})
+        return queryset
+
+    async def paginate(self, queryset, serializer_class):
+        paginator = self.viewset.pagination_class()
+        page = await paginator.apaginate_queryset(queryset, self.request, view=self.config)
+        data = serializer_class(page, many=True).data
+        return self.render(paginator.get_paginated_response(data).data)
+
+
+def active_products():
+    # ProductSerializer lee category.name: traerla en la misma consulta
+    return Product.objects.filter(is_active=True).select_related('category')
+
+
+def product_fieldset(request, detail=False):
+    """?fields= y ?omit= como en ProductViewSet: listados compactos por defecto"""
+    return Fieldset(request, ProductSerializer if detail else ProductListSerializer, ProductSerializer)
+
+
+# ===== PRODUCTOS =====
+
+class ProductListView(AsyncCatalogView):
+    viewset = ProductViewSet
+
+    @acache_catalog_response
+    async def get(self, request):
+        fieldset = product_fieldset(request)
+        queryset = fieldset.apply(self.filter_queryset(active_products()))
+        return await self.paginate(queryset, fieldset.serializer)
+
+
+class ProductDetailView(AsyncCatalogView):
+    viewset = ProductViewSet
+
+    @acache_catalog_response
+    async def get(self, request, pk):
+        fieldset = product_fieldset(request, detail=True)
+        product = await fieldset.apply(active_products().filter(pk=pk)).afirst()
+        if product is None:
+            raise NotFound()
+        return self.render(fieldset.serializer(product).data)
+
+
+class FeaturedProductsView(AsyncCatalogView):
+    viewset = ProductViewSet
+
+    @acache_catalog_response
+    async def get(self, request):
+        fieldset = product_fieldset(request)
+        entries = fieldset.apply(ranking(ProductRanking.FEATURED), 'product__')
+        products = [entry.product async for entry in entries]
+        return self.render(fieldset.serializer(products, many=True).data)
+
+
+class ProductsByCategoryView(AsyncCatalogView):
+    viewset = ProductViewSet
+
+    @acache_catalog_response
+    async def get(self, request):
+        category_id = request.query_params.get('category_id')
+        if not category_id:
+            return self.render({'error': 'category_id parameter is required'}, status=400)
+        if not category_id.isdigit():
+            raise ValidationError({'category_id': ['Debe ser un número entero.']})
+        fieldset = product_fieldset(request)
+        products = fieldset.apply(active_products().filter(category_id=category_id))
+        return self.render(fieldset.serializer([p async for p in products], many=True).data)
+
+
+# ===== CATEGORÍAS =====
+
+class CategoryListView(AsyncCatalogView):
+    viewset = CategoryViewSet
+
+    @acache_catalog_response
+    async def get(self, request):
+        queryset = self.filter_queryset(Category.objects.with_product_count())
+        return await self.paginate(queryset, CategoryListSerializer)
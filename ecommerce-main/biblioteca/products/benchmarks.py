@@ -0,0 +1,156 @@
+"""
+Utilidades compartidas por los comandos benchmark_*.
+
+Todos los benchmarks siembran sus propios datos dentro de una transacción que
+se revierte al final, así que se pueden ejecutar sobre la base de desarrollo
+sin dejar basura.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .models import Category, Order, OrderItem, Product
+from .rankings import refresh_featured
+
+
+class Rollback(Exception):
+    """Se lanza para revertir la transacción del benchmark"""
+
+
+@contextmanager
+def rollback_after():
+    """Ejecuta el bloque dentro de una transacción que siempre se revierte"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def percentile(samples, pct):
+    """Percentil por interpolación lineal (pct entre 0 y 100)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def measure(func, repeat=5, setup=None):
+    """
+    Ejecuta `func` `repeat` veces y devuelve tiempos (ms) y consultas SQL.
+    `setup` se ejecuta antes de cada repetición y no se mide.
+    """
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(ctx.captured_queries))
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'queries': max(queries),
+    }
+
+
+WORDS = [
+    'dragón', 'espada', 'sombra', 'reino', 'magia', 'academia', 'pirata', 'ninja',
+    'corazón', 'estrella', 'guerra', 'luna', 'fuego', 'hielo', 'bosque', 'ciudad',
+    'secreto', 'leyenda', 'héroe', 'villano', 'torre', 'océano', 'tormenta', 'jardín',
+    'samurái', 'robot', 'tiempo', 'memoria', 'destino', 'cazador', 'princesa', 'isla',
+]
+
+
+def _words(seed, count):
+    return ' '.join(WORDS[(seed * 7 + offset * 13) % len(WORDS)] for offset in range(count))
+
+
+def seed_catalog(products=100, categories=5, stock=1000, prefix='bench', batch_size=1000):
+    """Crea categorías y productos de prueba con bulk_create"""
+    cats = Category.objects.bulk_create([
+        Category(name=f'{prefix} categoría {i}', slug=f'{prefix}-cat-{i}',
+                 description=f'Categoría de prueba {i}: {_words(i, 4)}')
+        for i in range(categories)
+    ])
+    # SQLite y PostgreSQL devuelven los ids en bulk_create
+    for start in range(0, products, batch_size):
+        Product.objects.bulk_create([
+            Product(
+                category=cats[i % categories],
+                title=f'{_words(i, 2).title()} Vol. {i % 40 + 1}',
+                author=f'Autor {i % 97}',
+                isbn=f'9{i:012d}',
+                description=f'{_words(i + 3, 12)}. Edición número {i}.',
+                price=Decimal('5.00') + Decimal(i % 50),
+                stock=stock,
+                publisher=f'Editorial {i % 13}',
+                language='Español',
+                rating=Decimal(i % 500) / 100,
+            )
+            for i in range(start, min(start + batch_size, products))
+        ])
+    # bulk_create no dispara señales: la lista de destacados se recalcula aquí
+    refresh_featured()
+    return cats, list(Product.objects.filter(category__in=cats).order_by('pk'))
+
+
+def seed_user(username='bench-user'):
+    return User.objects.create_user(username=username, email=f'{username}@example.com',
+                                    password='bench-password')
+
+
+def seed_users(count, prefix='bench'):
+    """Crea usuarios con bulk_create (misma contraseña para todos)"""
+    password = User(username='x')
+    password.set_password('bench-password')
+    User.objects.bulk_create([
+        User(username=f'{prefix}-user-{i}', email=f'{prefix}-user-{i}@example.com',
+             password=password.password)
+        for i in range(count)
+    ], batch_size=1000)
+    return list(User.objects.filter(username__startswith=f'{prefix}-user-').order_by('pk'))
+
+
+def seed_orders(users, products, orders_per_user=5, items_per_order=3, prefix='bench'):
+    """Crea historial de órdenes con sus items (sin pasar por save() ni señales)"""
+    statuses = [value for value, _ in Order.STATUS_CHOICES]
+    orders = []
+    for u, user in enumerate(users):
+        for k in range(orders_per_user):
+            orders.append(Order(
+                user=user,
+                order_number=f'ORD-{prefix.upper()}-{u}-{k}',
+                status=statuses[(u + k) % len(statuses)],
+                payment_method='cash',
+                subtotal=Decimal('30.00'), shipping_cost=Decimal('5.00'), total=Decimal('35.00'),
+                shipping_address='Av. Benchmark 123', shipping_city='Lima',
+                shipping_postal_code='15001', phone='999999999',
+            ))
+    Order.objects.bulk_create(orders, batch_size=1000)
+    orders = list(Order.objects.filter(order_number__startswith=f'ORD-{prefix.upper()}-'))
+
+    items = []
+    for o, order in enumerate(orders):
+        for i in range(items_per_order):
+            product = products[(o * items_per_order + i) % len(products)]
+            items.append(OrderItem(
+                order=order, product=product, product_title=product.title,
+                product_author=product.author, product_isbn=product.isbn or '',
+                quantity=1, price=product.price, subtotal=product.price,
+            ))
+    OrderItem.objects.bulk_create(items, batch_size=1000)
+    return orders
@@ -0,0 +1,162 @@
+"""
+Caché versionada de respuestas para los endpoints públicos del catálogo.
+
+Cada respuesta se guarda bajo una clave formada por la versión del catálogo,
+la ruta, el formato y la query string normalizada. Guardar o eliminar un
+Product o Category incrementa la versión (ver signals.py), así que las
+entradas viejas dejan de usarse sin tener que borrarlas una por una.
+
+La versión cambia al confirmar la transacción de la escritura
+(invalidate_catalog): si cambiara antes, un lector concurrente podría
+guardar bajo la versión nueva las filas todavía sin confirmar.
+
+Las respuestas llevan un ETag fuerte (hash del contenido); si el cliente
+envía If-None-Match con ese valor se responde 304 sin construir el queryset
+ni serializar nada.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # add() no pisa la versión si otro proceso la creó primero
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Invalida todas las respuestas cacheadas del catálogo"""
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # La clave no existía (caché reiniciada): cualquier versión nueva sirve
+        cache.add(CATALOG_VERSION_KEY, 2, timeout=None)
+        return cache.get(CATALOG_VERSION_KEY)
+
+
+def invalidate_catalog():
+    """bump_catalog_version() al confirmar la transacción en curso (o ya, fuera de una)"""
+    # robust: la escritura ya está confirmada, un error de la caché no debe devolver 500
+    transaction.on_commit(bump_catalog_version, robust=True)
+
+
+async def aget_catalog_version():
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def catalog_cache_key(request, version):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+    )
+    # El host y el esquema entran en la clave porque los enlaces de paginación son absolutos
+    raw = '|'.join([
+        request.scheme,
+        request.get_host(),
+        request.path,
+        request.accepted_renderer.format,
+        '&'.join(f'{key}={value}' for key, value in params),
+    ])
+    return f'catalog:{version}:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+
+def _not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+def _entry(response):
+    etag = '"{}"'.format(hashlib.sha1(response.content).hexdigest())
+    return (response.content, response['Content-Type'], etag)
+
+
+def _cached_response(request, entry):
+    content, content_type, etag = entry
+    if _not_modified(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def cache_catalog_response(view_method):
+    """
+    Decorador para acciones de solo lectura del catálogo. Solo se cachean
+    las respuestas JSON con estado 200; el resto pasa tal cual.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+        # La API navegable incluye datos de la sesión (usuario, CSRF): solo JSON
+        if not timeout or request.accepted_renderer.format != 'json':
+            return view_method(self, request, *args, **kwargs)
+
+        key = catalog_cache_key(request, get_catalog_version())
+        entry = cache.get(key)
+        if entry is not None:
+            return _cached_response(request, entry)
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+
+        # Renderizar aquí (normalmente lo hace dispatch) para cachear los bytes
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+
+        entry = _entry(response)
+        cache.set(key, entry, timeout)
+        return _cached_response(request, entry)
+
+    return wrapper
+
+
+def acache_catalog_response(view_method):
+    """
+    cache_catalog_response para los métodos async de async_views.py, que
+    reciben un Request de DRF y devuelven un HttpResponse ya renderizado.
+    """
+    @wraps(view_method)
+    async def wrapper(self, request, *args, **kwargs):
+        timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+        if not timeout:
+            return await view_method(self, request, *args, **kwargs)
+
+        key = catalog_cache_key(request, await aget_catalog_version())
+        entry = await cache.aget(key)
+        if entry is not None:
+            return _cached_response(request, entry)
+
+        response = await view_method(self, request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        entry = _entry(response)
+        await cache.aset(key, entry, timeout)
+        return _cached_response(request, entry)
+
+    return wrapper
@@ -0,0 +1,243 @@
+"""
+Carritos anónimos guardados en caché (ANONYMOUS_CART_STORE = 'cache').
+
+Con el modo 'database' cada visitante que toca el carrito crea una fila de
+sesión y una de Cart. En modo 'cache' el carrito anónimo vive en el alias de
+caché CART_CACHE_ALIAS bajo un token aleatorio que viaja en la cookie
+ANONYMOUS_CART_COOKIE; no se crea sesión ni se escribe en la base de datos.
+Solo al iniciar sesión (o al hacer checkout) el contenido se vuelca al Cart
+del usuario con persist_anonymous_cart().
+
+CachedCart y CachedCartItem imitan los atributos de Cart y CartItem que usa
+CartSerializer, así que la respuesta de los endpoints no cambia. El id de
+cada item es el id del producto (único dentro del carrito) y el id del
+carrito es null mientras no exista en la base de datos.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product, StockReservation
+from .reservations import InsufficientStock, reserve_stock
+
+
+def uses_cache_store():
+    return getattr(settings, 'ANONYMOUS_CART_STORE', 'database') == 'cache'
+
+
+def _cache():
+    return caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+
+
+def _key(token):
+    return f'cart:anon:{token}'
+
+
+def _timeout():
+    return getattr(settings, 'ANONYMOUS_CART_TIMEOUT', settings.SESSION_COOKIE_AGE)
+
+
+def get_cart_token(request):
+    """Token del carrito anónimo de la cookie (None si no hay o el modo es 'database')"""
+    if not uses_cache_store():
+        return None
+    token = request.COOKIES.get(settings.ANONYMOUS_CART_COOKIE)
+    try:
+        return uuid.UUID(token).hex if token else None
+    except ValueError:
+        return None
+
+
+def set_cart_cookie(response, token):
+    response.set_cookie(
+        settings.ANONYMOUS_CART_COOKIE, token, max_age=_timeout(),
+        httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+    )
+
+
+class CachedCartItem:
+    def __init__(self, cart, product, quantity, added_at, updated_at):
+        self.cart = cart
+        self.product = product
+        self.quantity = quantity
+        self.added_at = added_at
+        self.updated_at = updated_at
+
+    @property
+    def id(self):
+        return self.product.pk
+
+    @property
+    def total_price(self):
+        return self.product.price * self.quantity
+
+    def save(self):
+        self.cart.entries[self.product.pk] = {
+            'quantity': self.quantity,
+            'added_at': self.added_at,
+            'updated_at': timezone.now(),
+        }
+        self.cart.save()
+
+    def delete(self):
+        self.cart.entries.pop(self.product.pk, None)
+        self.cart.save()
+
+
+class CachedCart:
+    """Carrito anónimo guardado en caché: {product_id: {quantity, added_at, updated_at}}"""
+
+    id = None
+
+    def __init__(self, token=None, data=None):
+        now = timezone.now()
+        data = data or {}
+        self.token = token
+        self.entries = data.get('items', {})
+        self.created_at = data.get('created_at', now)
+        self.updated_at = data.get('updated_at', now)
+        self._items = None
+
+    @classmethod
+    def load(cls, token):
+        if token is None:
+            return cls()
+        return cls(token, _cache().get(_key(token)))
+
+    @property
+    def items(self):
+        """Items con su producto, ordenados como CartItem (más recientes primero)"""
+        if self._items is None:
+            products = Product.objects.filter(pk__in=self.entries, is_active=True).in_bulk()
+            self._items = sorted(
+                (CachedCartItem(self, products[pk], entry['quantity'], entry['added_at'], entry['updated_at'])
+                 for pk, entry in self.entries.items() if pk in products),
+                key=lambda item: item.added_at, reverse=True,
+            )
+        return self._items
+
+    @property
+    def total_items(self):
+        return sum(item.quantity for item in self.items)
+
+    @property
+    def subtotal(self):
+        return sum((item.total_price for item in self.items), 0)
+
+    @property
+    def total(self):
+        return self.subtotal
+
+    def get_item(self, product_id):
+        """Item del producto, o None; no consulta la base si no está en el carrito"""
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None
+        if product_id not in self.entries:
+            return None
+        return next((item for item in self.items if item.product.pk == product_id), None)
+
+    def add_item(self, product, quantity):
+        now = timezone.now()
+        self.entries[product.pk] = {'quantity': quantity, 'added_at': now, 'updated_at': now}
+        self.save()
+        return CachedCartItem(self, product, quantity, now, now)
+
+    def set_quantities(self, quantities):
+        """Fija varias cantidades de una vez ({product_id: cantidad}, 0 elimina)"""
+        now = timezone.now()
+        for product_id, quantity in quantities.items():
+            if quantity <= 0:
+                self.entries.pop(product_id, None)
+                continue
+            entry = self.entries.get(product_id, {'added_at': now})
+            self.entries[product_id] = {**entry, 'quantity': quantity, 'updated_at': now}
+        self.save()
+
+    def clear(self):
+        self.entries = {}
+        self.save()
+
+    def save(self):
+        if self.token is None:
+            self.token = uuid.uuid4().hex
+        self.updated_at = timezone.now()
+        self._items = None
+        _cache().set(_key(self.token), {
+            'items': self.entries,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }, _timeout())
+
+
+def persist_anonymous_cart(token, user_id):
+    """
+    Vuelca el carrito anónimo `token` al Cart del usuario y lo borra de la
+    caché. Las cantidades se suman a las que ya tenga el usuario, sin superar
+    el stock disponible (stock - reserved_stock, más lo que el carrito ya
+    tenía apartado), y se reservan como en add_item. Devuelve el Cart o None
+    si no había nada que volcar. Nunca falla por falta de stock: el login y
+    el checkout no deben romperse por el volcado.
+    """
+    if token is None:
+        return None
+    entries = (_cache().get(_key(token)) or {}).get('items', {})
+    if not entries:
+        _cache().delete(_key(token))
+        return None
+
+    with transaction.atomic():
+        # Si la transacción falla el carrito anónimo sigue en la caché
+        transaction.on_commit(lambda: _cache().delete(_key(token)))
+        cart, _ = Cart.objects.get_or_create(user_id=user_id)
+        products = Product.objects.filter(pk__in=entries, is_active=True).in_bulk()
+        existing = {item.product_id: item for item in cart.items.select_for_update()}
+        held = dict(StockReservation.objects.filter(cart=cart, product_id__in=products)
+                    .values_list('product_id', 'quantity'))
+        quantities = {}
+        for product_id, entry in entries.items():
+            product = products.get(product_id)
+            if product is None:
+                continue
+            current = existing[product_id].quantity if product_id in existing else 0
+            available = product.available_stock + held.get(product_id, 0)
+            quantities[product_id] = max(min(current + entry['quantity'], available), current)
+
+        # Otro carrito puede apartar unidades entre la lectura y la reserva: se
+        # toma lo que queda y, si vuelve a faltar, la línea queda como estaba.
+        # Cada fallo recorta o descarta un producto, así que el ciclo termina.
+        clamped = set()
+        while True:
+            try:
+                with transaction.atomic():
+                    reserve_stock(cart, quantities)
+                break
+            except InsufficientStock as exc:
+                for product in exc.products:
+                    if product.pk in clamped:
+                        del quantities[product.pk]
+                    else:
+                        clamped.add(product.pk)
+                        quantities[product.pk] = exc.available_for(product)
+
+        now = timezone.now()
+        to_create, to_update, removed = [], [], []
+        for product_id, quantity in quantities.items():
+            item = existing.get(product_id)
+            if quantity <= 0:
+                if item is not None:
+                    removed.append(item.pk)
+            elif item is None:
+                to_create.append(CartItem(cart=cart, product=products[product_id], quantity=quantity))
+            elif item.quantity != quantity:
+                item.quantity = quantity
+                item.updated_at = now
+                to_update.append(item)
+        CartItem.objects.filter(pk__in=removed).delete()
+        CartItem.objects.bulk_create(to_create)
+        CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+    return cart
@@ -0,0 +1,154 @@
+"""
+Feed de cambios del catálogo: lo que cambió desde un cursor, para que el
+frontend, los indexadores y los feeds de socios se mantengan al día sin
+volver a descargar /api/products/.
+
+GET /api/catalog/changes/?cursor=...&limit=N devuelve:
+- products: productos activos creados o modificados (ProductSerializer)
+- categories: categorías creadas o modificadas (CategoryListSerializer)
+- deleted: ids de productos eliminados o desactivados y de categorías
+  eliminadas (tombstones)
+- cursor: para la próxima llamada; has_more y next si ya hay otra página
+Sin cursor empieza desde el principio (la sincronización inicial). El
+cliente aplica products y categories, luego deleted, y guarda el cursor.
+
+Hay tres flujos ordenados por (fecha, id), cada uno con su índice: Product
+por updated_at (incluye los inactivos), Category por updated_at y
+CatalogTombstone por deleted_at (las eliminaciones, que registra
+signals.py). El cursor guarda la última posición vista de cada flujo y cada
+página une los tres por fecha: como mucho `limit` cambios y seis consultas.
+
+- Solo se leen filas con fecha anterior a ahora - CHANGE_FEED_SETTLE_SECONDS:
+  una transacción que todavía no confirmó puede guardar una fecha anterior a
+  la de filas ya visibles, y sin ese margen el cursor la saltaría.
+- Las bajas se guardan CHANGE_FEED_RETENTION_DAYS (`manage.py
+  prune_catalog_tombstones`): un cursor emitido antes responde 410 y el
+  cliente vuelve a sincronizar desde cero.
+- Un cambio en una categoría no mueve el updated_at de sus productos: su
+  category_name nuevo llega con la categoría en `categories`.
+- Lo que se modifica con update() sin tocar updated_at no aparece.
+"""
+import base64
+import heapq
+import json
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from .models import CatalogTombstone, Category, Product
+from .rows import row_mapper
+from .serializers import CategoryListSerializer, ProductSerializer
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+# (nombre en el cursor, modelo, campo de fecha, columnas extra)
+STREAMS = [
+    ('p', Product, 'updated_at', ['is_active']),
+    ('c', Category, 'updated_at', []),
+    ('t', CatalogTombstone, 'deleted_at', ['kind', 'object_id']),
+]
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'El cursor expiró: sincronizar de nuevo sin cursor'
+    default_code = 'cursor_expired'
+
+
+def encode_cursor(positions, issued):
+    payload = {
+        name: [when.isoformat(), pk] for name, (when, pk) in positions.items()
+    }
+    payload['at'] = issued.isoformat()
+    token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode())
+    return token.decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(posiciones por flujo, fecha de emisión); NotFound si el cursor no es válido"""
+    if not token:
+        return {}, None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        positions = {
+            name: (parse_datetime(payload[name][0]), int(payload[name][1]))
+            for name, *_ in STREAMS if name in payload
+        }
+        issued = parse_datetime(payload['at'])
+        if issued is None or any(when is None for when, _ in positions.values()):
+            raise ValueError
+        return positions, issued
+    except (TypeError, ValueError, KeyError, IndexError):
+        raise NotFound('Cursor inválido')
+
+
+def stream_query(model, field, columns, position, horizon):
+    """Filas (fecha, id, *columnas) de un flujo posteriores a `position`, en orden"""
+    queryset = model._default_manager.filter(**{f'{field}__lte': horizon})
+    if position is not None:
+        when, pk = position
+        # Un rango sobre la fecha (no un OR) para recorrer el índice en orden sin ordenar después
+        queryset = queryset.filter(Q(**{f'{field}__gte': when}) & ~Q(**{field: when, 'pk__lte': pk}))
+    return queryset.order_by(field, 'pk').values_list(field, 'pk', *columns)
+
+
+def product_data(ids):
+    mapper = row_mapper(ProductSerializer)
+    products = Product.objects.filter(pk__in=ids).order_by('updated_at', 'pk')
+    if mapper is not None:
+        return mapper.data(mapper.rows(products))
+    return ProductSerializer(products.select_related('category'), many=True).data
+
+
+def category_data(ids):
+    categories = Category.objects.with_product_count().filter(pk__in=ids).order_by('updated_at', 'pk')
+    return CategoryListSerializer(categories, many=True).data
+
+
+def read_changes(token, limit):
+    """Una página del feed desde el cursor `token` (None = desde el principio)"""
+    now = timezone.now()
+    positions, issued = decode_cursor(token)
+    if issued is not None and issued < now - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS):
+        raise CursorExpired()
+    horizon = now - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)
+
+    streams = [
+        [
+            (row[0], name, row)
+            # Una fila extra indica si quedan cambios en el flujo
+            for row in stream_query(model, field, columns, positions.get(name), horizon)[:limit + 1]
+        ]
+        for name, model, field, columns in STREAMS
+    ]
+    # Los cambios más viejos primero, sin importar de qué flujo vienen
+    taken = list(islice(heapq.merge(*streams), limit))
+    has_more = sum(len(rows) for rows in streams) > len(taken)
+
+    products, categories = [], []
+    deleted = {'products': [], 'categories': []}
+    for when, name, row in taken:
+        positions[name] = (when, row[1])
+        if name == 'p':
+            (products if row[2] else deleted['products']).append(row[1])
+        elif name == 'c':
+            categories.append(row[1])
+        else:
+            kind = 'products' if row[2] == CatalogTombstone.PRODUCT else 'categories'
+            deleted[kind].append(row[3])
+
+    return {
+        'cursor': encode_cursor(positions, now),
+        'has_more': has_more,
+        'products': product_data(products) if products else [],
+        'categories': category_data(categories) if categories else [],
+        'deleted': deleted,
+    }
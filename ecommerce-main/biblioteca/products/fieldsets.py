@@ -0,0 +1,183 @@
+"""
+Campos a pedido (sparse fieldsets) para el catálogo.
+
+- `?fields=id,title,price` devuelve solo esos campos, elegidos entre todos los
+  de la representación completa, y el queryset carga solo sus columnas con
+  only().
+- `?omit=description,isbn` quita campos de la representación por defecto
+  y difiere sus columnas con defer().
+- Sin parámetros, los listados usan la representación compacta
+  (ProductListSerializer: sin los datos de publicación y con la descripción
+  resumida) y cargan solo sus columnas; el detalle usa la completa.
+  `?fields=description` devuelve la descripción entera.
+
+Las columnas salen del `source` de cada campo (`category.name` ->
+`category`, `category__name`). Si un campo pedido no sale de columnas
+(SerializerMethodField, propiedades) se cargan todas, para no disparar una
+consulta por fila al leer un campo diferido.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+_serializer_fields = {}
+
+
+def serializer_fields(serializer_class):
+    """Campos legibles de un serializer (nombre -> campo), calculados una vez por clase"""
+    fields = _serializer_fields.get(serializer_class)
+    if fields is None:
+        fields = _serializer_fields[serializer_class] = {
+            name: field for name, field in serializer_class().fields.items() if not field.write_only
+        }
+    return fields
+
+
+def field_columns(field, model):
+    """Rutas de only() que lee un campo, o None si no salen de columnas del modelo"""
+    if field.source == '*':
+        return None
+    paths, prefix = [], ''
+    for i, attr in enumerate(field.source_attrs):
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete:
+            return None
+        paths.append(prefix + attr)
+        if not model_field.is_relation:
+            return paths if i == len(field.source_attrs) - 1 else None
+        model = model_field.related_model
+        prefix += f'{attr}__'
+    return paths
+
+
+def _param(request, name):
+    value = request.query_params.get(name, '')
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+class Fieldset:
+    """
+    Campos de la respuesta según ?fields= y ?omit=. `default` es la
+    representación sin parámetros y `full` la que tiene todos los campos.
+    """
+
+    def __init__(self, request, default, full):
+        fields, omit = _param(request, FIELDS_PARAM), _param(request, OMIT_PARAM)
+        self.serializer_class = full if fields else default
+        available = serializer_fields(self.serializer_class)
+        for param, names in [(FIELDS_PARAM, fields), (OMIT_PARAM, omit)]:
+            unknown = sorted(names - available.keys())
+            if unknown:
+                raise ValidationError({param: [
+                    f'Campos desconocidos: {", ".join(unknown)}. '
+                    f'Disponibles: {", ".join(available)}'
+                ]})
+        self.names = [name for name in available if (not fields or name in fields) and name not in omit]
+        if not self.names:
+            raise ValidationError({OMIT_PARAM: ['La respuesta debe tener al menos un campo']})
+        self.only = bool(fields) or default is not full
+        self.omitted = [available[name] for name in available if name not in self.names]
+        self.model = self.serializer_class.Meta.model
+
+    def columns(self, fields):
+        """Rutas de columnas de `fields`, o None si alguno no sale de columnas"""
+        paths = []
+        for field in fields:
+            columns = field_columns(field, self.model)
+            if columns is None:
+                return None
+            paths += columns
+        return paths
+
+    def apply(self, queryset, prefix=''):
+        """
+        Carga solo las columnas de la respuesta. `prefix` es la relación al
+        producto cuando el queryset es de otro modelo (`product__` para
+        ProductRanking). Las columnas del orden se cargan siempre: la
+        paginación por cursor lee sus valores de la última fila.
+        """
+        available = serializer_fields(self.serializer_class)
+        needed = self.columns(available[name] for name in self.names)
+        if needed is None:
+            return queryset
+        if not prefix:
+            needed += self.ordering_columns(queryset)
+
+        # El join con la categoría solo si algún campo la lee
+        base = prefix[:-2]
+        relations = {path.rsplit('__', 1)[0] for path in needed if '__' in path}
+        related = [prefix + relation for relation in relations] or ([base] if base else [])
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+
+        if self.only:
+            return queryset.only(*(prefix + path for path in needed), *([base] if base else []))
+        # Representación completa con ?omit=: diferir lo que solo usan los campos quitados
+        omitted = self.columns(self.omitted) or []
+        deferred = [path for path in omitted if path not in needed and '__' not in path]
+        return queryset.defer(*(prefix + path for path in deferred)) if deferred else queryset
+
+    def ordering_columns(self, queryset):
+        meta = queryset.model._meta
+        columns = []
+        for item in list(queryset.query.order_by) or list(meta.ordering):
+            if not isinstance(item, str):
+                continue
+            try:
+                field = meta.get_field(item.lstrip('-'))
+            except FieldDoesNotExist:
+                continue
+            if field.concrete:
+                columns.append(field.name)
+        return columns
+
+    def serializer(self, *args, **kwargs):
+        """Instancia de `serializer_class` sin los campos que no se pidieron"""
+        serializer = self.serializer_class(*args, **kwargs)
+        target = getattr(serializer, 'child', serializer)
+        for name in [name for name in target.fields if name not in self.names]:
+            target.fields.pop(name)
+        return serializer
+
+
+class SparseFieldsetMixin:
+    """
+    Para viewsets: ?fields= y ?omit= en las lecturas. Los listados (acciones
+    sin detalle) usan `list_serializer_class` por defecto.
+    """
+    list_serializer_class = None
+
+    def get_fieldset(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        if getattr(self, '_fieldset', None) is None:
+            full = self.serializer_class
+            detail = getattr(self, 'detail', False)
+            default = full if detail or self.list_serializer_class is None else self.list_serializer_class
+            self._fieldset = Fieldset(self.request, default, full)
+        return self._fieldset
+
+    def get_serializer_class(self):
+        fieldset = self.get_fieldset()
+        return fieldset.serializer_class if fieldset else super().get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return super().get_serializer(*args, **kwargs)
+        kwargs.setdefault('context', self.get_serializer_context())
+        return fieldset.serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        return self.restrict_columns(super().filter_queryset(queryset))
+
+    def restrict_columns(self, queryset, prefix=''):
+        fieldset = self.get_fieldset()
+        return fieldset.apply(queryset, prefix) if fieldset else queryset
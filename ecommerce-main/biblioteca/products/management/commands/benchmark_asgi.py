@@ -0,0 +1,184 @@
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import override_settings
+
+from products.benchmarks import percentile, seed_catalog
+from products.models import Category
+
+PREFIX = 'bench-asgi'
+
+# (nombre, ruta del viewset, ruta de la vista async); {pk} y {category} se completan al sembrar
+ENDPOINTS = [
+    ('products.list', '/api/products/', '/api/async/products/'),
+    ('products.retrieve', '/api/products/{pk}/', '/api/async/products/{pk}/'),
+    ('products.featured', '/api/products/featured/', '/api/async/products/featured/'),
+    ('products.by_category', '/api/products/by_category/?category_id={category}',
+     '/api/async/products/by_category/?category_id={category}'),
+    ('categories.list', '/api/categories/', '/api/async/categories/'),
+]
+
+# (modo, servidor, usa la ruta async)
+MODES = [
+    ('wsgi', 'wsgi', False),
+    ('asgi-sync', 'asgi', False),
+    ('asgi-async', 'asgi', True),
+]
+
+
+def wsgi_get(app, url):
+    path, _, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost', 'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    response = app(environ, lambda status_line, headers: status.append(int(status_line[:3])))
+    b''.join(response)
+    response.close()
+    return status[0]
+
+
+async def asgi_get(app, url):
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        'headers': [(b'host', b'localhost'), (b'accept', b'application/json')],
+    }
+    body_sent = False
+    status = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Django espera aquí un http.disconnect que nunca llega; cancela la tarea al terminar
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara peticiones por segundo y latencia (p50/p95/p99) de las lecturas del '
+        'catálogo servidas por WSGI, por ASGI con los viewsets y por ASGI con las vistas async'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Peticiones por endpoint, modo y concurrencia')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+        parser.add_argument('--only', action='append',
+                            help='Medir solo endpoints cuyo nombre empiece así (repetible)')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Mide con la caché del catálogo activa (por defecto se desactiva)')
+        parser.add_argument('--json', dest='json_path',
+                            help='Escribe los resultados en este archivo JSON')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING(
+            'Las peticiones se envían a los handlers WSGI/ASGI de Django dentro de este proceso '
+            '(sin red ni servidor): mide el costo del stack de Django, no de gunicorn/uvicorn'
+        ))
+        endpoints = [
+            e for e in ENDPOINTS
+            if not options['only'] or any(e[0].startswith(prefix) for prefix in options['only'])
+        ]
+        overrides = {'ALLOWED_HOSTS': ['*'], 'DEBUG': False}
+        if not options['with_cache']:
+            overrides['CATALOG_CACHE_TIMEOUT'] = 0
+
+        # Cada hilo y cada petición ASGI abre su propia conexión: los datos se
+        # confirman y se borran al final
+        categories, products = seed_catalog(products=options['products'], categories=5, prefix=PREFIX)
+        values = {'pk': products[0].pk, 'category': categories[0].pk}
+        connection.close()
+        results = []
+        try:
+            with override_settings(**overrides):
+                wsgi_app, asgi_app = get_wsgi_application(), get_asgi_application()
+                for name, sync_path, async_path in endpoints:
+                    self.stdout.write(self.style.MIGRATE_HEADING(name))
+                    for concurrency in options['concurrency']:
+                        for mode, server, use_async in MODES:
+                            url = (async_path if use_async else sync_path).format(**values)
+                            if server == 'wsgi':
+                                stats = self.run_wsgi(wsgi_app, url, options['requests'], concurrency)
+                            else:
+                                stats = asyncio.run(
+                                    self.run_asgi(asgi_app, url, options['requests'], concurrency)
+                                )
+                            results.append({'endpoint': name, 'mode': mode,
+                                            'concurrency': concurrency, **stats})
+                            self.stdout.write(
+                                f'  c={concurrency:<4} {mode:<11} {stats["rps"]:>8.1f} req/s '
+                                f'p50={stats["p50_ms"]:>8.2f}ms p95={stats["p95_ms"]:>8.2f}ms '
+                                f'p99={stats["p99_ms"]:>8.2f}ms errores={stats["errors"]}'
+                            )
+        finally:
+            Category.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+    def summarize(self, timings, statuses, wall):
+        return {
+            'requests': len(timings),
+            'rps': round(len(timings) / wall, 1),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'errors': sum(status >= 400 for status in statuses),
+        }
+
+    def run_wsgi(self, app, url, total, concurrency):
+        def timed(_):
+            start = time.perf_counter()
+            status = wsgi_get(app, url)
+            return (time.perf_counter() - start) * 1000, status
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed, range(concurrency)))  # calentamiento
+            start = time.perf_counter()
+            samples = list(pool.map(timed, range(total)))
+            wall = time.perf_counter() - start
+        return self.summarize([ms for ms, _ in samples], [status for _, status in samples], wall)
+
+    async def run_asgi(self, app, url, total, concurrency):
+        # `concurrency` clientes que envían peticiones hasta completar `total`
+        pending = iter(range(total))
+        samples = []
+
+        async def client():
+            for _ in pending:
+                start = time.perf_counter()
+                status = await asgi_get(app, url)
+                samples.append(((time.perf_counter() - start) * 1000, status))
+
+        await asyncio.gather(*(asgi_get(app, url) for _ in range(concurrency)))  # calentamiento
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+        return self.summarize([ms for ms, _ in samples], [status for _, status in samples], wall)
@@ -0,0 +1,86 @@
+import json
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from products.benchmarks import measure, rollback_after, seed_catalog, seed_user
+from products.models import Cart, CartItem, Order, OrderItem
+from products.services import checkout_cart
+
+SHIPPING = {
+    'payment_method': 'cash',
+    'shipping_address': 'Av. Benchmark 123',
+    'shipping_city': 'Lima',
+    'shipping_postal_code': '15001',
+    'phone': '999999999',
+}
+
+
+def legacy_checkout(user):
+    """Reproduce el checkout anterior (una consulta por línea, sin transacción)"""
+    cart = Cart.objects.get(user=user)
+    subtotal = sum(item.total_price for item in cart.items.all())
+    shipping_cost = Decimal('5.00')
+    order = Order.objects.create(
+        user=user, subtotal=subtotal, shipping_cost=shipping_cost,
+        total=subtotal + shipping_cost, **SHIPPING
+    )
+    for cart_item in cart.items.all():
+        OrderItem.objects.create(
+            order=order,
+            product=cart_item.product,
+            product_title=cart_item.product.title,
+            product_author=cart_item.product.author,
+            product_isbn=cart_item.product.isbn or '',
+            quantity=cart_item.quantity,
+            price=cart_item.product.price,
+            subtotal=cart_item.total_price
+        )
+        cart_item.product.stock -= cart_item.quantity
+        cart_item.product.save()
+    cart.items.all().delete()
+    return order
+
+
+class Command(BaseCommand):
+    help = 'Compara el checkout actual con el anterior para distintos tamaños de carrito'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 100],
+                            help='Cantidad de líneas del carrito a medir')
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Repeticiones por escenario')
+        parser.add_argument('--json', dest='json_path',
+                            help='Escribe los resultados en este archivo JSON')
+
+    def handle(self, *args, **options):
+        results = []
+        with rollback_after():
+            user = seed_user('bench-checkout')
+            cart = Cart.objects.create(user=user)
+            _, products = seed_catalog(products=max(options['lines']), stock=10 ** 6,
+                                       prefix='bench-checkout')
+
+            for lines in options['lines']:
+                def fill_cart(lines=lines):
+                    CartItem.objects.filter(cart=cart).delete()
+                    CartItem.objects.bulk_create([
+                        CartItem(cart=cart, product=product, quantity=2)
+                        for product in products[:lines]
+                    ])
+
+                for name, func in (
+                    ('legacy', lambda: legacy_checkout(user)),
+                    ('bulk', lambda: checkout_cart(user=user, **SHIPPING)),
+                ):
+                    stats = measure(func, repeat=options['repeat'], setup=fill_cart)
+                    results.append({'path': name, 'lines': lines, **stats})
+                    self.stdout.write(
+                        f'{name:<7} líneas={lines:<4} consultas={stats["queries"]:<4} '
+                        f'p50={stats["p50_ms"]:.2f}ms p95={stats["p95_ms"]:.2f}ms'
+                    )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["json_path"]}'))
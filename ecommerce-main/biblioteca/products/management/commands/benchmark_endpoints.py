@@ -0,0 +1,292 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from products.benchmarks import (
+    measure, rollback_after, seed_catalog, seed_orders, seed_user, seed_users
+)
+from products.models import Cart, CartItem, Order, OrderItem
+from products.rankings import rebuild_rankings
+from products.reservations import release_cart_reservations, reserve_stock
+
+DEFAULT_BUDGETS = Path(settings.BASE_DIR) / 'benchmark_budgets.json'
+
+
+class Scenario:
+    """
+    Una petición a medir. `path`, `data` y `setup` reciben el contexto
+    sembrado; cualquier respuesta distinta de `expected` es un error.
+    """
+
+    def __init__(self, name, method, path, data=None, auth=True, setup=None, expected=200):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.auth = auth
+        self.setup = setup
+        self.expected = expected
+
+
+def fill_cart(ctx, lines=10):
+    # Las líneas llevan su reserva, como las que crea la API
+    release_cart_reservations(ctx['cart'])
+    CartItem.objects.filter(cart=ctx['cart']).delete()
+    CartItem.objects.bulk_create([
+        CartItem(cart=ctx['cart'], product=product, quantity=1)
+        for product in ctx['products'][:lines]
+    ])
+    reserve_stock(ctx['cart'], {product.pk: 1 for product in ctx['products'][:lines]})
+
+
+def add_one(ctx):
+    fill_cart(ctx, lines=1)
+    ctx['item'] = CartItem.objects.get(cart=ctx['cart'])
+
+
+def pending_order(ctx):
+    order = Order.objects.create(
+        user=ctx['user'], payment_method='cash', subtotal=10, total=15,
+        shipping_address='Av. Benchmark 123', shipping_city='Lima',
+        shipping_postal_code='15001', phone='999999999',
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, product_title=product.title,
+                  product_author=product.author, quantity=1, price=product.price,
+                  subtotal=product.price)
+        for product in ctx['products'][:10]
+    ])
+    ctx['pending'] = order
+
+
+def next_username(ctx):
+    ctx['registered'] = ctx.get('registered', 0) + 1
+    return f'bench-new-{ctx["registered"]}'
+
+
+SHIPPING = {
+    'payment_method': 'cash', 'shipping_address': 'Av. Benchmark 123',
+    'shipping_city': 'Lima', 'shipping_postal_code': '15001', 'phone': '999999999',
+}
+
+SCENARIOS = [
+    # Catálogo (anónimo)
+    Scenario('products.list', 'get', lambda c: '/api/products/', auth=False),
+    Scenario('products.list_ordered', 'get', lambda c: '/api/products/?ordering=price', auth=False),
+    Scenario('products.list_page_number', 'get', lambda c: '/api/products/?page=2', auth=False),
+    Scenario('products.search', 'get', lambda c: '/api/products/?search=dragón', auth=False),
+    Scenario('products.retrieve', 'get', lambda c: f'/api/products/{c["products"][0].pk}/', auth=False),
+    Scenario('products.featured', 'get', lambda c: '/api/products/featured/', auth=False),
+    Scenario('products.bestsellers', 'get', lambda c: '/api/products/bestsellers/', auth=False),
+    Scenario('products.bestsellers_category', 'get',
+             lambda c: f'/api/products/bestsellers/?category_id={c["categories"][0].pk}', auth=False),
+    Scenario('products.by_category', 'get',
+             lambda c: f'/api/products/by_category/?category_id={c["categories"][0].pk}', auth=False),
+    Scenario('products.partial_update', 'patch', lambda c: f'/api/products/{c["products"][1].pk}/',
+             data=lambda c: {'stock': 500}),
+    Scenario('categories.list', 'get', lambda c: '/api/categories/', auth=False),
+    Scenario('categories.retrieve', 'get', lambda c: f'/api/categories/{c["categories"][0].pk}/', auth=False),
+    Scenario('categories.products', 'get',
+             lambda c: f'/api/categories/{c["categories"][0].pk}/products/', auth=False),
+    Scenario('lista', 'get', lambda c: '/api/lista/', auth=False),
+    Scenario('catalog.changes', 'get', lambda c: '/api/catalog/changes/', auth=False),
+
+    # Catálogo con vistas async (async_views.py)
+    Scenario('async.products.list', 'get', lambda c: '/api/async/products/', auth=False),
+    Scenario('async.products.retrieve', 'get',
+             lambda c: f'/api/async/products/{c["products"][0].pk}/', auth=False),
+    Scenario('async.products.featured', 'get', lambda c: '/api/async/products/featured/', auth=False),
+    Scenario('async.products.by_category', 'get',
+             lambda c: f'/api/async/products/by_category/?category_id={c["categories"][0].pk}',
+             auth=False),
+    Scenario('async.categories.list', 'get', lambda c: '/api/async/categories/', auth=False),
+
+    # Carrito
+    Scenario('cart.my_cart', 'get', lambda c: '/api/cart/my_cart/', setup=fill_cart),
+    Scenario('cart.my_cart_anonymous', 'get', lambda c: '/api/cart/my_cart/', auth=False),
+    Scenario('cart.add_item', 'post', lambda c: '/api/cart/add_item/', setup=fill_cart,
+             data=lambda c: {'product_id': c['products'][-1].pk, 'quantity': 1}),
+    Scenario('cart.update_item', 'patch', lambda c: '/api/cart/update_item/', setup=add_one,
+             data=lambda c: {'item_id': c['item'].pk, 'quantity': 2}),
+    Scenario('cart.remove_item', 'delete', lambda c: '/api/cart/remove_item/', setup=add_one,
+             data=lambda c: {'item_id': c['item'].pk}),
+    Scenario('cart.batch', 'post', lambda c: '/api/cart/batch/', setup=fill_cart,
+             data=lambda c: {'operations': [
+                 {'op': 'add', 'product_id': c['products'][-1].pk, 'quantity': 1},
+                 {'op': 'set', 'product_id': c['products'][0].pk, 'quantity': 3},
+                 {'op': 'remove', 'product_id': c['products'][1].pk},
+             ]}),
+    Scenario('cart.clear', 'delete', lambda c: '/api/cart/clear/', setup=fill_cart),
+
+    # Órdenes
+    Scenario('orders.list', 'get', lambda c: '/api/orders/'),
+    Scenario('orders.retrieve', 'get', lambda c: f'/api/orders/{c["orders"][0].pk}/'),
+    Scenario('orders.history', 'get', lambda c: '/api/orders/history/'),
+    Scenario('orders.history_filtered', 'get', lambda c: '/api/orders/history/?status=pending'),
+    Scenario('orders.statistics', 'get', lambda c: '/api/orders/statistics/'),
+    Scenario('orders.create_order', 'post', lambda c: '/api/orders/create_order/',
+             setup=fill_cart, data=lambda c: SHIPPING, expected=201),
+    Scenario('orders.cancel', 'patch', lambda c: f'/api/orders/{c["pending"].pk}/cancel/',
+             setup=pending_order),
+
+    # Autenticación
+    Scenario('auth.register', 'post', lambda c: '/api/auth/register/', auth=False,
+             data=lambda c: {'username': next_username(c), 'email': f'{c["registered"]}@bench.example.com',
+                             'password': 'Bench-pass-123', 'password2': 'Bench-pass-123'},
+             expected=201),
+    Scenario('auth.login', 'post', lambda c: '/api/auth/login/', auth=False,
+             data=lambda c: {'username': c['user'].username, 'password': 'bench-password'}),
+    Scenario('auth.token_refresh', 'post', lambda c: '/api/auth/token/refresh/', auth=False,
+             data=lambda c: {'refresh': str(RefreshToken.for_user(c['user']))}),
+    Scenario('auth.profile', 'get', lambda c: '/api/auth/profile/'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide latencia (p50/p95) y consultas SQL de cada endpoint de products/urls.py '
+        'a distintos tamaños de datos y compara con los presupuestos guardados'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000],
+                            help='Cantidad de productos por escenario (usuarios = productos/10)')
+        parser.add_argument('--orders-per-user', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--only', action='append',
+                            help='Medir solo endpoints cuyo nombre empiece así (repetible)')
+        parser.add_argument('--output', default='benchmark_results.json',
+                            help='Archivo JSON con los resultados')
+        parser.add_argument('--budgets', default=str(DEFAULT_BUDGETS),
+                            help='JSON {endpoint: máximo de consultas}')
+        parser.add_argument('--baseline',
+                            help='Resultados anteriores para detectar regresiones de latencia')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Regresión de p95 tolerada respecto al baseline (0.25 = +25%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Diferencias de p95 menores a esto se consideran ruido')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Mide con la caché del catálogo activa (por defecto se desactiva)')
+
+    def handle(self, *args, **options):
+        scenarios = [
+            s for s in SCENARIOS
+            if not options['only'] or any(s.name.startswith(prefix) for prefix in options['only'])
+        ]
+        overrides = {'ALLOWED_HOSTS': ['*']}
+        if not options['with_cache']:
+            overrides['CATALOG_CACHE_TIMEOUT'] = 0
+
+        results = []
+        with override_settings(**overrides):
+            for size in options['sizes']:
+                cache.clear()
+                self.stdout.write(self.style.MIGRATE_HEADING(f'Tamaño: {size} productos'))
+                with rollback_after():
+                    ctx = self.seed(size, options['orders_per_user'])
+                    for scenario in scenarios:
+                        stats = self.run_scenario(scenario, ctx, options['repeat'])
+                        results.append({'endpoint': scenario.name, 'size': size, **stats})
+                        self.stdout.write(
+                            f'  {scenario.name:<28} {stats["status"]:<4} consultas={stats["queries"]:<4} '
+                            f'p50={stats["p50_ms"]:>8.2f}ms p95={stats["p95_ms"]:>8.2f}ms'
+                        )
+
+        with open(options['output'], 'w') as fh:
+            json.dump(results, fh, indent=2)
+        self.stdout.write(f'Resultados guardados en {options["output"]}')
+
+        failures = self.check_budgets(results, options) + self.check_baseline(results, options)
+        for failure in failures:
+            self.stderr.write(self.style.ERROR(failure))
+        if failures:
+            raise CommandError(f'{len(failures)} endpoint(s) fuera de presupuesto')
+        self.stdout.write(self.style.SUCCESS('Todos los endpoints dentro de presupuesto'))
+
+    def seed(self, size, orders_per_user):
+        categories, products = seed_catalog(products=size, categories=max(size // 100, 5),
+                                            prefix='bench-endpoints')
+        users = seed_users(max(size // 10, 1), prefix='bench-endpoints')
+        user = seed_user('bench-endpoints-main')
+        orders = seed_orders([user] + users, products, orders_per_user=orders_per_user,
+                             prefix='bench-endpoints')
+        # seed_orders usa bulk_create: las ventas se cargan a los rankings aquí
+        rebuild_rankings()
+        cart = Cart.objects.create(user=user)
+        return {
+            'categories': categories, 'products': products, 'user': user, 'cart': cart,
+            'orders': [o for o in orders if o.user_id == user.pk],
+            'token': str(RefreshToken.for_user(user).access_token),
+        }
+
+    def run_scenario(self, scenario, ctx, repeat):
+        client = Client()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {ctx["token"]}'} if scenario.auth else {}
+        status = []
+
+        def request():
+            data = scenario.data(ctx) if scenario.data else None
+            kwargs = {'content_type': 'application/json'} if scenario.method != 'get' else {}
+            if data is not None:
+                kwargs['data'] = json.dumps(data) if scenario.method != 'get' else data
+            response = getattr(client, scenario.method)(scenario.path(ctx), **kwargs, **headers)
+            status.append(response.status_code)
+
+        setup = (lambda: scenario.setup(ctx)) if scenario.setup else None
+        # Una petición de calentamiento (sesión, cachés de Django, etc.)
+        if setup:
+            setup()
+        request()
+        stats = measure(request, repeat=repeat, setup=setup)
+        # El primer estado inesperado (p. ej. un 400 por un fixture roto), si lo hubo
+        stats['status'] = next((code for code in status if code != scenario.expected), scenario.expected)
+        stats['expected_status'] = scenario.expected
+        return stats
+
+    def check_budgets(self, results, options):
+        path = Path(options['budgets'])
+        if not path.exists():
+            self.stdout.write(f'Sin presupuestos de consultas ({path})')
+            return []
+        budgets = json.loads(path.read_text())
+        failures = []
+        for result in results:
+            budget = budgets.get(result['endpoint'])
+            if budget is None:
+                # Un endpoint nuevo sin presupuesto no debe pasar el control sin que nadie lo mire
+                failures.append(f'{result["endpoint"]}: sin presupuesto en {path.name}')
+            elif result['queries'] > budget:
+                failures.append(
+                    f'{result["endpoint"]} (tamaño {result["size"]}): {result["queries"]} consultas, '
+                    f'presupuesto {budget}'
+                )
+            if result['status'] != result['expected_status']:
+                failures.append(
+                    f'{result["endpoint"]} (tamaño {result["size"]}): HTTP {result["status"]}, '
+                    f'se esperaba {result["expected_status"]}'
+                )
+        return failures
+
+    def check_baseline(self, results, options):
+        if not options['baseline']:
+            return []
+        baseline = {
+            (r['endpoint'], r['size']): r for r in json.loads(Path(options['baseline']).read_text())
+        }
+        failures = []
+        for result in results:
+            previous = baseline.get((result['endpoint'], result['size']))
+            if previous is None:
+                continue
+            limit = previous['p95_ms'] * (1 + options['threshold'])
+            if result['p95_ms'] > limit and result['p95_ms'] - previous['p95_ms'] > options['min_delta_ms']:
+                failures.append(
+                    f'{result["endpoint"]} (tamaño {result["size"]}): p95 {result["p95_ms"]:.2f}ms, '
+                    f'baseline {previous["p95_ms"]:.2f}ms (+{options["threshold"]:.0%} máx.)'
+                )
+        return failures
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.test import override_settings
+
+from products.benchmarks import percentile, seed_catalog, seed_users
+from products.models import Cart, CartItem, Category, Product
+from products.reservations import InsufficientStock, reserve_stock
+from products.services import checkout_cart
+
+PREFIX = 'bench-reservations'
+
+SHIPPING = {
+    'payment_method': 'cash',
+    'shipping_address': 'Av. Benchmark 123',
+    'shipping_city': 'Lima',
+    'shipping_postal_code': '15001',
+    'phone': '999999999',
+}
+
+
+def add_to_cart(user, product):
+    """Lo mismo que CartViewSet.add_item: validar, reservar y guardar la línea"""
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        product = Product.objects.get(pk=product.pk)
+        if product.stock < 1:
+            return False
+        reserve_stock(cart, {product.pk: 1})
+        CartItem.objects.create(cart=cart, product=product, quantity=1)
+    return True
+
+
+def with_retries(func, stats, lock, attempts=50):
+    """SQLite responde 'database is locked' cuando dos transacciones escriben a la vez"""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except OperationalError as exc:
+            if 'locked' not in str(exc) or attempt == attempts - 1:
+                raise
+            with lock:
+                stats['retries'] += 1
+            time.sleep(0.005 * (attempt + 1))
+
+
+class Command(BaseCommand):
+    help = (
+        'Simula un lanzamiento: muchos compradores concurrentes agregan el mismo producto '
+        'y pagan. Compara sin reservas y con reservas de stock'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50)
+        parser.add_argument('--stock', type=int, default=10)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--json', dest='json_path',
+                            help='Escribe los resultados en este archivo JSON')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite serializa todas las escrituras: los tiempos no representan un servidor real'
+            ))
+        results = []
+        for mode, ttl in (('sin reservas', 0), ('con reservas', 900)):
+            with override_settings(STOCK_RESERVATION_TTL=ttl):
+                result = self.run_scenario(options)
+            result['mode'] = mode
+            results.append(result)
+            self.stdout.write(
+                f'{mode:<14} agregados={result["added"]:<4} vendidos={result["sold"]:<4} '
+                f'rechazados en checkout={result["rejected_at_checkout"]:<4} '
+                f'sobreventa={result["oversold"]:<3} errores={result["errors"]:<3} reintentos={result["retries"]:<4} '
+                f'add p95={result["add_p95_ms"]:.1f}ms checkout p95={result["checkout_p95_ms"]:.1f}ms '
+                f'total={result["wall_s"]:.2f}s'
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+    def run_scenario(self, options):
+        # Los hilos usan sus propias conexiones: los datos se confirman y se borran al final
+        _, products = seed_catalog(products=1, categories=1, stock=options['stock'], prefix=PREFIX)
+        product = products[0]
+        buyers = seed_users(options['buyers'], prefix=PREFIX)
+        lock = threading.Lock()
+        stats = {'added': 0, 'sold': 0, 'rejected_at_checkout': 0, 'errors': 0, 'retries': 0}
+        timings = {'add': [], 'checkout': []}
+
+        def buyer(user):
+            try:
+                start = time.perf_counter()
+                try:
+                    added = with_retries(lambda: add_to_cart(user, product), stats, lock)
+                except InsufficientStock:
+                    added = False
+                add_ms = (time.perf_counter() - start) * 1000
+                sold = rejected = False
+                checkout_ms = None
+                if added:
+                    start = time.perf_counter()
+                    try:
+                        with_retries(lambda: checkout_cart(user=user, **SHIPPING), stats, lock)
+                        sold = True
+                    except InsufficientStock:
+                        rejected = True
+                    checkout_ms = (time.perf_counter() - start) * 1000
+                with lock:
+                    stats['added'] += added
+                    stats['sold'] += sold
+                    stats['rejected_at_checkout'] += rejected
+                    timings['add'].append(add_ms)
+                    if checkout_ms is not None:
+                        timings['checkout'].append(checkout_ms)
+            except Exception as exc:
+                with lock:
+                    stats['errors'] += 1
+                self.stderr.write(f'{user.username}: {exc}')
+            finally:
+                connection.close()
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                list(pool.map(buyer, buyers))
+            wall = time.perf_counter() - start
+            product.refresh_from_db()
+            return {
+                **stats,
+                'oversold': max(stats['sold'] - options['stock'], 0),
+                'final_stock': product.stock,
+                'add_p95_ms': round(percentile(timings['add'], 95), 3),
+                'checkout_p95_ms': round(percentile(timings['checkout'], 95), 3),
+                'wall_s': round(wall, 3),
+            }
+        finally:
+            User.objects.filter(username__startswith=f'{PREFIX}-user-').delete()
+            Category.objects.filter(slug__startswith=f'{PREFIX}-').delete()
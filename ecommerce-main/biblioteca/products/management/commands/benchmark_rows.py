@@ -0,0 +1,87 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from products.benchmarks import measure, rollback_after, seed_catalog, seed_orders, seed_user
+from products.rankings import rebuild_rankings
+from products.renderers import FastJSONRenderer
+
+# (nombre, ruta) de los listados de rows.py; la ruta recibe el contexto sembrado
+SCENARIOS = [
+    ('products.list', lambda c: '/api/products/?page_size=100'),
+    ('products.list_full', lambda c: (
+        '/api/products/?page_size=100&fields=id,category_name,title,author,isbn,'
+        'description,price,stock,publisher,language,rating,created_at')),
+    ('products.list_fields', lambda c: '/api/products/?page_size=100&fields=id,title,price'),
+    ('products.by_category', lambda c: f'/api/products/by_category/?category_id={c["category"].pk}'),
+    ('products.featured', lambda c: '/api/products/featured/'),
+    ('products.bestsellers', lambda c: '/api/products/bestsellers/'),
+    ('orders.history', lambda c: '/api/orders/history/?page_size=100'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara los listados con serializers contra los de rows.py (values_list + orjson): '
+        'latencia, consultas y que los bytes sean idénticos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=200, help='Órdenes del usuario del historial')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--json', dest='json_path',
+                            help='Escribe los resultados en este archivo JSON')
+
+    def handle(self, *args, **options):
+        results, mismatches = [], []
+        with override_settings(ALLOWED_HOSTS=['*'], CATALOG_CACHE_TIMEOUT=0), rollback_after():
+            cache.clear()
+            ctx = self.seed(options)
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(ctx["user"]).access_token}')
+            for name, path in SCENARIOS:
+                path = path(ctx)
+                responses = {}
+                for mode, fast in [('serializer', False), ('rows', True)]:
+                    with override_settings(FAST_ROWS=fast):
+                        def call(mode=mode):
+                            responses[mode] = client.get(path)
+                        stats = measure(call, repeat=options['repeat'])
+                    response = responses[mode]
+                    if response.status_code != 200:
+                        raise CommandError(f'{name}: {response.status_code} {response.content[:200]}')
+                    results.append({'endpoint': name, 'path': mode, 'bytes': len(response.content), **stats})
+                    self.report(name, mode, stats)
+                if responses['serializer'].content != responses['rows'].content:
+                    mismatches.append(name)
+
+                # Solo el renderizado de la misma respuesta
+                data = responses['rows'].data
+                for mode, renderer in [('json', JSONRenderer()), ('orjson', FastJSONRenderer())]:
+                    stats = measure(lambda renderer=renderer: renderer.render(data), repeat=options['repeat'])
+                    results.append({'endpoint': name, 'path': f'render_{mode}', **stats})
+                    self.report(name, f'render_{mode}', stats)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+        if mismatches:
+            raise CommandError(f'Respuestas distintas con rows.py: {", ".join(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Mismos bytes en todos los listados'))
+
+    def seed(self, options):
+        categories, products = seed_catalog(products=options['products'], categories=5, prefix='bench-rows')
+        user = seed_user('bench-rows')
+        seed_orders([user], products, orders_per_user=options['orders'], prefix='bench-rows')
+        rebuild_rankings()
+        return {'user': user, 'category': categories[0]}
+
+    def report(self, name, mode, stats):
+        self.stdout.write(
+            f'{name:<22} {mode:<14} consultas={stats["queries"]:<3} '
+            f'p50={stats["p50_ms"]:>8.2f}ms p95={stats["p95_ms"]:>8.2f}ms'
+        )
@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from products.benchmarks import measure, rollback_after, seed_catalog
+from products.views import ProductViewSet
+
+DEFAULT_QUERIES = ['dragón', 'espada sombra', 'acad', 'pirata vol', 'inexistente']
+
+
+class Command(BaseCommand):
+    help = 'Compara la búsqueda de texto completo con los icontains de SearchFilter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000,
+                            help='Cantidad de productos a sembrar')
+        parser.add_argument('--query', dest='queries', action='append',
+                            help='Términos a buscar (repetible)')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--json', dest='json_path',
+                            help='Escribe los resultados en este archivo JSON')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+        view = ProductViewSet.as_view({'get': 'list'})
+        results = []
+
+        # Sin la caché del catálogo: se mide la búsqueda, no la lectura de la caché
+        with override_settings(CATALOG_CACHE_TIMEOUT=0), rollback_after():
+            self.stdout.write(f'Sembrando {options["products"]} productos...')
+            seed_catalog(products=options['products'], categories=20, prefix='bench-search')
+
+            for term in options['queries'] or DEFAULT_QUERIES:
+                for backend in ('icontains', 'auto'):
+                    def search(term=term):
+                        # Paginación por número de página: la única que informa `count`
+                        response = view(factory.get('/api/products/', {'search': term, 'pagination': 'page'}))
+                        response.render()
+                        return response
+
+                    with override_settings(SEARCH_BACKEND=backend):
+                        count = search().data['count']
+                        stats = measure(search, repeat=options['repeat'])
+                    results.append({'query': term, 'backend': backend, 'results': count, **stats})
+                    self.stdout.write(
+                        f'{backend:<10} {term!r:<18} resultados={count:<7} '
+                        f'p50={stats["p50_ms"]:.2f}ms p95={stats["p95_ms"]:.2f}ms'
+                    )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["json_path"]}'))
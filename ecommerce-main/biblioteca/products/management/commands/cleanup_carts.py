@@ -0,0 +1,114 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from products.models import Cart, CartItem, StockReservation
+from products.reservations import release_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        'Elimina sesiones vencidas, carritos anónimos huérfanos o abandonados y vacía '
+        'carritos de usuario inactivos, en lotes acotados (pensado para cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Filas eliminadas por transacción')
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help='Pausa en segundos entre lotes para no retener locks')
+        parser.add_argument('--anonymous-days', type=int,
+                            default=settings.ANONYMOUS_CART_RETENTION_DAYS,
+                            help='Días sin cambios tras los que se elimina un carrito anónimo')
+        parser.add_argument('--user-days', type=int,
+                            default=settings.USER_CART_RETENTION_DAYS,
+                            help='Días sin cambios tras los que se vacía un carrito de usuario (0 = nunca)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Solo cuenta lo que se eliminaría')
+
+    def handle(self, *args, **options):
+        self.options = options
+        now = timezone.now()
+
+        sessions = self.purge(Session.objects.filter(expire_date__lt=now), 'session_key')
+
+        # Anónimos cuya sesión ya no existe (vencida, borrada o nunca guardada)
+        orphans = self.purge_carts(Cart.objects.filter(user__isnull=True).exclude(
+            Exists(Session.objects.filter(session_key=OuterRef('session_key')))
+        ))
+
+        abandoned = 0
+        if options['anonymous_days']:
+            cutoff = now - timedelta(days=options['anonymous_days'])
+            # Agregar o cambiar items no toca Cart.updated_at: mirar también los items
+            stale = Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff)
+            abandoned = self.purge_carts(stale.exclude(
+                Exists(CartItem.objects.filter(cart=OuterRef('pk'), updated_at__gte=cutoff))
+            ))
+
+        emptied = 0
+        if options['user_days']:
+            # El Cart del usuario se conserva (es uno por usuario); solo se vacía
+            cutoff = now - timedelta(days=options['user_days'])
+            stale = CartItem.objects.filter(cart__user__isnull=False, cart__updated_at__lt=cutoff)
+            emptied = self.purge_items(stale.exclude(
+                Exists(CartItem.objects.filter(cart=OuterRef('cart'), updated_at__gte=cutoff))
+            ))
+
+        prefix = '[dry-run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Sesiones vencidas: {sessions} | carritos huérfanos: {orphans} | '
+            f'carritos anónimos abandonados: {abandoned} | items de carritos de usuario: {emptied}'
+        ))
+
+    def batches(self, queryset, field):
+        """Ids a eliminar en lotes; cada lote se vuelve a consultar tras borrar el anterior"""
+        while True:
+            ids = list(queryset.order_by(field).values_list(field, flat=True)[:self.options['batch_size']])
+            if not ids:
+                return
+            yield ids
+            time.sleep(self.options['sleep'])
+
+    def purge(self, queryset, field):
+        if self.options['dry_run']:
+            return queryset.count()
+        removed = 0
+        for ids in self.batches(queryset, field):
+            removed += queryset.model.objects.filter(**{f'{field}__in': ids}).delete()[0]
+        return removed
+
+    def purge_items(self, queryset):
+        """Vacía carritos enteros: sus reservas se liberan junto con los items"""
+        if self.options['dry_run']:
+            return queryset.count()
+        removed = 0
+        for ids in self.batches(queryset, 'pk'):
+            with transaction.atomic():
+                carts = CartItem.objects.filter(pk__in=ids).values('cart_id')
+                release_reservations(StockReservation.objects.filter(cart_id__in=carts))
+                removed += CartItem.objects.filter(pk__in=ids).delete()[0]
+        return removed
+
+    def purge_carts(self, queryset):
+        if self.options['dry_run']:
+            return queryset.count()
+        removed = 0
+        for ids in self.batches(queryset, 'pk'):
+            with transaction.atomic():
+                # Devolver el stock apartado en bloque y borrar las filas que
+                # dependen del Cart con un DELETE directo cada una
+                release_reservations(StockReservation.objects.filter(cart_id__in=ids))
+                CartItem.objects.filter(cart_id__in=ids).delete()
+                # _raw_delete: sin dependientes ya no hace falta el Collector, que
+                # cargaría cada Cart para enviar su pre_delete (una consulta por
+                # carrito en release_deleted_cart_reservations)
+                carts = Cart.objects.filter(pk__in=ids)
+                removed += carts._raw_delete(carts.db)
+        return removed
@@ -0,0 +1,223 @@
+import re
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from products.benchmarks import rollback_after, seed_catalog, seed_orders, seed_user, seed_users
+from products.changes import DEFAULT_LIMIT, STREAMS, stream_query
+from products.models import Cart, Product, ProductRanking
+from products.pagination import KeysetPagination
+from products.rankings import ranking, rebuild_rankings
+from products.views import CategoryViewSet, OrderViewSet, ProductViewSet
+
+# Líneas del plan que indican un problema, por motor: (patrón, etiqueta)
+PROBLEMS = {
+    'sqlite': [
+        # "SCAN tabla" sin índice; las tablas virtuales (FTS5) y los índices cubrientes no cuentan
+        (re.compile(r'\bSCAN (?!.*\b(?:USING (?:COVERING )?INDEX|VIRTUAL TABLE)\b)'), 'escaneo completo'),
+        (re.compile(r'USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY)'), 'ordenamiento temporal'),
+    ],
+    'postgresql': [
+        (re.compile(r'\bSeq Scan on\b'), 'escaneo completo'),
+        # El nodo Sort, no sus detalles ("Sort Key:", "Sort Method:") ni los de Merge Append
+        (re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort(?:\s+\(|$)'), 'ordenamiento temporal'),
+    ],
+}
+
+
+class Variant:
+    """
+    Una consulta a explicar: `build(ctx)` devuelve el queryset (ya recortado).
+    `expected` son problemas inevitables que se muestran pero no cuentan.
+    """
+
+    def __init__(self, name, build, expected=()):
+        self.name = name
+        self.build = build
+        self.expected = set(expected)
+
+
+def viewset_page(viewset_class, path, user=None, refine=None):
+    """
+    La página que ejecuta el listado del viewset para `path`: get_queryset,
+    `refine` (lo que agrega la acción, p. ej. history), filtros (?search=,
+    ?ordering=, filterset_fields) y paginación.
+    """
+    request = Request(APIRequestFactory().get(path))
+    request.user = user or AnonymousUser()
+    view = viewset_class(request=request, action='list', format_kwarg=None, args=(), kwargs={})
+    queryset = view.get_queryset()
+    if refine is not None:
+        queryset = refine(queryset)
+    queryset = view.filter_queryset(queryset)
+    page = view.paginator.prepare_page(queryset, request)
+    if page is None:
+        # Paginación por número de página: la página pedida con OFFSET
+        return queryset[:view.paginator.delegate.get_page_size(request)]
+    return page
+
+
+def first_cursor(viewset_class, path):
+    """Cursor de la segunda página, para explicar el WHERE keyset"""
+    request = Request(APIRequestFactory().get(path))
+    paginator = viewset_class.pagination_class()
+    paginator.base_url = path
+    paginator.paginate_queryset(viewset_class.queryset, request)
+    link = paginator.get_next_link()
+    return parse_qs(urlparse(link).query)['cursor'][0] if link else ''
+
+
+def product_variants():
+    active = ProductViewSet.queryset
+    return [
+        Variant('products.list', lambda c: viewset_page(ProductViewSet, '/api/products/')),
+        Variant('products.list_cursor', lambda c: viewset_page(
+            ProductViewSet, f'/api/products/?cursor={c["cursor"]}')),
+        Variant('products.list_page_number', lambda c: viewset_page(ProductViewSet, '/api/products/?page=2')),
+        *[
+            Variant(f'products.list_ordering_{field.lstrip("-")}', lambda c, field=field: viewset_page(
+                ProductViewSet, f'/api/products/?ordering={field}'))
+            for field in ('price', '-rating', 'title')
+        ],
+        *[
+            Variant(f'products.list_{param}', lambda c, param=param, attr=attr: viewset_page(
+                ProductViewSet, f'/api/products/?{urlencode({param: getattr(c["product"], attr)})}'))
+            for param, attr in [('category', 'category_id'), ('author', 'author'),
+                                ('publisher', 'publisher'), ('language', 'language')]
+        ],
+        # El orden por relevancia se calcula sobre las filas que coinciden: no hay índice posible
+        Variant('products.search', lambda c: viewset_page(ProductViewSet, '/api/products/?search=libro'),
+                expected=['ordenamiento temporal']),
+        # get() descarta el orden por defecto
+        Variant('products.retrieve', lambda c: active.filter(pk=c['product'].pk).order_by()),
+        # Las mismas consultas que las acciones de ProductViewSet
+        Variant('products.featured', lambda c: ranking(ProductRanking.FEATURED)),
+        Variant('products.bestsellers', lambda c: ranking(ProductRanking.BESTSELLERS)),
+        Variant('products.bestsellers_category', lambda c: ranking(
+            ProductRanking.BESTSELLERS, c['product'].category_id)),
+        Variant('products.by_category', lambda c: active.filter(category_id=c['product'].category_id)),
+    ]
+
+
+def change_variants():
+    horizon = timezone.now()
+    return [
+        # Una página del feed: cada flujo desde el principio y desde una posición
+        *[
+            Variant(f'changes.{model._meta.model_name}', lambda c, model=model, field=field, columns=columns:
+                    stream_query(model, field, columns, None, horizon)[:DEFAULT_LIMIT + 1])
+            for _, model, field, columns in STREAMS
+        ],
+        *[
+            Variant(f'changes.{model._meta.model_name}_cursor', lambda c, model=model, field=field, columns=columns:
+                    stream_query(model, field, columns, (horizon, 1), horizon)[:DEFAULT_LIMIT + 1])
+            for _, model, field, columns in STREAMS
+        ],
+    ]
+
+
+def category_variants():
+    return [
+        Variant('categories.list', lambda c: viewset_page(CategoryViewSet, '/api/categories/')),
+        Variant('categories.search', lambda c: viewset_page(CategoryViewSet, '/api/categories/?search=libro'),
+                expected=['ordenamiento temporal']),
+        Variant('categories.products', lambda c: CategoryViewSet().get_active_products(
+            c['product'].category)[:KeysetPagination.page_size + 1]),
+    ]
+
+
+def order_variants():
+    return [
+        Variant('orders.list', lambda c: viewset_page(OrderViewSet, '/api/orders/', user=c['user'])),
+        Variant('orders.history_status', lambda c: viewset_page(
+            OrderViewSet, '/api/orders/history/', user=c['user'],
+            refine=lambda qs: qs.order_by('-created_at').filter(status='pending'))),
+        Variant('orders.statistics_last_order', lambda c: c['user'].orders.order_by('-created_at')[:1]),
+        Variant('cart.my_cart', lambda c: Cart.objects.with_totals().filter(user=c['user'])),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta EXPLAIN sobre las consultas de los viewsets (listados, filtros, orden, '
+        'búsqueda, paginación) y marca escaneos completos y ordenamientos temporales'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Sembrar N productos (y órdenes) en una transacción que se revierte '
+                                 'y ejecutar ANALYZE antes de explicar')
+        parser.add_argument('--only', action='append',
+                            help='Explicar solo las variantes cuyo nombre empiece así (repetible)')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Mostrar el plan completo de cada consulta')
+        parser.add_argument('--fail-on-issues', action='store_true',
+                            help='Terminar con error si alguna consulta tiene problemas (para CI)')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in PROBLEMS:
+            raise CommandError(f'Motor no soportado: {connection.vendor}')
+
+        with rollback_after():
+            if options['seed']:
+                self.seed(options['seed'])
+            ctx = self.context()
+            issues = self.report(ctx, options)
+
+        if issues:
+            message = f'{issues} consulta(s) con escaneos completos u ordenamientos temporales'
+            if options['fail_on_issues']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('Todas las consultas usan índices'))
+
+    def seed(self, size):
+        _, products = seed_catalog(products=size, categories=max(size // 100, 5), prefix='explain')
+        # Varios usuarios: con uno solo el planificador prefiere recorrer auth_user
+        users = [seed_user('explain-user')] + seed_users(max(size // 1000, 5), prefix='explain')
+        seed_orders(users, products, orders_per_user=max(size // 100, 5), prefix='explain')
+        user = users[0]
+        rebuild_rankings()
+        Cart.objects.create(user=user)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def context(self):
+        product = Product.objects.filter(is_active=True).select_related('category').first()
+        user = User.objects.filter(orders__isnull=False).first() or User.objects.first()
+        if product is None or user is None:
+            raise CommandError('No hay productos activos o usuarios: usar --seed N')
+        return {'product': product, 'user': user, 'cursor': first_cursor(ProductViewSet, '/api/products/')}
+
+    def report(self, ctx, options):
+        variants = product_variants() + category_variants() + order_variants() + change_variants()
+        if options['only']:
+            variants = [v for v in variants if any(v.name.startswith(p) for p in options['only'])]
+        issues = 0
+        for variant in variants:
+            plan = variant.build(ctx).explain()
+            found = sorted({
+                label
+                for line in plan.splitlines()
+                for pattern, label in PROBLEMS[connection.vendor]
+                if pattern.search(line)
+            })
+            unexpected = [label for label in found if label not in variant.expected]
+            issues += bool(unexpected)
+            if unexpected:
+                status = self.style.ERROR(', '.join(unexpected))
+            elif found:
+                status = self.style.WARNING(f'{", ".join(found)} (esperado)')
+            else:
+                status = self.style.SUCCESS('ok')
+            self.stdout.write(f'{variant.name:<34} {status}')
+            if unexpected or options['verbose_plans']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+        return issues
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products.pagination import KeysetPagination
+from products.snapshots import brotli, export_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta el catálogo activo como páginas JSON estáticas (y .gz/.br) con un manifiesto; '
+        'solo reescribe las páginas que cambiaron desde la exportación anterior'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.CATALOG_SNAPSHOT_DIR,
+                            help='Directorio del snapshot (CATALOG_SNAPSHOT_DIR)')
+        parser.add_argument('--base-url', default=settings.CATALOG_SNAPSHOT_URL,
+                            help='URL desde la que se sirve el directorio (CATALOG_SNAPSHOT_URL)')
+        parser.add_argument('--page-size', type=int, default=KeysetPagination.page_size)
+        parser.add_argument('--force', action='store_true',
+                            help='Reescribir todas las páginas aunque no hayan cambiado')
+
+    def handle(self, *args, **options):
+        if brotli is None:
+            self.stderr.write(self.style.WARNING('Sin el paquete Brotli: solo se generan archivos .gz'))
+        written, unchanged, removed = export_snapshot(
+            options['output'], options['page_size'], options['base_url'], force=options['force']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Snapshot en {options["output"]}: {written} páginas escritas, '
+            f'{unchanged} sin cambios, {removed} borradas'
+        ))
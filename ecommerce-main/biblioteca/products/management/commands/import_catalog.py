@@ -0,0 +1,277 @@
+import csv
+import json
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import URLValidator
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from products.cache import bump_catalog_version
+from products.models import Category, Product
+from products.rankings import refresh_featured
+
+# Columnas que se actualizan cuando el ISBN ya existe (created_at se conserva)
+UPDATE_FIELDS = [
+    'category', 'title', 'author', 'description', 'price', 'stock', 'image_url',
+    'publisher', 'publication_date', 'pages', 'language', 'rating', 'is_active', 'updated_at',
+]
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as fh:
+        # El número de línea sirve para los mensajes de error (la cabecera es la 1)
+        for line_number, row in enumerate(csv.DictReader(fh), start=2):
+            yield line_number, row
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as fh:
+        for line_number, line in enumerate(fh, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield line_number, RowError(f'JSON inválido: {exc}')
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def _text(row, field, required=False, max_length=None):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f'falta {field}')
+    if max_length and len(value) > max_length:
+        raise RowError(f'{field} supera {max_length} caracteres')
+    return value
+
+
+def _optional(row, field, cast):
+    value = row.get(field)
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return cast(str(value).strip())
+    except (ValueError, InvalidOperation):
+        raise RowError(f'{field} inválido: {value!r}')
+
+
+def parse_row(row):
+    """Convierte una fila del archivo en un dict de campos de Product (sin categoría)"""
+    if isinstance(row, RowError):
+        raise row
+    price = _optional(row, 'price', Decimal)
+    if price is None or price < 0:
+        raise RowError('price es obligatorio y no puede ser negativo')
+    rating = _optional(row, 'rating', Decimal) or Decimal('0')
+    if not Decimal('0') <= rating <= Decimal('5'):
+        raise RowError('rating debe estar entre 0 y 5')
+    stock = _optional(row, 'stock', int) or 0
+    if stock < 0:
+        raise RowError('stock no puede ser negativo')
+    # Se valida todo lo que la base rechazaría: un error en el bulk_create
+    # abortaría el lote entero en lugar de informar la línea
+    pages = _optional(row, 'pages', int)
+    if pages is not None and pages < 0:
+        raise RowError('pages no puede ser negativo')
+    image_url = _text(row, 'image_url', max_length=200) or None
+    if image_url is not None:
+        try:
+            URLValidator()(image_url)
+        except ValidationError:
+            raise RowError(f'image_url inválida: {image_url!r}')
+    is_active = row.get('is_active', True)
+    if isinstance(is_active, str):
+        is_active = is_active.strip().lower() not in ('0', 'false', 'no', '')
+
+    return {
+        'isbn': _text(row, 'isbn', required=True, max_length=13),
+        'category_slug': _text(row, 'category', required=True, max_length=50),
+        'category_name': _text(row, 'category_name', max_length=100),
+        'title': _text(row, 'title', required=True, max_length=200),
+        'author': _text(row, 'author', required=True, max_length=200),
+        'description': _text(row, 'description'),
+        'price': price,
+        'stock': stock,
+        'image_url': image_url,
+        'publisher': _text(row, 'publisher', max_length=200),
+        'publication_date': _optional(row, 'publication_date', date.fromisoformat),
+        'pages': pages,
+        'language': _text(row, 'language', max_length=50) or 'Español',
+        'rating': rating,
+        'is_active': bool(is_active),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Importa productos desde CSV o JSONL haciendo upsert por ISBN en lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo .csv o .jsonl')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Formato del archivo (por defecto según la extensión)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--create-categories', action='store_true',
+                            help='Crear las categorías cuyo slug no exista')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Valida y cuenta altas/actualizaciones sin escribir')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continúa desde el último lote confirmado')
+        parser.add_argument('--max-errors', type=int, default=100,
+                            help='Aborta después de esta cantidad de filas inválidas')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'No existe el archivo {path}')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError('Formato no soportado: use --format csv o --format jsonl')
+
+        self.options = options
+        self.dry_run = options['dry_run']
+        self.categories = {}
+        self.stats = {'read': 0, 'created': 0, 'updated': 0, 'errors': 0, 'skipped': 0}
+
+        # El checkpoint guarda cuántas filas ya quedaron confirmadas
+        checkpoint = path.with_name(path.name + '.checkpoint')
+        skip = 0
+        if options['resume'] and checkpoint.exists():
+            skip = json.loads(checkpoint.read_text())['rows']
+            self.stdout.write(f'Reanudando después de {skip} filas')
+
+        start = time.perf_counter()
+        batch = []
+        rows_done = 0
+        for line_number, row in READERS[file_format](path):
+            rows_done += 1
+            if rows_done <= skip:
+                self.stats['skipped'] += 1
+                continue
+            self.stats['read'] += 1
+            try:
+                batch.append((line_number, parse_row(row)))
+            except RowError as exc:
+                self.error(line_number, exc)
+            if len(batch) >= options['batch_size']:
+                self.flush(batch)
+                batch = []
+                self.save_checkpoint(checkpoint, rows_done)
+                self.progress(start)
+        if batch:
+            self.flush(batch)
+        self.save_checkpoint(checkpoint, rows_done)
+
+        if not self.dry_run:
+            # bulk_create no dispara señales: recalcular destacados e invalidar la caché a mano
+            refresh_featured()
+            bump_catalog_version()
+            checkpoint.unlink(missing_ok=True)
+
+        elapsed = time.perf_counter() - start
+        rate = self.stats['read'] / elapsed if elapsed else 0
+        prefix = '[dry-run] ' if self.dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Filas leídas: {self.stats["read"]} | nuevas: {self.stats["created"]} | '
+            f'actualizadas: {self.stats["updated"]} | con error: {self.stats["errors"]} | '
+            f'omitidas (resume): {self.stats["skipped"]} | {elapsed:.1f}s ({rate:,.0f} filas/s)'
+        ))
+
+    # ----- lotes -----
+
+    def flush(self, batch):
+        # Si el mismo ISBN aparece dos veces en el lote gana la última fila
+        by_isbn = {}
+        for line_number, data in batch:
+            by_isbn[data['isbn']] = (line_number, data)
+
+        categories = self.resolve_categories({data['category_slug']: data for _, data in by_isbn.values()})
+        products = []
+        for line_number, data in by_isbn.values():
+            category = categories.get(data['category_slug'])
+            if category is None:
+                self.error(line_number, f'categoría inexistente: {data["category_slug"]}')
+                continue
+            fields = {k: v for k, v in data.items() if k not in ('category_slug', 'category_name')}
+            products.append(Product(category_id=category, **fields))
+
+        existing = set(
+            Product.objects.filter(isbn__in=[p.isbn for p in products]).values_list('isbn', flat=True)
+        )
+        self.stats['updated'] += len(existing)
+        self.stats['created'] += len(products) - len(existing)
+        if self.dry_run or not products:
+            return
+
+        with transaction.atomic():
+            if connection.features.supports_update_conflicts_with_target:
+                Product.objects.bulk_create(
+                    products, update_conflicts=True, unique_fields=['isbn'], update_fields=UPDATE_FIELDS
+                )
+            else:
+                self.create_or_update(products, existing)
+
+    def create_or_update(self, products, existing):
+        """Alternativa para motores sin INSERT ... ON CONFLICT DO UPDATE"""
+        ids = dict(Product.objects.filter(isbn__in=existing).values_list('isbn', 'id'))
+        now = timezone.now()
+        to_update = []
+        for product in products:
+            if product.isbn in ids:
+                # bulk_update no aplica auto_now
+                product.pk = ids[product.isbn]
+                product.updated_at = now
+                to_update.append(product)
+        Product.objects.bulk_create([p for p in products if p.isbn not in ids])
+        Product.objects.bulk_update(to_update, UPDATE_FIELDS)
+
+    def resolve_categories(self, rows_by_slug):
+        """Devuelve {slug: category_id} con una consulta por lote (y caché local)"""
+        missing = [slug for slug in rows_by_slug if slug not in self.categories]
+        if missing:
+            self.categories.update(
+                Category.objects.filter(slug__in=missing).values_list('slug', 'id')
+            )
+        to_create = [slug for slug in missing if slug not in self.categories]
+        if to_create and self.options['create_categories'] and not self.dry_run:
+            Category.objects.bulk_create([
+                Category(slug=slug, name=rows_by_slug[slug]['category_name'] or slugify(slug).replace('-', ' ').title())
+                for slug in to_create
+            ], ignore_conflicts=True)
+            self.categories.update(
+                Category.objects.filter(slug__in=to_create).values_list('slug', 'id')
+            )
+        elif to_create and self.options['create_categories']:
+            # En dry-run se cuentan como si existieran
+            self.categories.update({slug: 0 for slug in to_create})
+        return self.categories
+
+    # ----- reporte -----
+
+    def error(self, line_number, message):
+        self.stats['errors'] += 1
+        self.stderr.write(f'Línea {line_number}: {message}')
+        if self.stats['errors'] >= self.options['max_errors']:
+            raise CommandError(
+                f'Demasiados errores ({self.stats["errors"]}); use --resume para continuar tras corregir'
+            )
+
+    def save_checkpoint(self, checkpoint, rows):
+        if not self.dry_run:
+            checkpoint.write_text(json.dumps({'rows': rows}))
+
+    def progress(self, start):
+        elapsed = time.perf_counter() - start
+        rate = self.stats['read'] / elapsed if elapsed else 0
+        self.stdout.write(f'  {self.stats["read"]:,} filas ({rate:,.0f} filas/s)')
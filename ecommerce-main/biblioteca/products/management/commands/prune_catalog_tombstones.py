@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.models import CatalogTombstone
+
+
+class Command(BaseCommand):
+    help = (
+        'Elimina las bajas del feed de cambios más viejas que CHANGE_FEED_RETENTION_DAYS '
+        '(los cursores de antes ya responden 410; pensado para cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHANGE_FEED_RETENTION_DAYS,
+                            help='Días que se conservan las bajas')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = CatalogTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Bajas eliminadas: {deleted}'))
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from products.models import OrderStatistics
+from products.services import rebuild_order_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recalcula las filas resumen de estadísticas de órdenes por usuario'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', dest='usernames', action='append',
+                            help='Solo recalcular estos usuarios (repetible)')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(orders__isnull=False).distinct()
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        else:
+            # Eliminar filas de usuarios que ya no tienen órdenes
+            removed, _ = OrderStatistics.objects.exclude(user__in=users).delete()
+            self.stdout.write(f'Filas sin órdenes eliminadas: {removed}')
+
+        rebuilt = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            rebuild_order_statistics(user_id)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Estadísticas recalculadas: {rebuilt}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.rankings import rebuild_rankings
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula la popularidad de los productos desde las órdenes y las listas de '
+        'destacados y más vendidos'
+    )
+
+    def handle(self, *args, **options):
+        products = rebuild_rankings()
+        self.stdout.write(self.style.SUCCESS(f'Rankings recalculados: {products} productos con ventas'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from products.search import BACKENDS, SEARCH_INDEXES
+
+
+class Command(BaseCommand):
+    help = 'Crea (si falta) y reconstruye los índices de texto completo de productos y categorías'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', choices=sorted(SEARCH_INDEXES), action='append',
+                            help='Índice a reconstruir (por defecto todos)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        backend_class = BACKENDS.get(connection.vendor)
+        if backend_class is None:
+            raise CommandError(f'El motor {connection.vendor} no tiene búsqueda de texto completo')
+
+        backend = backend_class(connection)
+        for name in options['index'] or sorted(SEARCH_INDEXES):
+            index = SEARCH_INDEXES[name]
+            # install() ya reindexa cuando tiene que crear la tabla o los triggers
+            if not backend.install(index):
+                backend.rebuild(index)
+            self.stdout.write(self.style.SUCCESS(f'✓ Índice reconstruido: {name}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products.reservations import rebuild_reserved_stock, release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Libera en lotes las reservas de stock vencidas (pensado para cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Además recalcula Product.reserved_stock desde el registro de reservas')
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reservas vencidas liberadas: {released}'))
+        if options['rebuild']:
+            products = rebuild_reserved_stock()
+            self.stdout.write(self.style.SUCCESS(f'Productos con reservas recalculados: {products}'))
@@ -0,0 +1,295 @@
+"""
+Métricas por petición: consultas SQL, tiempo en la base, serialización,
+renderizado y duración total, agrupadas por acción (`cart.add_item`,
+`order.statistics`, ...).
+
+- RequestMetricsMiddleware mide cada petición. El encabezado Server-Timing
+  (visible en la pestaña de red del navegador) solo se envía con DEBUG o a
+  usuarios staff: expone tiempos internos de la base.
+- Las consultas se cuentan con un execute_wrapper que se instala en cada
+  conexión nueva; el tiempo de serialización se toma de Serializer.data,
+  ListSerializer.data (incluye las consultas que dispare, como un N+1) y
+  RowMapper.data, y el de renderizado de Response.rendered_content.
+  Fuera de una petición medida cada hook solo lee una ContextVar.
+- REGISTRY guarda por acción contadores acumulados y una ventana de las
+  últimas peticiones (summary con cuantiles) que /api/metrics/ expone en el
+  formato de texto de Prometheus. Son datos por proceso: con varios workers
+  cada uno expone los suyos.
+
+Desactivado por defecto; se activa con REQUEST_METRICS (settings.py).
+"""
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from math import ceil
+from threading import Lock
+from time import monotonic, perf_counter
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.functional import LazyObject
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db', 'serialize', 'render', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = self.serialize = self.render = 0.0
+        self.serializing = False
+
+
+# ===== HOOKS =====
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db += perf_counter() - start
+        stats.queries += 1
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Receptor de connection_created: cuenta las consultas de esa conexión"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _measure(func, phase):
+    @wraps(func)
+    def timed(*args, **kwargs):
+        stats = _current.get()
+        # Solo el nivel más externo: un serializer dentro de otro ya está contado
+        if stats is None or stats.serializing:
+            return func(*args, **kwargs)
+        stats.serializing = True
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            setattr(stats, phase, getattr(stats, phase) + perf_counter() - start)
+            stats.serializing = False
+    timed.metrics_phase = phase
+    return timed
+
+
+def _timed(fget, phase):
+    return property(_measure(fget, phase))
+
+
+def timed_serialization(func):
+    """Decorador: el tiempo de `func` cuenta como serialización (listados de rows.py)"""
+    return _measure(func, 'serialize')
+
+
+def install_serializer_timing():
+    from rest_framework import serializers
+    from rest_framework.response import Response
+
+    for cls, attr, phase in [
+        (serializers.Serializer, 'data', 'serialize'),
+        (serializers.ListSerializer, 'data', 'serialize'),
+        (Response, 'rendered_content', 'render'),
+    ]:
+        prop = cls.__dict__[attr]
+        if not hasattr(prop.fget, 'metrics_phase'):
+            setattr(cls, attr, _timed(prop.fget, phase))
+
+
+# ===== REGISTRO =====
+
+class ActionMetrics:
+    def __init__(self, size):
+        # (instante, duración, consultas) de las últimas peticiones
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.duration = self.db = self.serialize = self.render = 0.0
+        self.queries = 0
+        self.statuses = {}
+
+
+class MetricsRegistry:
+    """
+    Totales acumulados (contadores de Prometheus) más una ventana de las
+    últimas observaciones por acción, de donde salen los cuantiles. Los
+    cuantiles describen el tráfico reciente: un pico de hace una hora no
+    queda diluido en el acumulado desde que arrancó el proceso.
+    """
+    QUANTILES = (0.5, 0.9, 0.95, 0.99)
+    METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+    def __init__(self, window=300, size=1024, clock=monotonic):
+        self.window = window
+        self.size = size
+        self.clock = clock
+        self.lock = Lock()
+        self.actions = {}
+
+    def observe(self, action, method, status, stats, duration):
+        # Un método inventado por el cliente no debe crear series nuevas
+        method = method if method in self.METHODS else 'OTHER'
+        with self.lock:
+            metrics = self.actions.get((action, method))
+            if metrics is None:
+                metrics = self.actions[action, method] = ActionMetrics(self.size)
+            metrics.count += 1
+            metrics.duration += duration
+            metrics.queries += stats.queries
+            metrics.db += stats.db
+            metrics.serialize += stats.serialize
+            metrics.render += stats.render
+            status_class = f'{status // 100}xx'
+            metrics.statuses[status_class] = metrics.statuses.get(status_class, 0) + 1
+            metrics.samples.append((self.clock(), duration, stats.queries))
+
+    def reset(self):
+        with self.lock:
+            self.actions = {}
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus (0.0.4)"""
+        cutoff = self.clock() - self.window
+        with self.lock:
+            actions = sorted(self.actions.items())
+            for _, metrics in actions:
+                while metrics.samples and metrics.samples[0][0] < cutoff:
+                    metrics.samples.popleft()
+            lines = []
+            lines += self._summary(
+                'http_request_duration_seconds', 'Duración total de la petición', actions,
+                lambda m: (m.duration, [duration for _, duration, _ in m.samples]),
+            )
+            lines += self._summary(
+                'http_request_db_queries', 'Consultas SQL por petición', actions,
+                lambda m: (m.queries, [queries for _, _, queries in m.samples]),
+            )
+            for name, help_text, attr in [
+                ('http_request_db_seconds_total', 'Tiempo en la base de datos', 'db'),
+                ('http_request_serialize_seconds_total', 'Tiempo en Serializer.data', 'serialize'),
+                ('http_request_render_seconds_total', 'Tiempo renderizando la respuesta', 'render'),
+            ]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                lines += [
+                    f'{name}{{{_labels(key)}}} {getattr(metrics, attr):.6f}' for key, metrics in actions
+                ]
+            lines += ['# HELP http_requests_total Peticiones por estado', '# TYPE http_requests_total counter']
+            for key, metrics in actions:
+                for status_class, count in sorted(metrics.statuses.items()):
+                    lines.append(f'http_requests_total{{{_labels(key)},status="{status_class}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def _summary(self, name, help_text, actions, values):
+        """Cuantiles de la ventana; _sum y _count son los acumulados"""
+        lines = [f'# HELP {name} {help_text} (cuantiles de los últimos {self.window} s)',
+                 f'# TYPE {name} summary']
+        for key, metrics in actions:
+            total, window = values(metrics)
+            window.sort()
+            for q in self.QUANTILES:
+                lines.append(f'{name}{{{_labels(key)},quantile="{q}"}} {_quantile(window, q)}')
+            lines.append(f'{name}_sum{{{_labels(key)}}} {total}')
+            lines.append(f'{name}_count{{{_labels(key)}}} {metrics.count}')
+        return lines
+
+
+def _quantile(values, q):
+    """Rango más cercano sobre `values` ordenados; NaN si la ventana está vacía"""
+    if not values:
+        return 'NaN'
+    return values[max(ceil(q * len(values)) - 1, 0)]
+
+
+def _labels(key):
+    action, method = key
+    action = action.replace('\\', '\\\\').replace('"', '\\"')
+    return f'action="{action}",method="{method}"'
+
+
+REGISTRY = MetricsRegistry()
+
+
+# ===== MIDDLEWARE =====
+
+def action_name(request):
+    """`basename.acción` para los viewsets; el nombre de la ruta para el resto"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        method = request.method.lower()
+        action = actions.get(method)
+        if action is None and method == 'head':
+            action = actions.get('get')
+        return f'{match.func.initkwargs.get("basename")}.{action or "unmapped"}'
+    return match.view_name
+
+
+def timing_allowed(request):
+    """Server-Timing solo con DEBUG o para staff"""
+    if settings.DEBUG:
+        return True
+    # Solo un usuario ya autenticado (DRF lo asigna en la vista): evaluar el
+    # SimpleLazyObject de AuthenticationMiddleware costaría una consulta, que
+    # además no puede hacerse desde el event loop
+    user = request.__dict__.get('user')
+    return not isinstance(user, LazyObject) and getattr(user, 'is_staff', False)
+
+
+def server_timing(stats, duration):
+    return ', '.join([
+        f'db;dur={stats.db * 1000:.2f};desc="{stats.queries} queries"',
+        f'serialize;dur={stats.serialize * 1000:.2f}',
+        f'render;dur={stats.render * 1000:.2f}',
+        f'total;dur={duration * 1000:.2f}',
+    ])
+
+
+class RequestMetricsMiddleware:
+    """Va primero en MIDDLEWARE para que la duración incluya todo el stack"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, perf_counter() - start)
+
+    def finish(self, request, response, stats, duration):
+        REGISTRY.observe(action_name(request), request.method, response.status_code, stats, duration)
+        if timing_allowed(request):
+            response['Server-Timing'] = server_timing(stats, duration)
+        return response
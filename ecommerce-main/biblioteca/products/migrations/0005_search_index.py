@@ -0,0 +1,99 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# DDL congelado a la fecha de esta migración (no importa products.search, que
+# sigue a los modelos actuales). Los cambios posteriores van en otra migración.
+SEARCH_INDEXES = [
+    # (tabla, [(columna, peso)])
+    ('products_product', [('title', 'A'), ('author', 'A'), ('isbn', 'A'), ('description', 'C')]),
+    ('products_category', [('name', 'A'), ('description', 'B')]),
+]
+
+
+def sqlite_install(table, columns):
+    fts = f'{table}_fts'
+    cols = ', '.join(column for column, _ in columns)
+    new = ', '.join(f"coalesce(new.{column}, '')" for column, _ in columns)
+    old = ', '.join(f"coalesce(old.{column}, '')" for column, _ in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def sqlite_uninstall(table, columns):
+    fts = f'{table}_fts'
+    return [f'DROP TRIGGER IF EXISTS {fts}_{suffix}' for suffix in ('ai', 'ad', 'au')] + [
+        f'DROP TABLE IF EXISTS {fts}',
+    ]
+
+
+def postgresql_install(table, columns):
+    vector = ' || '.join(
+        f"setweight(to_tsvector('spanish'::regconfig, coalesce(\"{column}\", '')), '{weight}')"
+        for column, weight in columns
+    )
+    return [f'CREATE INDEX IF NOT EXISTS "{table}_search_gin" ON "{table}" USING GIN (({vector}))']
+
+
+def postgresql_uninstall(table, columns):
+    return [f'DROP INDEX IF EXISTS "{table}_search_gin"']
+
+
+DDL = {
+    'sqlite': (sqlite_install, sqlite_uninstall),
+    'postgresql': (postgresql_install, postgresql_uninstall),
+}
+
+
+def run_ddl(position):
+    def run(apps, schema_editor):
+        statements = DDL.get(schema_editor.connection.vendor)
+        if statements is None:
+            # Otros motores: la búsqueda usa los icontains de SearchFilter
+            return
+        for table, columns in SEARCH_INDEXES:
+            for sql in statements[position](table, columns):
+                schema_editor.execute(sql, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+    """Índices de texto completo: FTS5 en SQLite, GIN sobre tsvector en PostgreSQL"""
+
+    dependencies = [
+        ('products', '0004_orderstatistics'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_ddl(0), run_ddl(1)),
+        # Modelos no administrados sobre las tablas FTS5 (solo estado)
+        migrations.CreateModel(
+            name='CategorySearchDocument',
+            fields=[
+                ('category', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='products.category')),
+            ],
+            options={
+                'db_table': 'products_category_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+            ],
+            options={
+                'db_table': 'products_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.8 on 2026-10-17 13:10
+
+from datetime import datetime, timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Copia de rankings.py a la fecha de esta migración
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+MAX_EXPONENT = 900
+FEATURED_MIN_RATING = 4.0
+
+
+def backfill_rankings(apps, schema_editor):
+    """Popularidad y listas desde las órdenes existentes, como rebuild_rankings"""
+    Product = apps.get_model('products', 'Product')
+    OrderItem = apps.get_model('products', 'OrderItem')
+    ProductPopularity = apps.get_model('products', 'ProductPopularity')
+    ProductRanking = apps.get_model('products', 'ProductRanking')
+    size = settings.RANKING_SIZE
+    half_life = settings.RANKING_HALF_LIFE_DAYS * 86400
+
+    scores, units = {}, {}
+    lines = (
+        OrderItem.objects.filter(product__isnull=False).exclude(order__status='cancelled')
+        .values_list('product_id', 'quantity', 'order__created_at')
+    )
+    for product_id, quantity, when in lines.iterator():
+        weight = 2.0 ** min((when - EPOCH).total_seconds() / half_life, MAX_EXPONENT)
+        scores[product_id] = scores.get(product_id, 0.0) + quantity * weight
+        units[product_id] = units.get(product_id, 0) + quantity
+    ProductPopularity.objects.bulk_create([
+        ProductPopularity(product_id=product_id, score=scores[product_id], units=units[product_id])
+        for product_id in units
+    ], batch_size=1000)
+
+    featured = (
+        Product.objects.filter(is_active=True, rating__gte=FEATURED_MIN_RATING)
+        .order_by('-rating', 'pk').values_list('pk', flat=True)[:size]
+    )
+    rows = [
+        ProductRanking(kind='featured', position=position, product_id=product_id)
+        for position, product_id in enumerate(featured, start=1)
+    ]
+    sold = (
+        ProductPopularity.objects.filter(units__gt=0, product__is_active=True)
+        .order_by('-score', 'product_id').values_list('product_id', 'product__category_id')
+    )
+    positions = {}
+    for product_id, category_id in sold.iterator():
+        # La lista global (None) y la de la categoría
+        for key in (None, category_id):
+            position = positions[key] = positions.get(key, 0) + 1
+            if position <= size:
+                rows.append(ProductRanking(kind='bestsellers', category_id=key, position=position,
+                                           product_id=product_id))
+    ProductRanking.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='products.product')),
+                ('score', models.FloatField(default=0)),
+                ('units', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Product popularity',
+                'indexes': [models.Index(fields=['-score'], name='popularity_score_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('featured', 'Destacados'), ('bestsellers', 'Más vendidos')], max_length=20)),
+                ('position', models.PositiveIntegerField()),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='products.product')),
+            ],
+            options={
+                'ordering': ['kind', 'category', 'position'],
+                'indexes': [models.Index(fields=['kind', 'category', 'position'], name='ranking_list_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_rankings, migrations.RunPython.noop),
+    ]
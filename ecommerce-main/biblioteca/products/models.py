@@ -1,8 +1,26 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import User
+from django.utils import timezone
 from decimal import Decimal
 
+class CategoryQuerySet(models.QuerySet):
+    def with_product_count(self):
+        """
+        Anota la cantidad de productos activos en la misma consulta. Es una
+        subconsulta correlacionada (no un GROUP BY) para poder combinarla con
+        el join de búsqueda FTS5, cuyo bm25() no admite agregaciones.
+        """
+        active_products = (
+            Product.objects.filter(category=models.OuterRef('pk'), is_active=True)
+            .order_by().values('category').annotate(total=models.Count('pk')).values('total')
+        )
+        return self.annotate(
+            active_product_count=Coalesce(models.Subquery(active_products), 0)
+        )
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
@@ -10,9 +28,15 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
+        indexes = [
+            # Feed de cambios (changes.py)
+            models.Index(fields=['updated_at', 'id'], name='category_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -26,6 +50,8 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     stock = models.PositiveIntegerField(default=0)
+    # Suma de las StockReservation vigentes (ver reservations.py)
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False)
     image_url = models.URLField(blank=True, null=True)
     publisher = models.CharField(max_length=200, blank=True)
     publication_date = models.DateField(blank=True, null=True)
@@ -39,16 +65,99 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Paginación por cursor: (campo de orden, id) sobre productos activos
+            models.Index(fields=['created_at', 'id'], name='product_active_created_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['price', 'id'], name='product_active_price_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['rating', 'id'], name='product_active_rating_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['title', 'id'], name='product_active_title_idx',
+                         condition=models.Q(is_active=True)),
+            # Filtros (by_category, ?category=, filterset_fields) con el orden por defecto
+            models.Index(fields=['category', 'created_at', 'id'], name='product_active_category_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['author', 'created_at', 'id'], name='product_active_author_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['publisher', 'created_at', 'id'], name='product_active_publisher_idx',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['language', 'created_at', 'id'], name='product_active_language_idx',
+                         condition=models.Q(is_active=True)),
+            # Feed de cambios (changes.py): incluye los inactivos, que salen como bajas
+            models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.author}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores con que se cargó, para saber en post_save si podía estar en
+        # destacados (signals.py); None si alguno quedó diferido
+        loaded = (instance.__dict__.get('is_active'), instance.__dict__.get('rating'))
+        instance._loaded_featured = None if None in loaded else loaded
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_featured = (self.is_active, self.rating)
+
+    @property
+    def available_stock(self):
+        """Stock que todavía no está reservado por ningún carrito"""
+        return max(self.stock - self.reserved_stock, 0)
+
+
+# Tablas FTS5 de search.py (solo SQLite). No se leen ni se escriben desde
+# Django: existen para que la búsqueda haga el join con el índice desde el ORM.
+
+class CategorySearchDocument(models.Model):
+    category = models.OneToOneField(Category, on_delete=models.DO_NOTHING, primary_key=True,
+                                    db_column='rowid', related_name='search_document')
+
+    class Meta:
+        managed = False
+        db_table = 'products_category_fts'
+
+
+class ProductSearchDocument(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True,
+                                   db_column='rowid', related_name='search_document')
+
+    class Meta:
+        managed = False
+        db_table = 'products_product_fts'
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Anota totales calculados en la base de datos y precarga los items con su producto"""
+        line_total = models.ExpressionWrapper(
+            models.F('items__quantity') * models.F('items__product__price'),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2)
+        )
+        items = CartItem.objects.select_related('product')
+        return self.annotate(
+            annotated_total_items=Coalesce(
+                models.Sum('items__quantity'), 0
+            ),
+            annotated_subtotal=Coalesce(
+                models.Sum(line_total), Decimal('0.00'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2)
+            ),
+        ).prefetch_related(models.Prefetch('items', queryset=items))
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart', null=True, blank=True)
     session_key = models.CharField(max_length=40, null=True, blank=True, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         ordering = ['-updated_at']
 
@@ -59,10 +168,15 @@ class Cart(models.Model):
 
     @property
     def total_items(self):
+        # Si el carrito viene de with_totals() el total ya fue calculado en la BD
+        if hasattr(self, 'annotated_total_items'):
+            return self.annotated_total_items
         return sum(item.quantity for item in self.items.all())
 
     @property
     def subtotal(self):
+        if hasattr(self, 'annotated_subtotal'):
+            return self.annotated_subtotal
         return sum(item.total_price for item in self.items.all())
 
     @property
@@ -140,10 +254,22 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+            # history?status=...
+            models.Index(fields=['user', 'status', 'created_at', 'id'], name='order_user_status_idx'),
+        ]
 
     def __str__(self):
         return f"Orden {self.order_number} - {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Estado con el que se cargó la orden, para detectar cambios en post_save
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.order_number:
             # Generar número de orden único
@@ -153,6 +279,7 @@ class Order(models.Model):
             unique_id = str(uuid.uuid4())[:8].upper()
             self.order_number = f"ORD-{timestamp}-{unique_id}"
         super().save(*args, **kwargs)
+        self._loaded_status = self.status
 
 
 class OrderItem(models.Model):
@@ -178,4 +305,120 @@ class OrderItem(models.Model):
 
     def save(self, *args, **kwargs):
         self.subtotal = self.price * self.quantity
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class OrderStatistics(models.Model):
+    """Resumen materializado de las órdenes de un usuario (ver services.py)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='order_statistics')
+    total_orders = models.PositiveIntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    # Un contador por cada estado de Order.STATUS_CHOICES
+    pending_count = models.PositiveIntegerField(default=0)
+    processing_count = models.PositiveIntegerField(default=0)
+    shipped_count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+
+    last_order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='+')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Order statistics"
+
+    def __str__(self):
+        return f"Estadísticas de {self.user.username}"
+
+    @staticmethod
+    def status_field(status):
+        return f'{status}_count'
+
+
+class StockReservation(models.Model):
+    """Unidades apartadas por un carrito hasta `expires_at` (ver reservations.py)"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='reservation_cart_product_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_id} (carrito {self.cart_id})"
+
+
+class ProductPopularity(models.Model):
+    """Popularidad por ventas de un producto, con decaimiento (ver rankings.py)"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='popularity')
+    score = models.FloatField(default=0)
+    # Unidades vendidas sin contar las órdenes canceladas
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Product popularity"
+        indexes = [
+            models.Index(fields=['-score'], name='popularity_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.score:.2f}"
+
+
+class ProductRanking(models.Model):
+    """
+    Una posición de una lista precalculada (ver rankings.py). Las listas por
+    categoría tienen `category`; las globales la dejan vacía.
+    """
+    FEATURED = 'featured'
+    BESTSELLERS = 'bestsellers'
+    KIND_CHOICES = [
+        (FEATURED, 'Destacados'),
+        (BESTSELLERS, 'Más vendidos'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='+')
+    position = models.PositiveIntegerField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='rankings')
+
+    class Meta:
+        ordering = ['kind', 'category', 'position']
+        indexes = [
+            models.Index(fields=['kind', 'category', 'position'], name='ranking_list_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.position}: {self.product_id}"
+
+
+class CatalogTombstone(models.Model):
+    """Producto o categoría eliminado, para el feed de cambios (ver changes.py)"""
+    PRODUCT = 'product'
+    CATEGORY = 'category'
+    KIND_CHOICES = [
+        (PRODUCT, 'Producto'),
+        (CATEGORY, 'Categoría'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['deleted_at', 'id']
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} eliminado"
@@ -0,0 +1,227 @@
+"""
+Paginación por cursor (keyset) para el catálogo y el historial de órdenes.
+
+KeysetPagination pide cada página con un WHERE sobre los valores de la última
+fila vista (`(price, id) > (9.50, 1234)`) en lugar de OFFSET, así que la
+página 5.000 cuesta lo mismo que la 2 y no hace COUNT(*). Respeta el
+`?ordering=` de OrderingFilter y agrega siempre el id como desempate único;
+los índices compuestos (campo, id) de models.py cubren esos órdenes.
+
+Los clientes que necesiten `count` y números de página pueden seguir
+usando `?page=N` (o `?pagination=page`), que delega en PageNumberPagination.
+"""
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursor inválido'
+
+    # Parámetros que fuerzan la paginación por número de página
+    page_query_param = 'page'
+    mode_query_param = 'pagination'
+
+    page_number_class = PageNumberPagination
+    base_url = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.prepare_page(queryset, request)
+        if page is None:
+            return self.delegate.paginate_queryset(queryset, request, view)
+        return self.finish_page(list(page))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset con el ORM async (vistas de async_views.py)"""
+        page = self.prepare_page(queryset, request)
+        if page is None:
+            # PageNumberPagination hace COUNT(*) y no tiene versión async
+            return await sync_to_async(self.delegate.paginate_queryset)(queryset, request, view)
+        return self.finish_page([row async for row in page])
+
+    def prepare_page(self, queryset, request):
+        """
+        Queryset de la página (con una fila extra), o None si se pagina por
+        número de página (self.delegate).
+        """
+        self.request = request
+        self.delegate = None
+        self.ordering = self.get_ordering(queryset)
+        if self.ordering is None or self.wants_page_numbers(request):
+            self.delegate = self.page_number_class()
+            return None
+
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.order_by(self.reverse))
+        if self.position is not None:
+            queryset = queryset.filter(self.after(self.position, self.reverse))
+        # Una fila extra indica si hay más resultados en esa dirección
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, rows):
+        position, reverse = self.position, self.reverse
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.first_position = self.position_of(rows[0]) if rows else position
+        self.last_position = self.position_of(rows[-1]) if rows else position
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.delegate is not None:
+            return self.delegate.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    # ----- modo -----
+
+    def wants_page_numbers(self, request):
+        return (
+            self.page_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == 'page'
+        )
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    # ----- orden -----
+
+    def get_ordering(self, queryset):
+        """
+        Devuelve [(campo, descendente)] terminado en el id, o None si el orden
+        no se puede paginar por cursor (anotaciones como la relevancia de
+        búsqueda, relaciones o campos que admiten NULL).
+        """
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        meta = queryset.model._meta
+        fields = []
+        for item in ordering:
+            if not isinstance(item, str):
+                return None
+            name = item.lstrip('-')
+            name = meta.pk.name if name == 'pk' else name
+            try:
+                field = meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.is_relation or field.null:
+                return None
+            fields.append((field.attname, item.startswith('-')))
+            if field.primary_key:
+                break
+        else:
+            descending = fields[0][1] if fields else False
+            fields.append((meta.pk.attname, descending))
+
+        self.fields = {name: meta.get_field(name) for name, _ in fields}
+        return fields
+
+    def order_by(self, reverse):
+        return [
+            f'-{name}' if descending != reverse else name
+            for name, descending in self.ordering
+        ]
+
+    def after(self, position, reverse):
+        """Condición keyset: filas estrictamente posteriores a `position`"""
+        conditions = []
+        for i, (name, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            equal = {prev: position[prev] for prev, _ in self.ordering[:i]}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[name]}))
+        return reduce(or_, conditions)
+
+    def position_of(self, row):
+        return {name: getattr(row, name) for name, _ in self.ordering}
+
+    # ----- cursores -----
+
+    def encode_cursor(self, position, reverse):
+        payload = {
+            'p': [_to_json(position[name]) for name, _ in self.ordering],
+            'r': int(reverse),
+        }
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode())
+        # base_url permite apuntar los enlaces a otra ruta (p. ej. el detalle de
+        # una categoría enlaza a /categories/{id}/products/)
+        url = self.base_url or self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token.decode().rstrip('='))
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = {
+                name: self.fields[name].to_python(value)
+                for (name, _), value in zip(self.ordering, values)
+            }
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.delegate is not None:
+            return self.delegate.get_next_link()
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.delegate is not None:
+            return self.delegate.get_previous_link()
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
+
+
+def _to_json(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
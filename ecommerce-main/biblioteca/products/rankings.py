@@ -0,0 +1,207 @@
+"""
+Listas precalculadas del catálogo: destacados, más vendidos global y más
+vendidos por categoría. Se guardan en ProductRanking (una fila por posición)
+y los endpoints las leen con una sola consulta por el índice
+(kind, category, position).
+
+Destacados: los RANKING_SIZE productos activos con rating >= FEATURED_MIN_RATING.
+Se recalcula cuando se guarda o elimina un producto que puede estar en la
+lista (signals.py), una sola vez al confirmar la transacción.
+
+Más vendidos: ProductPopularity.score suma las unidades vendidas con
+decaimiento exponencial (vida media RANKING_HALF_LIFE_DAYS). En lugar de
+multiplicar todos los puntajes por el decaimiento a medida que pasa el
+tiempo, cada venta suma `cantidad * 2 ** ((fecha - EPOCH) / vida media)`:
+las ventas nuevas pesan más y el orden entre productos es el mismo que con
+el decaimiento aplicado a todos hasta hoy. Así crear o cancelar una orden
+solo toca los productos de esa orden (record_sales), y cancelar resta
+exactamente lo que se sumó. `units` cuenta las unidades netas: solo
+entran en las listas los productos con ventas.
+
+Las listas se actualizan con transaction.on_commit: el checkout y las
+cancelaciones no pagan el recálculo ni lo hacen mientras tienen bloqueados
+los productos, y una transacción revertida no toca la popularidad. Un error
+en el recálculo se registra en el log sin afectar la orden ya confirmada; si
+falla o el proceso muere entre el commit y el recálculo, `rebuild_rankings`
+lo corrige.
+
+El exponente del peso se limita a MAX_EXPONENT para no desbordar el float:
+con una vida media de 7 días se alcanza unos 17 años después de EPOCH, y
+desde ahí las ventas nuevas dejan de pesar más que las anteriores. Antes de
+eso hay que adelantar EPOCH y ejecutar `manage.py rebuild_rankings`, que
+recalcula todo desde OrderItem; también hace falta al cambiar
+RANKING_HALF_LIFE_DAYS.
+"""
+from datetime import datetime, timezone as dt_timezone
+from threading import local
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, IntegerField, Q, When, Window
+from django.db.models.functions import RowNumber
+
+from .cache import bump_catalog_version
+from .models import OrderItem, Product, ProductPopularity, ProductRanking
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+# 2 ** 900 ~ 8e270: deja margen para sumar ~1e37 unidades sin llegar a inf
+MAX_EXPONENT = 900
+FEATURED_MIN_RATING = 4.0
+
+
+def decay_weight(when):
+    """Peso de una unidad vendida en `when` (1 en EPOCH, el doble cada vida media)"""
+    half_life = settings.RANKING_HALF_LIFE_DAYS * 86400
+    return 2.0 ** min((when - EPOCH).total_seconds() / half_life, MAX_EXPONENT)
+
+
+def _totals(lines, sign=1):
+    """Puntaje y unidades por producto de líneas (product_id, cantidad, fecha)"""
+    scores, units = {}, {}
+    for product_id, quantity, when in lines:
+        scores[product_id] = scores.get(product_id, 0.0) + sign * quantity * decay_weight(when)
+        units[product_id] = units.get(product_id, 0) + sign * quantity
+    return scores, units
+
+
+# ===== LECTURA =====
+
+def ranking(kind, category_id=None):
+    """Productos activos de una lista, en orden, con su categoría (una consulta)"""
+    return (
+        ProductRanking.objects.filter(kind=kind, category_id=category_id, product__is_active=True)
+        .select_related('product__category').order_by('position')
+    )
+
+
+# ===== ACTUALIZACIÓN =====
+
+def featured_candidate(is_active, rating):
+    """Si un producto con estos valores puede estar en los destacados"""
+    return bool(is_active) and rating >= FEATURED_MIN_RATING
+
+
+# Hay un recálculo de destacados pendiente en este hilo
+_featured = local()
+
+
+def schedule_featured_refresh():
+    """Recalcula los destacados al confirmar, una vez aunque cambien varios productos"""
+    # Cada cambio registra su callback (si la transacción o un savepoint se
+    # revierten, Django descarta los suyos) y el primero que se ejecuta hace
+    # el recálculo para todos
+    _featured.pending = True
+    transaction.on_commit(_refresh_featured_on_commit, robust=True)
+
+
+def _refresh_featured_on_commit():
+    if not getattr(_featured, 'pending', False):
+        return
+    _featured.pending = False
+    refresh_featured()
+    # La versión de la caché cambió dentro de la transacción, antes del
+    # recálculo: se vuelve a invalidar con la lista ya al día
+    bump_catalog_version()
+
+
+def record_sales(lines, sign=1):
+    """
+    Suma (sign=1, orden creada) o resta (sign=-1, orden cancelada) las
+    líneas (product_id, cantidad, fecha de la orden) a la popularidad y
+    recalcula las listas de más vendidos afectadas, al confirmar la
+    transacción. `lines` se lee recién entonces.
+    """
+    def apply_recorded_sales():
+        apply_sales(lines, sign)
+
+    # robust: la orden ya está confirmada; un error aquí se registra en el log
+    # (con una función, no un partial: el log usa su __qualname__)
+    transaction.on_commit(apply_recorded_sales, robust=True)
+
+
+def apply_sales(lines, sign=1):
+    """Aplica record_sales de inmediato. Las consultas no dependen de la cantidad de líneas."""
+    scores, units = _totals(lines, sign)
+    if not units:
+        return
+    with transaction.atomic(savepoint=False):
+        ProductPopularity.objects.bulk_create(
+            [ProductPopularity(product_id=product_id) for product_id in units], ignore_conflicts=True
+        )
+        ProductPopularity.objects.filter(product_id__in=units).update(
+            score=Case(
+                *(When(product_id=product_id, then=F('score') + delta) for product_id, delta in scores.items()),
+                default=F('score'),
+                output_field=FloatField(),
+            ),
+            units=Case(
+                *(When(product_id=product_id, then=F('units') + delta) for product_id, delta in units.items()),
+                default=F('units'),
+                output_field=IntegerField(),
+            ),
+        )
+        refresh_bestsellers(Product.objects.filter(pk__in=units).values('category_id'))
+
+
+def refresh_featured():
+    top = (
+        Product.objects.filter(is_active=True, rating__gte=FEATURED_MIN_RATING)
+        .order_by('-rating', 'pk').values_list('pk', flat=True)[:settings.RANKING_SIZE]
+    )
+    with transaction.atomic(savepoint=False):
+        ProductRanking.objects.filter(kind=ProductRanking.FEATURED).delete()
+        ProductRanking.objects.bulk_create([
+            ProductRanking(kind=ProductRanking.FEATURED, position=position, product_id=product_id)
+            for position, product_id in enumerate(top, start=1)
+        ])
+
+
+def refresh_bestsellers(categories=None):
+    """
+    Recalcula la lista global y las de `categories` (ids o un queryset de
+    valores; None = todas) con una consulta cada una: las de categoría con
+    ROW_NUMBER() por categoría.
+    """
+    size = settings.RANKING_SIZE
+    sold = ProductPopularity.objects.filter(units__gt=0, product__is_active=True)
+    top = sold.order_by('-score', 'product_id').values_list('product_id', flat=True)[:size]
+    by_category = sold.annotate(position=Window(
+        RowNumber(), partition_by=F('product__category_id'),
+        order_by=[F('score').desc(), F('product_id').asc()],
+    )).filter(position__lte=size)
+    lists = ProductRanking.objects.filter(kind=ProductRanking.BESTSELLERS)
+    if categories is not None:
+        by_category = by_category.filter(product__category_id__in=categories)
+        lists = lists.filter(Q(category__isnull=True) | Q(category_id__in=categories))
+
+    rows = [
+        ProductRanking(kind=ProductRanking.BESTSELLERS, position=position, product_id=product_id)
+        for position, product_id in enumerate(top, start=1)
+    ]
+    rows += [
+        ProductRanking(kind=ProductRanking.BESTSELLERS, category_id=category_id, position=position,
+                       product_id=product_id)
+        for product_id, category_id, position in by_category.values_list(
+            'product_id', 'product__category_id', 'position')
+    ]
+    with transaction.atomic(savepoint=False):
+        lists.delete()
+        ProductRanking.objects.bulk_create(rows)
+
+
+@transaction.atomic
+def rebuild_rankings():
+    """Recalcula la popularidad desde OrderItem y todas las listas"""
+    lines = (
+        OrderItem.objects.filter(product__isnull=False).exclude(order__status='cancelled')
+        .values_list('product_id', 'quantity', 'order__created_at')
+    )
+    scores, units = _totals(lines.iterator())
+    ProductPopularity.objects.all().delete()
+    ProductPopularity.objects.bulk_create([
+        ProductPopularity(product_id=product_id, score=scores[product_id], units=units[product_id])
+        for product_id in units
+    ], batch_size=1000)
+    refresh_featured()
+    refresh_bestsellers()
+    return len(units)
@@ -0,0 +1,48 @@
+"""
+JSONRenderer con orjson.
+
+Con la configuración por defecto del JSONRenderer de DRF (separadores
+compactos, UTF-8 sin escapar, U+2028/U+2029 escapados) produce los mismos
+bytes para textos, enteros, booleanos, fechas y Decimal (estos dos pasan
+por el JSONEncoder de DRF). Con floats no:
+
+- orjson escribe los exponentes sin signo ni ceros (1e-7, 1e16) donde
+  JSONRenderer escribe 1e-07, 1e+16; el valor es el mismo.
+- NaN e Infinity salen como null; JSONRenderer da error.
+
+Las respuestas del catálogo no tienen floats (precios y ratings son
+Decimal), pero por eso no es el renderer por defecto: se activa en
+DEFAULT_RENDERER_CLASSES (settings.py). Se usa JSONRenderer tal cual si
+orjson no está instalado, si se pide indentación
+(`Accept: application/json; indent=4`) o si orjson rechaza los datos
+(claves que no son texto, enteros de más de 64 bits).
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LINE_SEPARATORS = [('\u2028'.encode(), b'\\u2028'), ('\u2029'.encode(), b'\\u2029')]
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def __init__(self):
+        self.default = self.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        for raw, escaped in LINE_SEPARATORS:
+            if raw in ret:
+                ret = ret.replace(raw, escaped)
+        return ret
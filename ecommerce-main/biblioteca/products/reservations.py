@@ -0,0 +1,211 @@
+"""
+Reservas de stock con vencimiento para los carritos guardados en la base.
+
+Cada línea del carrito aparta sus unidades en StockReservation durante
+STOCK_RESERVATION_TTL segundos (cada cambio en el carrito renueva el plazo).
+Product.reserved_stock lleva la suma de esas reservas y se modifica solo con
+UPDATE condicionales de una sentencia:
+
+    UPDATE product SET reserved_stock = reserved_stock + 2
+    WHERE id = 7 AND stock >= reserved_stock + 2
+
+así dos compradores del mismo producto nunca apartan más de lo que hay y
+nadie bloquea la fila mientras lee o valida (no hay SELECT ... FOR UPDATE).
+El stock disponible es stock - reserved_stock.
+
+En el checkout las reservas del carrito se convierten en descuento de stock
+(services.decrement_stock) y las vencidas se liberan en bloque con
+release_expired_reservations(), que también se ejecuta cuando una reserva
+falla por falta de stock. Un Cart eliminado (también en cascada con su
+usuario) libera sus reservas en pre_delete (signals.py). Los carritos
+anónimos en caché no reservan.
+"""
+from contextlib import nullcontext
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Sum, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    """Uno o más productos no tienen stock suficiente"""
+
+    def __init__(self, products, available=None):
+        self.products = products
+        self.available = available or {}
+        titles = ', '.join(f'{p.title} (disponible: {self.available_for(p)})' for p in products)
+        super().__init__(f'Stock insuficiente: {titles}')
+
+    def available_for(self, product):
+        return self.available.get(product.pk, product.available_stock)
+
+
+def reservation_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', 0)
+
+
+def uses_reservations(cart):
+    return bool(reservation_ttl()) and getattr(cart, 'pk', None) is not None
+
+
+def _case(values, field):
+    """CASE WHEN pk=... THEN field + delta ... para actualizar varias filas en un UPDATE"""
+    return Case(
+        # Greatest evita violar el CHECK >= 0 si el contador quedó desfasado
+        *(When(pk=product_id, then=F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0))
+          for product_id, delta in values.items()),
+        default=F(field),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def _apply_deltas(deltas):
+    """
+    Suma `deltas` {product_id: delta} a reserved_stock con un único UPDATE.
+    Los aumentos solo se aplican si hay stock libre; si alguno no entra no se
+    modifica nada y se devuelven los ids que fallaron.
+    """
+    conditions = [
+        Q(pk=product_id, stock__gte=F('reserved_stock') + delta) if delta > 0 else Q(pk=product_id)
+        for product_id, delta in deltas.items()
+    ]
+    # Con un solo producto el UPDATE ya es todo o nada; con varios hace falta un savepoint
+    with transaction.atomic() if len(deltas) > 1 else nullcontext():
+        updated = Product.objects.filter(reduce(or_, conditions)).update(
+            reserved_stock=_case(deltas, 'reserved_stock')
+        )
+        if updated == len(deltas):
+            return []
+        if len(deltas) > 1:
+            transaction.set_rollback(True)
+    increases = [product_id for product_id, delta in deltas.items() if delta > 0]
+    return [
+        product_id for product_id, stock, reserved in
+        Product.objects.filter(pk__in=increases).values_list('pk', 'stock', 'reserved_stock')
+        if stock < reserved + deltas[product_id]
+    ]
+
+
+@transaction.atomic(savepoint=False)
+def reserve_stock(cart, quantities):
+    """
+    Ajusta las reservas del carrito a `quantities` {product_id: cantidad total
+    en el carrito}; 0 libera la reserva. Renueva el vencimiento de todas las
+    reservas del carrito. Lanza InsufficientStock si algún aumento no entra.
+    """
+    if not uses_reservations(cart) or not quantities:
+        return
+    held = dict(StockReservation.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+    deltas = {
+        product_id: quantity - held.get(product_id, 0)
+        for product_id, quantity in quantities.items()
+        if quantity != held.get(product_id, 0)
+    }
+    if deltas:
+        short = _apply_deltas(deltas)
+        if short and release_expired_reservations(product_ids=short):
+            # Había reservas vencidas sin liberar: reintentar una vez
+            short = _apply_deltas(deltas)
+        if short:
+            products = list(Product.objects.filter(pk__in=short).order_by('pk'))
+            raise InsufficientStock(products, available={
+                product.pk: product.available_stock + held.get(product.pk, 0) for product in products
+            })
+
+    expires_at = timezone.now() + timedelta(seconds=reservation_ttl())
+    released = [product_id for product_id, delta in deltas.items() if quantities[product_id] <= 0]
+    if released:
+        StockReservation.objects.filter(cart=cart, product_id__in=released).delete()
+    changed = [product_id for product_id, delta in deltas.items() if quantities[product_id] > 0]
+    if changed:
+        # Un solo upsert escribe las reservas cambiadas y renueva el plazo del resto
+        totals = {**held, **{product_id: quantities[product_id] for product_id in changed}}
+        StockReservation.objects.bulk_create([
+            StockReservation(cart=cart, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in totals.items() if product_id not in released
+        ], update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity', 'expires_at'])
+    elif set(held) - set(deltas):
+        # Renovar el plazo del resto de las reservas del carrito
+        StockReservation.objects.filter(cart=cart).exclude(product_id__in=deltas).update(expires_at=expires_at)
+
+
+def release_reservations(reservations):
+    """Libera las reservas de un queryset de StockReservation y devuelve cuántas"""
+    with transaction.atomic(savepoint=False):
+        held = _lock(reservations)
+        _release(held)
+    return len(held)
+
+
+def release_cart_reservations(cart):
+    """Libera todas las reservas del carrito (carrito vaciado o eliminado)"""
+    if getattr(cart, 'pk', None) is None:
+        return 0
+    return release_reservations(StockReservation.objects.filter(cart=cart))
+
+
+def take_cart_reservations(cart, product_ids):
+    """
+    Quita del registro las reservas del carrito para `product_ids` y devuelve
+    {product_id: cantidad}. Se usa dentro de la transacción del checkout, que
+    descuenta esas cantidades de stock y de reserved_stock en el mismo UPDATE.
+    Las reservas de productos que ya no están en el carrito se liberan.
+    """
+    held = _lock(StockReservation.objects.filter(cart=cart))
+    _release([row for row in held if row[1] not in product_ids])
+    taken = [row for row in held if row[1] in product_ids]
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in taken]).delete()
+    return {product_id: quantity for _, product_id, quantity in taken}
+
+
+def release_expired_reservations(product_ids=None, batch_size=1000):
+    """Libera en lotes las reservas vencidas; devuelve cuántas liberó"""
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.filter(expires_at__lte=timezone.now())
+            if product_ids is not None:
+                expired = expired.filter(product_id__in=product_ids)
+            held = _lock(expired.order_by('pk'), batch_size)
+            _release(held)
+        released += len(held)
+        if len(held) < batch_size:
+            return released
+
+
+def rebuild_reserved_stock():
+    """Recalcula Product.reserved_stock desde el registro (por si quedó desfasado)"""
+    totals = dict(
+        StockReservation.objects.values('product_id').annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    with transaction.atomic():
+        Product.objects.exclude(pk__in=totals).exclude(reserved_stock=0).update(reserved_stock=0)
+        for product_id, total in totals.items():
+            Product.objects.filter(pk=product_id).update(reserved_stock=total)
+    return len(totals)
+
+
+def _lock(queryset, limit=None):
+    """Filas (pk, product_id, quantity) bloqueadas; las tomadas por otro proceso se saltan"""
+    if connection.features.has_select_for_update_skip_locked:
+        queryset = queryset.select_for_update(skip_locked=True)
+    queryset = queryset.values_list('pk', 'product_id', 'quantity')
+    return list(queryset[:limit] if limit else queryset)
+
+
+def _release(held):
+    if not held:
+        return
+    totals = {}
+    for _, product_id, quantity in held:
+        totals[product_id] = totals.get(product_id, 0) - quantity
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in held]).delete()
+    Product.objects.filter(pk__in=totals).update(reserved_stock=_case(totals, 'reserved_stock'))
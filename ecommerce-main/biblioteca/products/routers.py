@@ -0,0 +1,143 @@
+"""
+Lecturas del catálogo desde una réplica de solo lectura.
+
+- ReplicaRouter envía a la réplica las lecturas de Product y Category que
+  hacen las vistas marcadas con `read_replica = True` (ProductViewSet,
+  CategoryViewSet y las vistas async del catálogo) en peticiones GET/HEAD.
+  Carrito, órdenes, autenticación, sesiones, escrituras y todo lo que corre
+  fuera de una petición (comandos, señales) usan la primaria.
+- Leer lo propio: después de una escritura, el resto de la petición lee de
+  la primaria, y ReplicaRoutingMiddleware agrega la cookie REPLICA_PIN_COOKIE
+  para que las siguientes peticiones del mismo cliente también lo hagan
+  durante REPLICA_PIN_SECONDS (el retraso de replicación que se tolera).
+
+Sin el alias 'replica' en DATABASES el router no decide nada (None) y todo
+va a 'default', como sin router.
+
+La caché del catálogo puede guardar una respuesta leída de una réplica
+atrasada justo después de que una escritura la invalidó: con réplica,
+CATALOG_CACHE_TIMEOUT debería ser corto.
+"""
+from contextvars import ContextVar
+from inspect import iscoroutinefunction
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_PIN_COOKIE = 'db_pin'
+
+_routing = ContextVar('replica_routing', default=None)
+
+
+class RoutingState:
+    """Lo que el router necesita saber de la petición en curso"""
+    __slots__ = ('request', 'pinned', 'wrote', '_catalog')
+
+    SAFE_METHODS = ('GET', 'HEAD')
+
+    def __init__(self, request):
+        self.request = request
+        self.pinned = REPLICA_PIN_COOKIE in request.COOKIES
+        self.wrote = False
+        self._catalog = None
+
+    def catalog_read(self):
+        """La vista es de lectura del catálogo (se resuelve en la primera consulta)"""
+        if self._catalog is None:
+            match = getattr(self.request, 'resolver_match', None)
+            if match is None:
+                return False
+            view_class = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+            self._catalog = (
+                self.request.method in self.SAFE_METHODS and getattr(view_class, 'read_replica', False)
+            )
+        return self._catalog
+
+
+class ReplicaRouter:
+    primary = DEFAULT_DB_ALIAS
+    replica = 'replica'
+    # Modelos que se leen de la réplica
+    replica_models = {'products.product', 'products.category'}
+    # Escrituras que no cuentan para leer lo propio (la sesión se guarda en cada petición)
+    unpinned_models = {'sessions.session'}
+
+    def enabled(self):
+        return self.replica in connections.settings
+
+    def db_for_read(self, model, **hints):
+        if not self.enabled():
+            return None
+        state = _routing.get()
+        if (
+            state is not None
+            and not state.pinned
+            and not state.wrote
+            and model._meta.label_lower in self.replica_models
+            # Dentro de una transacción todo se lee de la primaria
+            and not connections[self.primary].in_atomic_block
+            and state.catalog_read()
+        ):
+            return self.replica
+        return self.primary
+
+    def db_for_write(self, model, **hints):
+        if not self.enabled():
+            return None
+        state = _routing.get()
+        if state is not None and model._meta.label_lower not in self.unpinned_models:
+            state.wrote = True
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplica es una copia de la primaria: los objetos son intercambiables
+        if self.enabled():
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La réplica recibe el esquema por replicación
+        if db == self.replica:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Expone la petición al router y fija la primaria después de escribir"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = RoutingState(request)
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state = RoutingState(request)
+        token = _routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(state, response)
+
+    def finish(self, state, response):
+        if state.wrote:
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
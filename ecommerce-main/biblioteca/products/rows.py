@@ -0,0 +1,230 @@
+"""
+Listados de solo lectura sin instancias del modelo ni serializers.
+
+RowMapper compila un serializer (con los campos de ?fields=/?omit=) una sola
+vez: para cada campo, la columna de values_list() de la que sale y la
+conversión de su to_representation(). Cada fila es una tupla y cada campo
+una llamada, en lugar de una instancia con get_attribute() +
+to_representation() por campo; el resultado es el mismo, byte a byte una
+vez renderizado (FastRowsParityTests, `manage.py benchmark_rows`).
+
+Se compilan:
+- campos de columnas del modelo o de relaciones que no admiten NULL
+  (`category.name`)
+- PrimaryKeyRelatedField (el id de la FK)
+- `get_<campo>_display` de campos con choices
+- serializers anidados many=True de relaciones inversas (los items de una
+  orden): una consulta más para toda la página, como prefetch_related
+- campos que el serializer calcula de columnas y declara en `row_fields`
+  ({nombre: (columnas, función)})
+Con cualquier otro campo (SerializerMethodField, source='*', propiedades,
+relaciones que admiten NULL) no hay mapper y la vista usa el serializer.
+
+FastRowsMixin lo aplica a las acciones de `fast_row_actions` de un viewset
+si FAST_ROWS está activado (settings.py).
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .fieldsets import serializer_fields
+from .metrics import timed_serialization
+
+# Campos cuyo to_representation() solo depende del valor de la columna
+CONVERTED_FIELDS = (
+    serializers.DecimalField, serializers.FloatField, serializers.DateTimeField,
+    serializers.DateField, serializers.TimeField, serializers.DurationField,
+    serializers.UUIDField, serializers.JSONField,
+)
+
+
+class NotCompilable(Exception):
+    """El serializer tiene un campo que no sale de columnas"""
+
+
+def _converter(field):
+    """Conversión que hace `field` del valor de la columna (None = ninguna)"""
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        return None
+    if isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField,
+                          serializers.FileField, serializers.MultipleChoiceField)):
+        raise NotCompilable(field.field_name)
+    if isinstance(field, (serializers.BooleanField, serializers.ReadOnlyField)):
+        return None
+    if isinstance(field, serializers.IntegerField):
+        return int
+    if isinstance(field, serializers.CharField):
+        # Las subclases que transforman el texto (TruncatedCharField) usan su conversión
+        if type(field).to_representation is serializers.CharField.to_representation:
+            return str
+        return field.to_representation
+    if isinstance(field, (serializers.ChoiceField, *CONVERTED_FIELDS)):
+        return field.to_representation
+    raise NotCompilable(field.field_name)
+
+
+def _display(model_field, convert):
+    """get_<campo>_display(): la etiqueta de la opción, o el valor si no hay"""
+    labels = dict(model_field.flatchoices)
+    if convert is None:
+        return lambda value: labels.get(value, value)
+    return lambda value: convert(labels.get(value, value))
+
+
+def _column(field, model):
+    """Ruta de values_list() de la que sale `field` y su conversión"""
+    if field.source == '*':
+        raise NotCompilable(field.field_name)
+    path = []
+    attrs = field.source_attrs
+    for i, attr in enumerate(attrs):
+        last = i == len(attrs) - 1
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            name = attr[len('get_'):-len('_display')]
+            if not (last and attr.startswith('get_') and attr.endswith('_display')):
+                raise NotCompilable(field.field_name)
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise NotCompilable(field.field_name)
+            if not model_field.choices:
+                raise NotCompilable(field.field_name)
+            return '__'.join(path + [name]), _display(model_field, _converter(field))
+        if not model_field.concrete:
+            raise NotCompilable(field.field_name)
+        path.append(attr)
+        if last:
+            if model_field.is_relation != isinstance(field, serializers.PrimaryKeyRelatedField):
+                raise NotCompilable(field.field_name)
+            return '__'.join(path), _converter(field)
+        # Con una relación NULL el serializer omite el campo (SkipField)
+        if not model_field.is_relation or model_field.null:
+            raise NotCompilable(field.field_name)
+        model = model_field.related_model
+
+
+class RowMapper:
+    """
+    Representación de `serializer_class` (solo los campos `names`, en su
+    orden) a partir de tuplas de values_list(*columns).
+    """
+
+    def __init__(self, serializer_class, names=None):
+        self.model = serializer_class.Meta.model
+        available = serializer_fields(serializer_class)
+        computed = getattr(serializer_class, 'row_fields', {})
+        self.columns = []
+        self.getters = []
+        # (nombre, mapper, modelo, FK al padre) de cada relación inversa
+        self.nested = []
+        for name in names or available:
+            field = available[name]
+            if name in computed:
+                paths, func = computed[name]
+                indexes = [self.column(path) for path in paths]
+                getter = lambda row, indexes=indexes, func=func: func(*[row[i] for i in indexes])
+            elif isinstance(field, serializers.ListSerializer):
+                self.nested.append(self.compile_nested(name, field))
+                # El valor se completa en data(), en la posición del campo
+                getter = lambda row: None
+            elif isinstance(field, serializers.BaseSerializer):
+                raise NotCompilable(name)
+            else:
+                path, convert = _column(field, self.model)
+                i = self.column(path)
+                if convert is None:
+                    getter = lambda row, i=i: row[i]
+                else:
+                    getter = lambda row, i=i, convert=convert: None if row[i] is None else convert(row[i])
+            self.getters.append((name, getter))
+
+    def column(self, path):
+        """Índice de `path` en la tupla, agregándola si falta"""
+        if path not in self.columns:
+            self.columns.append(path)
+        return self.columns.index(path)
+
+    def compile_nested(self, name, field):
+        try:
+            relation = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise NotCompilable(name)
+        if not (relation.one_to_many and relation.auto_created):
+            raise NotCompilable(name)
+        self.pk_index = self.column(self.model._meta.pk.attname)
+        child = RowMapper(type(field.child))
+        return name, child, relation.related_model, relation.field.attname
+
+    def rows(self, queryset, extra=(), prefix=''):
+        """
+        values_list() de las columnas del mapper seguidas de `extra` (p. ej.
+        las del orden, que lee la paginación por cursor). Con `extra` las
+        filas son namedtuples. `prefix` es la relación al modelo del
+        serializer cuando el queryset es de otro (`product__`).
+        """
+        columns = self.columns + [column for column in extra if column not in self.columns]
+        return queryset.prefetch_related(None).values_list(
+            *(prefix + column for column in columns), named=bool(extra)
+        )
+
+    @timed_serialization
+    def data(self, rows):
+        """Lista de dicts de la representación de `rows`"""
+        rows = list(rows)
+        items = [{name: getter(row) for name, getter in self.getters} for row in rows]
+        for name, child, model, fk in self.nested:
+            groups = {row[self.pk_index]: [] for row in rows}
+            if groups:
+                # Como prefetch_related: el orden por defecto del modelo relacionado
+                children = list(child.rows(model._default_manager.filter(**{f'{fk}__in': groups}), [fk]))
+                for row, value in zip(children, child.data(children)):
+                    groups[getattr(row, fk)].append(value)
+            for row, item in zip(rows, items):
+                item[name] = groups[row[self.pk_index]]
+        return items
+
+
+@lru_cache(maxsize=256)
+def row_mapper(serializer_class, names=None):
+    """RowMapper de `serializer_class` con los campos `names` (tupla), o None si no se puede"""
+    try:
+        return RowMapper(serializer_class, names)
+    except NotCompilable:
+        return None
+
+
+class FastRowsMixin:
+    """
+    Para viewsets: las acciones de `fast_row_actions` responden con
+    RowMapper cuando el serializer de la acción (y ?fields=/?omit=) se puede
+    compilar. Las acciones llaman a get_row_mapper() y row_response().
+    """
+    fast_row_actions = ()
+
+    def get_row_mapper(self):
+        if not settings.FAST_ROWS or self.action not in self.fast_row_actions:
+            return None
+        fieldset = self.get_fieldset() if hasattr(self, 'get_fieldset') else None
+        if fieldset is not None:
+            return row_mapper(fieldset.serializer_class, tuple(fieldset.names))
+        return row_mapper(self.get_serializer_class())
+
+    def row_response(self, mapper, queryset, paginate=True, prefix=''):
+        if paginate and self.paginator is not None:
+            ordering = getattr(self.paginator, 'get_ordering', lambda queryset: None)(queryset)
+            extra = [name for name, _ in ordering or []]
+            page = self.paginate_queryset(mapper.rows(queryset, extra, prefix))
+            if page is not None:
+                return self.get_paginated_response(mapper.data(page))
+        return Response(mapper.data(mapper.rows(queryset, prefix=prefix)))
+
+    def list(self, request, *args, **kwargs):
+        mapper = self.get_row_mapper()
+        if mapper is None:
+            return super().list(request, *args, **kwargs)
+        return self.row_response(mapper, self.filter_queryset(self.get_queryset()))
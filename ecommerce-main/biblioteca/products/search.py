@@ -0,0 +1,245 @@
+"""
+Búsqueda de texto completo para ProductViewSet y CategoryViewSet.
+
+Cada índice se declara con SearchIndex y se mantiene en la base de datos:
+- SQLite: tabla virtual FTS5 (external content) sincronizada con triggers.
+- PostgreSQL: índice GIN sobre la expresión tsvector (se actualiza solo).
+La migración 0005_search_index crea las tablas, triggers e índices con su
+propio DDL; install_search_indexes() vuelve a crear los que falten después
+de cada migrate (las migraciones que recrean una tabla en SQLite eliminan
+sus triggers).
+
+Un viewset lo activa declarando `search_index` y usando FullTextSearchFilter
+en lugar de SearchFilter. Con SEARCH_BACKEND = 'icontains' (o en otro motor)
+se vuelve al comportamiento de SearchFilter de DRF.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Category, Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchIndex:
+    def __init__(self, name, model, columns):
+        self.name = name
+        self.model = model
+        # [(columna, peso)] ; pesos estilo PostgreSQL: A > B > C > D
+        self.columns = columns
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def fts_table(self):
+        # La misma tabla que el modelo no administrado de `search_document`
+        return self.model._meta.get_field('search_document').related_model._meta.db_table
+
+    @property
+    def pg_index(self):
+        return f'{self.table}_search_gin'
+
+
+PRODUCT_INDEX = SearchIndex('product', Product, [
+    ('title', 'A'), ('author', 'A'), ('isbn', 'A'), ('description', 'C'),
+])
+CATEGORY_INDEX = SearchIndex('category', Category, [
+    ('name', 'A'), ('description', 'B'),
+])
+
+SEARCH_INDEXES = {index.name: index for index in (PRODUCT_INDEX, CATEGORY_INDEX)}
+
+
+def tokenize(terms):
+    """Separa los términos de búsqueda en palabras, descartando la sintaxis del motor"""
+    return [token for term in terms for token in TOKEN_RE.findall(term)]
+
+
+# ===== BACKENDS =====
+
+class SQLiteFTSSearchBackend:
+    vendor = 'sqlite'
+    BM25_WEIGHTS = {'A': 10.0, 'B': 4.0, 'C': 1.0, 'D': 0.5}
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def match_expression(self, tokens):
+        # Cada palabra entre comillas (escapa la sintaxis FTS5) y como prefijo
+        return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+    def search(self, queryset, index, tokens):
+        match = self.match_expression(tokens)
+        weights = ', '.join(str(self.BM25_WEIGHTS[weight]) for _, weight in index.columns)
+        fts = index.fts_table
+        # Join con la tabla FTS5 por la relación search_document (no una
+        # subconsulta correlacionada, que ejecutaría un MATCH por fila).
+        # bm25() devuelve valores negativos: más bajo = más relevante, por eso
+        # se invierte el signo.
+        matches = RawSQL(f'"{fts}" MATCH %s', [match], output_field=BooleanField())
+        rank = RawSQL(f'-bm25("{fts}", {weights})', [], output_field=FloatField())
+        return (
+            queryset.filter(search_document__isnull=False).filter(matches)
+            .annotate(search_rank=rank).order_by('-search_rank', 'pk')
+        )
+
+    def _triggers(self, index):
+        return [f'{index.fts_table}_ai', f'{index.fts_table}_ad', f'{index.fts_table}_au']
+
+    def install(self, index):
+        """Crea la tabla FTS5 y sus triggers si faltan; devuelve True si creó algo"""
+        fts, table = index.fts_table, index.table
+        columns = [column for column, _ in index.columns]
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                self._triggers(index)
+            )
+            if cursor.fetchone()[0] == 3:
+                return False
+
+            cols = ', '.join(columns)
+            new = ', '.join(f"coalesce(new.{column}, '')" for column in columns)
+            old = ', '.join(f"coalesce(old.{column}, '')" for column in columns)
+            # Solo las columnas indexadas disparan el trigger de UPDATE, así los
+            # cambios de stock o precio no reescriben el índice
+            for sql in [
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', "
+                f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+                f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+            ]:
+                cursor.execute(sql)
+        # Los cambios hechos sin triggers no están en el índice
+        self.rebuild(index)
+        return True
+
+    def uninstall(self, index):
+        with self.connection.cursor() as cursor:
+            for trigger in self._triggers(index):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            cursor.execute(f'DROP TABLE IF EXISTS {index.fts_table}')
+
+    def rebuild(self, index):
+        fts = index.fts_table
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+
+
+class PostgresSearchBackend:
+    vendor = 'postgresql'
+    CONFIG = 'spanish'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def vector_sql(self, index, qualified=True):
+        """Expresión tsvector; la del índice GIN es la misma sin calificar"""
+        return ' || '.join(
+            f"setweight(to_tsvector('{self.CONFIG}'::regconfig, "
+            f"coalesce({self._column(index, column, qualified)}, '')), '{weight}')"
+            for column, weight in index.columns
+        )
+
+    def _column(self, index, column, qualified):
+        return f'"{index.table}"."{column}"' if qualified else f'"{column}"'
+
+    def tsquery(self, tokens):
+        return ' & '.join(f"{token}:*" for token in tokens)
+
+    def search(self, queryset, index, tokens):
+        query = self.tsquery(tokens)
+        vector = self.vector_sql(index)
+        matches = RawSQL(
+            f"({vector}) @@ to_tsquery('{self.CONFIG}'::regconfig, %s)",
+            [query], output_field=BooleanField()
+        )
+        rank = RawSQL(
+            f"ts_rank({vector}, to_tsquery('{self.CONFIG}'::regconfig, %s))",
+            [query], output_field=FloatField()
+        )
+        return queryset.filter(matches).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+    def install(self, index):
+        # El índice de expresión se mantiene solo; no hacen falta triggers
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS "{index.pg_index}" ON "{index.table}" '
+                f'USING GIN (({self.vector_sql(index, qualified=False)}))'
+            )
+        return False
+
+    def uninstall(self, index):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX IF EXISTS "{index.pg_index}"')
+
+    def rebuild(self, index):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'REINDEX INDEX "{index.pg_index}"')
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    """
+    Devuelve el backend de texto completo según SEARCH_BACKEND: 'auto' (según
+    el motor de la base de datos) o 'icontains' (devuelve None y se usan los
+    icontains de SearchFilter).
+    """
+    connection = connections[using]
+    if getattr(settings, 'SEARCH_BACKEND', 'auto') == 'icontains' or connection.vendor not in BACKENDS:
+        return None
+    return BACKENDS[connection.vendor](connection)
+
+
+def install_search_indexes(connection):
+    """Crea los índices de texto completo que falten en esta conexión"""
+    backend_class = BACKENDS.get(connection.vendor)
+    if backend_class is None:
+        return []
+    backend = backend_class(connection)
+    return [index.name for index in SEARCH_INDEXES.values() if backend.install(index)]
+
+
+def uninstall_search_indexes(connection):
+    backend_class = BACKENDS.get(connection.vendor)
+    if backend_class is not None:
+        backend = backend_class(connection)
+        for index in SEARCH_INDEXES.values():
+            backend.uninstall(index)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter que usa el índice de texto completo de la vista
+    (`search_index`) y ordena por relevancia. Si el backend activo no
+    soporta texto completo se comporta igual que SearchFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        index = SEARCH_INDEXES.get(getattr(view, 'search_index', None))
+        backend = get_search_backend(queryset.db)
+        if index is None or backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        tokens = tokenize(self.get_search_terms(request))
+        if not tokens:
+            return queryset
+        return backend.search(queryset, index, tokens)
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import Category, Cart, CartItem, Product, Order, OrderItem
+from .services import EmptyCart, InsufficientStock, checkout_cart
 
 # ===== AUTENTICACIÓN =====
 
@@ -67,6 +68,14 @@ class OrderItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'subtotal', 'created_at']
 
 
+def format_user_info(username, email, first_name, last_name):
+    return {
+        'username': username,
+        'email': email,
+        'full_name': f"{first_name} {last_name}".strip()
+    }
+
+
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user_info = serializers.SerializerMethodField()
@@ -82,12 +91,13 @@ class OrderSerializer(serializers.ModelSerializer):
                   'items', 'created_at', 'updated_at', 'delivered_at']
         read_only_fields = ['id', 'order_number', 'user', 'created_at', 'updated_at']
 
+    # user_info desde columnas, para los listados de rows.py
+    row_fields = {
+        'user_info': (['user__username', 'user__email', 'user__first_name', 'user__last_name'], format_user_info),
+    }
+
     def get_user_info(self, obj):
-        return {
-            'username': obj.user.username,
-            'email': obj.user.email,
-            'full_name': f"{obj.user.first_name} {obj.user.last_name}".strip()
-        }
+        return format_user_info(obj.user.username, obj.user.email, obj.user.first_name, obj.user.last_name)
 
 
 class CreateOrderSerializer(serializers.Serializer):
@@ -99,77 +109,68 @@ class CreateOrderSerializer(serializers.Serializer):
     phone = serializers.CharField(max_length=20)
     notes = serializers.CharField(required=False, allow_blank=True)
 
-    def validate(self, data):
-        user = self.context['request'].user
-        
-        # Verificar que el usuario tenga un carrito con items
-        try:
-            cart = Cart.objects.get(user=user)
-            if not cart.items.exists():
-                raise serializers.ValidationError("El carrito está vacío")
-        except Cart.DoesNotExist:
-            raise serializers.ValidationError("No se encontró un carrito")
-        
-        return data
-
+    # El carrito (que exista y tenga items) se valida en checkout_cart, bajo el
+    # mismo bloqueo con que se compra; revisarlo antes solo repetía consultas
     def create(self, validated_data):
         user = self.context['request'].user
-        cart = Cart.objects.get(user=user)
-        
-        # Calcular totales
-        subtotal = cart.subtotal
-        shipping_cost = Decimal('5.00')  # Costo fijo de envío
-        discount = Decimal('0.00')
-        total = subtotal + shipping_cost - discount
-        
-        # Crear la orden
-        order = Order.objects.create(
-            user=user,
-            payment_method=validated_data['payment_method'],
-            subtotal=subtotal,
-            shipping_cost=shipping_cost,
-            discount=discount,
-            total=total,
-            shipping_address=validated_data['shipping_address'],
-            shipping_city=validated_data['shipping_city'],
-            shipping_postal_code=validated_data['shipping_postal_code'],
-            shipping_country=validated_data.get('shipping_country', 'Perú'),
-            phone=validated_data['phone'],
-            notes=validated_data.get('notes', '')
-        )
-        
-        # Crear los items de la orden
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                product_title=cart_item.product.title,
-                product_author=cart_item.product.author,
-                product_isbn=cart_item.product.isbn or '',
-                quantity=cart_item.quantity,
-                price=cart_item.product.price,
-                subtotal=cart_item.total_price
+        try:
+            return checkout_cart(
+                user=user,
+                payment_method=validated_data['payment_method'],
+                shipping_address=validated_data['shipping_address'],
+                shipping_city=validated_data['shipping_city'],
+                shipping_postal_code=validated_data['shipping_postal_code'],
+                shipping_country=validated_data.get('shipping_country', 'Perú'),
+                phone=validated_data['phone'],
+                notes=validated_data.get('notes', '')
             )
-            
-            # Reducir el stock
-            cart_item.product.stock -= cart_item.quantity
-            cart_item.product.save()
-        
-        # Vaciar el carrito
-        cart.items.all().delete()
-        
-        return order
+        except (EmptyCart, InsufficientStock) as exc:
+            raise serializers.ValidationError({'non_field_errors': [str(exc)]})
     
+def active_product_count(category):
+    """Usa la anotación de Category.objects.with_product_count() si está disponible"""
+    if hasattr(category, 'active_product_count'):
+        return category.active_product_count
+    return category.products.filter(is_active=True).count()
+
+
 class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     
     class Meta:
         model = Product
-        fields = '__all__'
+        # reserved_stock es interno (reservations.py): cambia con cada carrito sin invalidar la caché
+        exclude = ['reserved_stock']
+
+
+class TruncatedCharField(serializers.CharField):
+    """Texto de solo lectura recortado a `max_chars` caracteres (terminado en '…')"""
+
+    def __init__(self, max_chars, **kwargs):
+        self.max_chars = max_chars
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        value = super().to_representation(value)
+        if len(value) <= self.max_chars:
+            return value
+        return value[:self.max_chars - 1].rstrip() + '…'
+
+
+class ProductListSerializer(serializers.ModelSerializer):
+    """Representación liviana para listados (usar con select_related('category'))"""
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    # El frontend muestra la descripción en las tarjetas: basta un resumen
+    description = TruncatedCharField(max_chars=300)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'category', 'category_name', 'title', 'author', 'isbn', 'description',
+                  'price', 'stock', 'image_url', 'rating']
 
 
 class CategorySerializer(serializers.ModelSerializer):
-    products = ProductSerializer(many=True, read_only=True)
     product_count = serializers.SerializerMethodField()
     
     class Meta:
@@ -177,7 +178,7 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = '__all__'
     
     def get_product_count(self, obj):
-        return obj.products.count()
+        return active_product_count(obj)
 
 
 class CategoryListSerializer(serializers.ModelSerializer):
@@ -188,7 +189,7 @@ class CategoryListSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'slug', 'product_count']
     
     def get_product_count(self, obj):
-        return obj.products.count()
+        return active_product_count(obj)
 
 class CartItemProductSerializer(serializers.ModelSerializer):
     """Serializer simplificado del producto para el carrito"""
@@ -226,6 +227,23 @@ class CartItemSerializer(serializers.ModelSerializer):
         return data
 
 
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, data):
+        if data['op'] != 'remove' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': 'Requerido para add y set'})
+        if data['op'] == 'add' and data['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Debe ser al menos 1'})
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=200)
+
+
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
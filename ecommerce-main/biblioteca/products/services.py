@@ -0,0 +1,394 @@
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, PositiveIntegerField, Q, Sum, When
+from django.utils import timezone
+
+from .cache import invalidate_catalog
+from .carts import CachedCart
+from .models import Cart, CartItem, Order, OrderItem, OrderStatistics, Product
+from .rankings import record_sales
+from .reservations import InsufficientStock, reserve_stock, take_cart_reservations, uses_reservations
+
+SHIPPING_COST = Decimal('5.00')  # Costo fijo de envío
+
+
+class EmptyCart(Exception):
+    """El carrito no tiene items para generar una orden"""
+
+
+class ProductUnavailable(Exception):
+    """Productos inexistentes o inactivos"""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Productos no disponibles: {", ".join(map(str, product_ids))}')
+
+
+# ===== CARRITO =====
+
+def apply_cart_operations(cart, operations):
+    """
+    Aplica en orden una lista de operaciones {op: add|set|remove, product_id,
+    quantity} sobre un Cart o CachedCart. Valida el stock de todos los
+    productos afectados (o los reserva, ver reservations.py) con una sola
+    consulta y escribe todo o nada.
+    """
+    if isinstance(cart, CachedCart):
+        current = {product_id: entry['quantity'] for product_id, entry in cart.entries.items()}
+    else:
+        items = {item.product_id: item for item in CartItem.objects.filter(cart=cart)}
+        current = {product_id: item.quantity for product_id, item in items.items()}
+
+    quantities = dict(current)
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['op'] == 'add':
+            quantities[product_id] = quantities.get(product_id, 0) + operation['quantity']
+        elif operation['op'] == 'set':
+            quantities[product_id] = operation['quantity']
+        else:
+            quantities[product_id] = 0
+
+    # Solo se validan y escriben los productos cuya cantidad final cambió
+    changed = {
+        product_id: quantity for product_id, quantity in quantities.items()
+        if quantity != current.get(product_id, 0)
+    }
+    wanted = [product_id for product_id, quantity in changed.items() if quantity > 0]
+    products = Product.objects.filter(pk__in=wanted, is_active=True).in_bulk()
+    missing = [product_id for product_id in wanted if product_id not in products]
+    if missing:
+        raise ProductUnavailable(missing)
+    if not uses_reservations(cart):
+        short = [
+            products[product_id] for product_id in wanted
+            if products[product_id].available_stock < changed[product_id]
+        ]
+        if short:
+            raise InsufficientStock(short)
+
+    if isinstance(cart, CachedCart):
+        cart.set_quantities(changed)
+        return
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    for product_id in wanted:
+        item = items.get(product_id)
+        if item is None:
+            to_create.append(CartItem(cart=cart, product_id=product_id, quantity=changed[product_id]))
+        else:
+            item.quantity = changed[product_id]
+            item.updated_at = now
+            to_update.append(item)
+    removed = [product_id for product_id, quantity in changed.items() if quantity <= 0]
+    with transaction.atomic():
+        # Con reservas activas la validación de stock la hace reserve_stock
+        reserve_stock(cart, changed)
+        if removed:
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+        CartItem.objects.bulk_create(to_create)
+        CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+
+
+# ===== CHECKOUT =====
+
+def decrement_stock(quantities, reserved=None):
+    """
+    Descuenta stock de varios productos con un único UPDATE condicional.
+    `quantities` es un dict {product_id: cantidad}; `reserved` son las
+    unidades que el comprador tenía reservadas, que se descuentan también de
+    reserved_stock. Solo se puede tomar el stock libre más lo reservado por
+    uno mismo; si algún producto no alcanza no se modifica ninguna fila y se
+    lanza InsufficientStock.
+    """
+    if not quantities:
+        return
+    reserved = reserved or {}
+    enough_stock = reduce(or_, (
+        Q(pk=product_id, stock__gte=F('reserved_stock') - reserved.get(product_id, 0) + quantity)
+        for product_id, quantity in quantities.items()
+    ))
+    try:
+        # Savepoint: si falla la condición se revierte solo este UPDATE
+        with transaction.atomic():
+            updated = Product.objects.filter(enough_stock).update(
+                stock=Case(
+                    *(When(pk=product_id, then=F('stock') - quantity)
+                      for product_id, quantity in quantities.items()),
+                    default=F('stock'),
+                    output_field=PositiveIntegerField(),
+                ),
+                reserved_stock=Case(
+                    *(When(pk=product_id, then=F('reserved_stock') - held)
+                      for product_id, held in reserved.items() if product_id in quantities),
+                    default=F('reserved_stock'),
+                    output_field=PositiveIntegerField(),
+                ),
+                # update() no aplica auto_now: el stock visible cambió (ver snapshots.py)
+                updated_at=timezone.now(),
+            )
+            if updated != len(quantities):
+                raise InsufficientStock([])
+    except InsufficientStock:
+        short = [
+            product for product in Product.objects.filter(pk__in=quantities).order_by('pk')
+            if product.available_stock + reserved.get(product.pk, 0) < quantities[product.pk]
+        ]
+        raise InsufficientStock(short, available={
+            product.pk: product.available_stock + reserved.get(product.pk, 0) for product in short
+        })
+    # update() no dispara señales: invalidar la caché del catálogo a mano
+    invalidate_catalog()
+
+
+@transaction.atomic
+def checkout_cart(user, payment_method, shipping_address, shipping_city,
+                  shipping_postal_code, phone, shipping_country='Perú', notes=''):
+    """
+    Convierte el carrito del usuario en una orden dentro de una sola transacción:
+    bloquea solo los productos del carrito, descuenta stock con un UPDATE
+    condicional, crea los OrderItem con bulk_create y vacía el carrito.
+    El número de consultas no depende de la cantidad de líneas del carrito.
+    """
+    try:
+        cart = Cart.objects.select_for_update().get(user=user)
+    except Cart.DoesNotExist:
+        raise EmptyCart('No se encontró un carrito')
+    lines = list(
+        CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')
+    )
+    if not lines:
+        raise EmptyCart('El carrito está vacío')
+
+    # Bloquear en orden de id para evitar deadlocks entre compras concurrentes
+    quantities = dict(lines)
+    products = list(
+        Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk')
+    )
+    # Las reservas del carrito se convierten en descuento definitivo de stock
+    decrement_stock(quantities, reserved=take_cart_reservations(cart, quantities))
+
+    subtotal = sum(
+        (product.price * quantities[product.pk] for product in products),
+        Decimal('0.00')
+    )
+    shipping_cost = SHIPPING_COST
+    discount = Decimal('0.00')
+
+    order = Order.objects.create(
+        user=user,
+        payment_method=payment_method,
+        subtotal=subtotal,
+        shipping_cost=shipping_cost,
+        discount=discount,
+        total=subtotal + shipping_cost - discount,
+        shipping_address=shipping_address,
+        shipping_city=shipping_city,
+        shipping_postal_code=shipping_postal_code,
+        shipping_country=shipping_country,
+        phone=phone,
+        notes=notes
+    )
+
+    # bulk_create no llama a OrderItem.save(), por eso el subtotal se calcula aquí
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=product,
+            product_title=product.title,
+            product_author=product.author,
+            product_isbn=product.isbn or '',
+            quantity=quantities[product.pk],
+            price=product.price,
+            subtotal=product.price * quantities[product.pk]
+        )
+        for product in products
+    ])
+    # Popularidad y más vendidos: al confirmar, fuera de los bloqueos (rankings.py)
+    record_sales((product.pk, quantities[product.pk], order.created_at) for product in products)
+
+    # Vaciar el carrito
+    CartItem.objects.filter(cart=cart).delete()
+
+    return order
+
+
+# ===== ESTADÍSTICAS DE ÓRDENES =====
+
+ORDER_STATUSES = [value for value, label in Order.STATUS_CHOICES]
+
+
+def compute_order_statistics(user):
+    """Calcula las estadísticas del usuario con una sola consulta agregada"""
+    totals = Order.objects.filter(user_id=getattr(user, 'pk', user)).aggregate(
+        total_orders=Count('id'),
+        total_spent=Sum('total'),
+        **{
+            OrderStatistics.status_field(status): Count('id', filter=Q(status=status))
+            for status in ORDER_STATUSES
+        }
+    )
+    totals['total_spent'] = totals['total_spent'] or 0
+    return totals
+
+
+def rebuild_order_statistics(user):
+    """Recalcula (o crea) la fila materializada de estadísticas del usuario"""
+    user_id = getattr(user, 'pk', user)
+    totals = compute_order_statistics(user_id)
+    totals['last_order'] = Order.objects.filter(user_id=user_id).order_by('-created_at').first()
+    stats, created = OrderStatistics.objects.update_or_create(user_id=user_id, defaults=totals)
+    return stats
+
+
+def _adjust_order_statistics(user, **changes):
+    """Aplica incrementos con F() a la fila del usuario; si no existe la reconstruye"""
+    updated = OrderStatistics.objects.filter(user_id=getattr(user, 'pk', user)).update(**changes)
+    if not updated:
+        # Primera vez: la reconstrucción ya incluye la orden que disparó el cambio
+        rebuild_order_statistics(user)
+
+
+def record_order_created(order):
+    _adjust_order_statistics(
+        order.user_id,
+        total_orders=F('total_orders') + 1,
+        total_spent=F('total_spent') + order.total,
+        last_order=order,
+        **{OrderStatistics.status_field(order.status): F(OrderStatistics.status_field(order.status)) + 1}
+    )
+
+
+def record_status_change(user_id, old_status, new_status, count=1):
+    """Mueve `count` órdenes del contador `old_status` a `new_status`"""
+    if old_status == new_status:
+        return
+    old_field = OrderStatistics.status_field(old_status)
+    new_field = OrderStatistics.status_field(new_status)
+    _adjust_order_statistics(
+        user_id,
+        **{old_field: F(old_field) - count, new_field: F(new_field) + count}
+    )
+
+
+def get_order_statistics(user):
+    """
+    Devuelve las estadísticas del usuario. Con ORDER_STATISTICS_MATERIALIZED
+    activo se lee la fila resumen (O(1)); si no, se calcula en vivo.
+    """
+    if getattr(settings, 'ORDER_STATISTICS_MATERIALIZED', False):
+        stats = (
+            OrderStatistics.objects.filter(user=user).first()
+            or rebuild_order_statistics(user)
+        )
+        totals = {
+            field: getattr(stats, field)
+            for field in ['total_orders', 'total_spent'] + [
+                OrderStatistics.status_field(status) for status in ORDER_STATUSES
+            ]
+        }
+        last_order_id = stats.last_order_id
+    else:
+        totals = compute_order_statistics(user)
+        last_order_id = (
+            Order.objects.filter(user=user).order_by('-created_at')
+            .values_list('pk', flat=True).first()
+        )
+
+    last_order = None
+    if last_order_id:
+        last_order = (
+            Order.objects.select_related('user').prefetch_related('items')
+            .filter(pk=last_order_id).first()
+        )
+
+    return {
+        'total_orders': totals['total_orders'],
+        'total_spent': totals['total_spent'],
+        'orders_by_status': {
+            status: totals[OrderStatistics.status_field(status)]
+            for status in ORDER_STATUSES
+        },
+        'last_order': last_order,
+    }
+
+
+# ===== TRANSICIONES DE ÓRDENES =====
+
+# Estados a los que se puede pasar desde cada estado
+ORDER_TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+
+
+def restore_stock(order_ids):
+    """Devuelve al stock las unidades de las órdenes con un único UPDATE"""
+    totals = dict(
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .values('product_id').annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    if not totals:
+        return
+    Product.objects.filter(pk__in=totals).update(stock=Case(
+        *(When(pk=product_id, then=F('stock') + quantity) for product_id, quantity in totals.items()),
+        default=F('stock'),
+        output_field=PositiveIntegerField(),
+    ), updated_at=timezone.now())
+    # update() no dispara señales: invalidar la caché del catálogo a mano
+    invalidate_catalog()
+
+
+@transaction.atomic
+def transition_orders(orders, new_status, from_statuses=None):
+    """
+    Pasa a `new_status` todas las órdenes de `orders` (queryset) cuyo estado
+    lo permita según ORDER_TRANSITIONS (y `from_statuses`, si se indica).
+    Usa UPDATEs de conjunto: uno para las órdenes, uno para el stock si se
+    cancelan (la popularidad se descuenta al confirmar, ver rankings.py) y
+    uno por usuario/estado para las estadísticas. Devuelve la cantidad de
+    órdenes que cambiaron.
+    """
+    allowed = [status for status, targets in ORDER_TRANSITIONS.items() if new_status in targets]
+    if from_statuses is not None:
+        allowed = [status for status in allowed if status in from_statuses]
+    rows = list(
+        orders.filter(status__in=allowed).select_for_update().order_by('pk')
+        .values_list('pk', 'user_id', 'status')
+    )
+    if not rows:
+        return 0
+
+    order_ids = [pk for pk, _, _ in rows]
+    now = timezone.now()
+    changes = {'status': new_status, 'updated_at': now}
+    if new_status == 'delivered':
+        changes['delivered_at'] = now
+    Order.objects.filter(pk__in=order_ids).update(**changes)
+
+    if new_status == 'cancelled':
+        restore_stock(order_ids)
+        # Restar de la popularidad exactamente lo que sumó cada orden
+        record_sales(
+            OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+            .values_list('product_id', 'quantity', 'order__created_at'),
+            sign=-1,
+        )
+
+    # update() no dispara post_save: mover los contadores por (usuario, estado anterior)
+    if getattr(settings, 'ORDER_STATISTICS_MATERIALIZED', False):
+        moved = {}
+        for _, user_id, old_status in rows:
+            moved[user_id, old_status] = moved.get((user_id, old_status), 0) + 1
+        for (user_id, old_status), count in moved.items():
+            record_status_change(user_id, old_status, new_status, count=count)
+    return len(rows)
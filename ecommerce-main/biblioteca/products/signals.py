@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_catalog
+from .models import Cart, CatalogTombstone, Category, Order, OrderStatistics, Product
+from .rankings import featured_candidate, schedule_featured_refresh
+from .reservations import release_cart_reservations
+from .search import install_search_indexes
+from .services import rebuild_order_statistics, record_order_created, record_status_change
+
+
+# ===== ESTADÍSTICAS DE ÓRDENES =====
+
+@receiver(post_save, sender=Order)
+def update_order_statistics(sender, instance, created, raw=False, **kwargs):
+    if raw or not getattr(settings, 'ORDER_STATISTICS_MATERIALIZED', False):
+        return
+    if created:
+        record_order_created(instance)
+        return
+    old_status = getattr(instance, '_loaded_status', None)
+    if old_status is None:
+        # No sabemos el estado anterior: recalcular desde cero
+        rebuild_order_statistics(instance.user_id)
+    else:
+        record_status_change(instance.user_id, old_status, instance.status)
+
+
+@receiver(post_delete, sender=Order)
+def rebuild_statistics_after_delete(sender, instance, **kwargs):
+    if not getattr(settings, 'ORDER_STATISTICS_MATERIALIZED', False):
+        return
+    # Si el usuario se está eliminando en cascada no hay que recrear su fila
+    if OrderStatistics.objects.filter(user_id=instance.user_id).exists():
+        rebuild_order_statistics(instance.user_id)
+
+
+# ===== RANKINGS =====
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_featured(sender, instance, raw=False, created=False, **kwargs):
+    """
+    Recalcula los destacados al confirmar si el producto entra en la lista o
+    podía estar según los valores con que se cargó (sin consultar la lista)
+    """
+    if raw:
+        return
+    loaded = getattr(instance, '_loaded_featured', None)
+    was_candidate = not created and (loaded is None or featured_candidate(*loaded))
+    if was_candidate or featured_candidate(instance.is_active, instance.rating):
+        schedule_featured_refresh()
+
+
+# ===== RESERVAS DE STOCK =====
+
+@receiver(pre_delete, sender=Cart)
+def release_deleted_cart_reservations(sender, instance, **kwargs):
+    """
+    El CASCADE borraría las StockReservation sin descontarlas de
+    Product.reserved_stock: se liberan antes, sea cual sea el camino del
+    borrado (el usuario eliminado, el admin, cleanup_carts).
+    """
+    release_cart_reservations(instance)
+
+
+# ===== CACHÉ DEL CATÁLOGO =====
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    invalidate_catalog()
+
+
+# ===== FEED DE CAMBIOS =====
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def record_tombstone(sender, instance, **kwargs):
+    """Las eliminaciones llegan al feed de cambios como bajas (ver changes.py)"""
+    kind = CatalogTombstone.PRODUCT if sender is Product else CatalogTombstone.CATEGORY
+    CatalogTombstone.objects.create(kind=kind, object_id=instance.pk)
+
+
+# ===== ÍNDICE DE BÚSQUEDA =====
+
+@receiver(post_migrate)
+def restore_search_indexes(sender, using='default', **kwargs):
+    """
+    En SQLite, las migraciones que recrean products_product o
+    products_category eliminan los triggers del índice FTS5; se vuelven a
+    crear (y se reindexa) al terminar migrate.
+    """
+    if sender.name != 'products':
+        return
+    connection = connections[using]
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ('products', '0005_search_index') in applied:
+        install_search_indexes(connection)
@@ -0,0 +1,212 @@
+"""
+Copia estática del catálogo para servir la navegación anónima sin Django.
+
+`manage.py export_catalog_snapshot` escribe en CATALOG_SNAPSHOT_DIR:
+
+- categories/page-N.json: CategoryViewSet.list
+- products/page-N.json: ProductViewSet.list
+- categories/<id>/products/page-N.json: CategoryViewSet.products
+
+Cada página tiene la forma de las respuestas paginadas de la API
+(`next`, `previous`, `results`), el mismo orden y los mismos `results`
+byte a byte; `next` y `previous` apuntan a la página vecina bajo
+CATALOG_SNAPSHOT_URL en lugar de llevar un cursor. Cada archivo va también
+comprimido (.json.gz y, con el paquete Brotli, .json.br) para servirlo con
+`gzip_static on;` / `brotli_static on;` de nginx o desde una CDN.
+
+manifest.json lista las páginas con su ETag, tamaños y huella. La huella
+sale del id y updated_at de cada fila de la página (y de su categoría, por
+category_name), así que la exportación siguiente solo reescribe las páginas
+cuyas filas cambiaron, se movieron de página o dejaron de existir, y borra
+las que sobran. Cambiar el tamaño de página o la URL base las reescribe todas.
+Los cambios que no pasan por updated_at (update() sin tocarlo) no se ven:
+los UPDATE de stock de services.py lo actualizan.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.utils import timezone
+
+from .models import Category, Product
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .rows import row_mapper
+from .serializers import CategoryListSerializer, ProductListSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# Cambia cuando cambia la forma de los archivos: obliga a reescribirlos todos
+FORMAT = 1
+
+
+class Shard:
+    """Una página del snapshot: `build(ids)` devuelve sus `results`"""
+
+    def __init__(self, path, keys, build, links):
+        self.path = path
+        self.keys = keys
+        self.build = build
+        self.links = links
+
+    def fingerprint(self):
+        raw = json.dumps([FORMAT, self.links, self.keys], separators=(',', ':'), default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def render(self, renderer):
+        next_url, previous_url = self.links
+        results = self.build([key[0] for key in self.keys])
+        return renderer.render({'next': next_url, 'previous': previous_url, 'results': results})
+
+
+def keyset_order(queryset):
+    """El orden de la primera página de KeysetPagination (con el id como desempate)"""
+    paginator = KeysetPagination()
+    paginator.ordering = paginator.get_ordering(queryset)
+    return queryset.order_by(*paginator.order_by(reverse=False))
+
+
+def paginate(prefix, keys, build, page_size, base_url):
+    """Páginas de `keys` ([(id, ...)], en orden) bajo `prefix`; siempre al menos una"""
+    pages = [keys[start:start + page_size] for start in range(0, len(keys), page_size)] or [[]]
+    url = lambda number: f'{base_url}{prefix}/page-{number}.json'
+    return [
+        Shard(f'{prefix}/page-{number}.json', page, build, (
+            url(number + 1) if number < len(pages) else None,
+            url(number - 1) if number > 1 else None,
+        ))
+        for number, page in enumerate(pages, start=1)
+    ]
+
+
+def _in_order(ids, objects, key):
+    position = {pk: i for i, pk in enumerate(ids)}
+    return sorted(objects, key=lambda obj: position[key(obj)])
+
+
+def product_results(ids):
+    mapper = row_mapper(ProductListSerializer)
+    rows = _in_order(ids, mapper.rows(Product.objects.filter(pk__in=ids), extra=['id']), lambda row: row.id)
+    return mapper.data(rows)
+
+
+def category_results(ids):
+    categories = Category.objects.with_product_count().filter(pk__in=ids)
+    return CategoryListSerializer(_in_order(ids, categories, lambda category: category.pk), many=True).data
+
+
+def catalog_shards(page_size, base_url):
+    """Todas las páginas del catálogo actual, sin construir su contenido (dos consultas)"""
+    category_keys = list(
+        keyset_order(Category.objects.with_product_count())
+        .values_list('id', 'updated_at', 'active_product_count')
+    )
+    shards = paginate('categories', category_keys, category_results, page_size, base_url)
+
+    # category_name sale de la categoría: su updated_at entra en la huella
+    category_updated = {pk: updated_at for pk, updated_at, _ in category_keys}
+    keys = [
+        (pk, updated_at, category_id, category_updated.get(category_id))
+        for pk, updated_at, category_id in keyset_order(Product.objects.filter(is_active=True))
+        .values_list('id', 'updated_at', 'category_id')
+    ]
+    shards += paginate('products', keys, product_results, page_size, base_url)
+
+    by_category = {pk: [] for pk in category_updated}
+    for key in keys:
+        by_category[key[2]].append(key)
+    for category_id, category_keys in by_category.items():
+        shards += paginate(f'categories/{category_id}/products', category_keys, product_results,
+                           page_size, base_url)
+    return shards
+
+
+# ===== ESCRITURA =====
+
+def _write(path, content):
+    """Escribe `path` de forma atómica: quien lo sirve nunca ve un archivo a medias"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(content)
+    # mkstemp crea el archivo con permisos 0600
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def write_shard(path, content):
+    """Escribe el JSON y sus versiones comprimidas; devuelve la entrada del manifiesto"""
+    entry = {'etag': '"{}"'.format(hashlib.sha1(content).hexdigest()), 'bytes': len(content)}
+    _write(path, content)
+    compressed = gzip.compress(content, compresslevel=9, mtime=0)
+    _write(path.with_name(path.name + '.gz'), compressed)
+    entry['gzip_bytes'] = len(compressed)
+    br = path.with_name(path.name + '.br')
+    if brotli is not None:
+        compressed = brotli.compress(content, quality=11)
+        _write(br, compressed)
+        entry['br_bytes'] = len(compressed)
+    else:
+        br.unlink(missing_ok=True)
+    return entry
+
+
+def remove_shard(directory, path):
+    target = directory / path
+    for suffix in ('', '.gz', '.br'):
+        target.with_name(target.name + suffix).unlink(missing_ok=True)
+    # Directorios que quedaron vacíos (categorías eliminadas)
+    for parent in target.parents:
+        if parent == directory:
+            break
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+
+
+def load_manifest(directory):
+    try:
+        return json.loads((directory / MANIFEST).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def export_snapshot(directory, page_size, base_url, force=False):
+    """
+    Escribe las páginas que cambiaron desde la exportación anterior, borra
+    las que ya no existen y al final el manifiesto. Devuelve
+    (escritas, sin cambios, borradas).
+    """
+    directory = Path(directory)
+    previous = load_manifest(directory)
+    options = {'format': FORMAT, 'page_size': page_size, 'base_url': base_url}
+    if any(previous.get(name) != value for name, value in options.items()):
+        force = True
+    old = previous.get('shards', {})
+
+    renderer = FastJSONRenderer()
+    entries, written = {}, 0
+    for shard in catalog_shards(page_size, base_url):
+        fingerprint = shard.fingerprint()
+        entry = old.get(shard.path)
+        if not force and entry and entry['fingerprint'] == fingerprint and (directory / shard.path).exists():
+            entries[shard.path] = entry
+            continue
+        entry = write_shard(directory / shard.path, shard.render(renderer))
+        entries[shard.path] = {**entry, 'items': len(shard.keys), 'fingerprint': fingerprint}
+        written += 1
+
+    removed = [path for path in old if path not in entries]
+    for path in removed:
+        remove_shard(directory, path)
+    manifest = {**options, 'generated_at': timezone.now().isoformat(), 'shards': entries}
+    _write(directory / MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return written, len(entries) - written, len(removed)
@@ -1,3 +1,1958 @@
-from django.test import TestCase
+"""
+Pruebas de comportamiento (checkout y stock, estadísticas y transiciones
+de órdenes, rankings, búsqueda, caché del catálogo, importación, métricas,
+carritos y reservas), de consultas N+1, del router de réplica, de los
+listados de rows.py, del snapshot estático y del feed de cambios del
+catálogo.
 
-# Create your tests here.
+Cada prueba N+1 mide un endpoint con N filas y otra vez con 10N; la cantidad
+de consultas SQL debe ser la misma. Si crece, el error indica qué campo de
+serializer disparó las consultas extra (por ejemplo `OrderSerializer.items`)
+y cuántas hizo con cada tamaño.
+"""
+import csv
+import gzip
+import json
+import re
+import shutil
+import sqlite3
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .benchmarks import seed_catalog, seed_orders, seed_user
+from .management.commands.benchmark_endpoints import (
+    SCENARIOS as BENCHMARK_SCENARIOS, Command as BenchmarkEndpointsCommand
+)
+from .management.commands.explain_queries import PROBLEMS as EXPLAIN_PROBLEMS, Variant as ExplainVariant
+from .metrics import (
+    REGISTRY, MetricsRegistry, RequestStats, install_query_wrapper, install_serializer_timing
+)
+from .models import (
+    Cart, CartItem, CatalogTombstone, Category, Order, OrderItem, OrderStatistics, Product, ProductPopularity,
+    ProductRanking, StockReservation
+)
+from .rankings import EPOCH, MAX_EXPONENT, decay_weight, rebuild_rankings, record_sales, refresh_featured
+from .renderers import FastJSONRenderer
+from .reservations import release_expired_reservations, reserve_stock
+from .routers import REPLICA_PIN_COOKIE, ReplicaRouter, RoutingState, _routing
+from .rows import RowMapper, row_mapper
+from .serializers import OrderSerializer, ProductListSerializer, ProductSerializer
+from .services import (
+    InsufficientStock, checkout_cart, compute_order_statistics, decrement_stock, get_order_statistics,
+    transition_orders
+)
+from .snapshots import export_snapshot
+
+
+# ===== ATRIBUCIÓN DE CONSULTAS =====
+
+class TracedField:
+    """Envuelve un campo para que las consultas que dispare se le atribuyan"""
+
+    def __init__(self, field, label, stack):
+        self._field = field
+        self._label = label
+        self._stack = stack
+
+    def __getattr__(self, name):
+        return getattr(self._field, name)
+
+    def get_attribute(self, instance):
+        return self._traced(self._field.get_attribute, instance)
+
+    def to_representation(self, value):
+        return self._traced(self._field.to_representation, value)
+
+    def _traced(self, method, value):
+        self._stack.append(self._label)
+        try:
+            return method(value)
+        finally:
+            self._stack.pop()
+
+
+@contextmanager
+def queries_by_field():
+    """
+    Cuenta las consultas SQL por campo de serializer (`Serializer.campo`,
+    el más interno si están anidados). Las que ocurren fuera de la
+    serialización se cuentan bajo None.
+    """
+    counts = Counter()
+    stack = []
+    readable_fields = serializers.Serializer._readable_fields
+
+    def traced_fields(serializer):
+        for field in readable_fields.fget(serializer):
+            yield TracedField(field, f'{type(serializer).__name__}.{field.field_name}', stack)
+
+    def record(execute, sql, params, many, context):
+        counts[stack[-1] if stack else None] += 1
+        return execute(sql, params, many, context)
+
+    with mock.patch.object(serializers.Serializer, '_readable_fields', property(traced_fields)):
+        with connection.execute_wrapper(record):
+            yield counts
+
+
+# ===== BASE =====
+
+@override_settings(ALLOWED_HOSTS=['*'], CATALOG_CACHE_TIMEOUT=0)
+class QueryScalingTestCase(TestCase):
+    N = 2
+
+    def setUp(self):
+        self.user = seed_user('n1-user')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        self.seeded = 0
+
+    def request(self, method, path, data=None, auth=True):
+        kwargs = dict(self.auth) if auth else {}
+        if data is not None:
+            kwargs.update(data=data, content_type='application/json')
+        return getattr(self.client, method)(path, **kwargs)
+
+    def assertConstantQueries(self, grow, call):
+        """
+        `grow(n)` lleva los datos del endpoint a n filas y `call()` hace la
+        petición (y devuelve la respuesta). Compara N contra 10N.
+        """
+        # Calentamiento: sesión, fila de estadísticas, etc. solo se crean una vez
+        grow(self.N)
+        call()
+        measured = []
+        for size in (self.N, self.N * 10):
+            grow(size)
+            with queries_by_field() as counts:
+                response = call()
+            self.assertLess(response.status_code, 400, response.content[:500])
+            measured.append((size, counts))
+
+        (small, few), (large, many) = measured
+        if sum(few.values()) == sum(many.values()):
+            return
+        grown = [
+            f'  {field or "(fuera de los serializers)"}: {few[field]} consultas con {small} filas, '
+            f'{many[field]} con {large}'
+            for field in sorted(set(few) | set(many), key=str)
+            if few[field] != many[field]
+        ]
+        self.fail(
+            f'Las consultas crecen con los datos ({sum(few.values())} -> {sum(many.values())}):\n'
+            + '\n'.join(grown)
+        )
+
+
+# ===== CATÁLOGO =====
+
+class CatalogQueryTests(QueryScalingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = seed_catalog(products=0, categories=1, prefix='n1-base')[0][0]
+
+    def grow_products(self, size):
+        """Productos destacados en self.category hasta llegar a `size`"""
+        Product.objects.bulk_create([
+            Product(category=self.category, title=f'Libro {i}', author=f'Autor {i}', isbn=f'n1-{i}',
+                    description='Libro de prueba', price=10, stock=100, rating=4.5)
+            for i in range(self.seeded, size)
+        ])
+        self.seeded = max(self.seeded, size)
+        refresh_featured()
+
+    def grow_sales(self, size):
+        """Productos con una venta cada uno (para los más vendidos) hasta llegar a `size`"""
+        start = self.seeded
+        self.grow_products(size)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_sales(
+                (pk, 1, timezone.now())
+                for pk in self.category.products.order_by('pk').values_list('pk', flat=True)[start:size]
+            )
+
+    def grow_categories(self, size):
+        """Categorías (con un producto cada una) hasta llegar a `size`"""
+        categories = Category.objects.bulk_create([
+            Category(name=f'Categoría {i}', slug=f'n1-cat-{i}', description='Categoría de prueba')
+            for i in range(self.seeded, size)
+        ])
+        Product.objects.bulk_create([
+            Product(category=category, title=category.name, author='Autor', description='Libro de prueba',
+                    price=10, stock=100)
+            for category in categories
+        ])
+        self.seeded = max(self.seeded, size)
+
+    def test_product_list(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/products/?page_size=100', auth=False))
+
+    def test_product_list_fields(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/products/?page_size=100&fields=id,title,category_name', auth=False))
+
+    def test_product_list_omit(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/products/?page_size=100&omit=category_name', auth=False))
+
+    def test_product_list_page_number(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/products/?page=1', auth=False))
+
+    def test_product_retrieve(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', f'/api/products/{self.category.products.first().pk}/', auth=False))
+
+    def test_product_retrieve_omit(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', f'/api/products/{self.category.products.first().pk}/?omit=description,category_name',
+            auth=False))
+
+    def test_featured(self):
+        self.N = 1
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/products/featured/', auth=False))
+
+    def test_bestsellers(self):
+        self.assertConstantQueries(self.grow_sales, lambda: self.request(
+            'get', '/api/products/bestsellers/', auth=False))
+
+    def test_bestsellers_by_category(self):
+        self.assertConstantQueries(self.grow_sales, lambda: self.request(
+            'get', f'/api/products/bestsellers/?category_id={self.category.pk}', auth=False))
+
+    def test_by_category(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', f'/api/products/by_category/?category_id={self.category.pk}', auth=False))
+
+    def test_category_list(self):
+        self.assertConstantQueries(self.grow_categories, lambda: self.request(
+            'get', '/api/categories/?page_size=100', auth=False))
+
+    def test_category_retrieve(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', f'/api/categories/{self.category.pk}/', auth=False))
+
+    def test_category_products(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', f'/api/categories/{self.category.pk}/products/?page_size=100', auth=False))
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+    def test_catalog_changes(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/catalog/changes/?limit=500', auth=False))
+
+    def test_async_product_list(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/async/products/?page_size=100', auth=False))
+
+    def test_async_featured(self):
+        self.N = 1
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', '/api/async/products/featured/', auth=False))
+
+    def test_async_by_category(self):
+        self.assertConstantQueries(self.grow_products, lambda: self.request(
+            'get', f'/api/async/products/by_category/?category_id={self.category.pk}', auth=False))
+
+    def test_async_category_list(self):
+        self.assertConstantQueries(self.grow_categories, lambda: self.request(
+            'get', '/api/async/categories/?page_size=100', auth=False))
+
+
+# ===== CAMPOS A PEDIDO =====
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductFieldsetTests(TestCase):
+    LIST_FIELDS = ['id', 'category', 'category_name', 'title', 'author', 'isbn', 'description',
+                   'price', 'stock', 'image_url', 'rating']
+
+    @classmethod
+    def setUpTestData(cls):
+        _, (cls.product,) = seed_catalog(products=1, categories=1, prefix='fieldsets')
+        cls.product.description = 'palabra ' * 100
+        cls.product.rating = Decimal('4.50')
+        cls.product.save()
+        refresh_featured()
+
+    def get(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response.json()
+
+    def test_default_list_fields(self):
+        # Lo que leen las tarjetas del frontend: cambiarlo rompe clientes
+        item, = self.get('/api/products/')['results']
+        self.assertEqual(list(item), self.LIST_FIELDS)
+        self.assertEqual(item['description'], self.product.description[:299] + '…')
+        for path in ['/api/products/featured/', f'/api/products/by_category/?category_id={self.product.category_id}']:
+            self.assertEqual(list(self.get(path)[0]), self.LIST_FIELDS)
+
+    def test_full_description_on_request(self):
+        full = self.product.description.strip()
+        self.assertEqual(self.get(f'/api/products/{self.product.pk}/')['description'].strip(), full)
+        item, = self.get('/api/products/?fields=id,description')['results']
+        self.assertEqual(item['description'].strip(), full)
+        item, = self.get('/api/products/?omit=description,isbn')['results']
+        self.assertEqual(list(item), [name for name in self.LIST_FIELDS if name not in ('description', 'isbn')])
+
+
+# ===== CARRITO =====
+
+class CartQueryTests(QueryScalingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create(user=self.user)
+        _, self.products = seed_catalog(products=self.N * 10 + 1, categories=2, prefix='n1-cart')
+        self.extra = self.products.pop()
+
+    def grow_cart(self, size):
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=product, quantity=1)
+            for product in self.products[self.seeded:size]
+        ])
+        self.seeded = size
+
+    def test_my_cart(self):
+        self.assertConstantQueries(self.grow_cart, lambda: self.request('get', '/api/cart/my_cart/'))
+
+    def test_add_item(self):
+        def call():
+            CartItem.objects.filter(product=self.extra).delete()
+            return self.request('post', '/api/cart/add_item/', {'product_id': self.extra.pk, 'quantity': 1})
+        self.assertConstantQueries(self.grow_cart, call)
+
+    def test_update_item(self):
+        self.assertConstantQueries(self.grow_cart, lambda: self.request('patch', '/api/cart/update_item/', {
+            'item_id': self.cart.items.order_by('pk').first().pk, 'quantity': 2}))
+
+    def test_batch(self):
+        self.assertConstantQueries(self.grow_cart, lambda: self.request('post', '/api/cart/batch/', {
+            'operations': [{'op': 'set', 'product_id': self.extra.pk, 'quantity': 1}]}))
+
+
+# ===== ÓRDENES =====
+
+class OrderQueryTests(QueryScalingTestCase):
+    def setUp(self):
+        super().setUp()
+        _, self.products = seed_catalog(products=self.N * 10, categories=2, prefix='n1-orders')
+
+    def grow_orders(self, size):
+        seed_orders([self.user], self.products, orders_per_user=size - self.seeded,
+                    prefix=f'n1-{size}')
+        self.seeded = size
+
+    def grow_items(self, size):
+        """Una sola orden (la más reciente) con `size` items"""
+        if not self.seeded:
+            self.order = seed_orders([self.user], self.products, orders_per_user=1, items_per_order=0)[0]
+        self.add_items(self.order, self.products[self.seeded:size])
+        self.seeded = max(self.seeded, size)
+
+    def new_pending_order(self, size):
+        """Orden pendiente nueva con `size` items (con save(), así se cuenta en las estadísticas)"""
+        self.order = Order.objects.create(
+            user=self.user, payment_method='cash', subtotal=10, total=15,
+            shipping_address='Av. Prueba 123', shipping_city='Lima',
+            shipping_postal_code='15001', phone='999999999',
+        )
+        self.add_items(self.order, self.products[:size])
+
+    def add_items(self, order, products):
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, product_title=product.title,
+                      product_author=product.author, quantity=1, price=product.price,
+                      subtotal=product.price)
+            for product in products
+        ])
+
+    def grow_cart(self, size):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=1)
+            for product in self.products[self.seeded:size]
+        ])
+        self.seeded = size
+
+    def test_list(self):
+        self.assertConstantQueries(self.grow_orders, lambda: self.request('get', '/api/orders/?page_size=100'))
+
+    def test_history(self):
+        self.assertConstantQueries(self.grow_orders, lambda: self.request(
+            'get', '/api/orders/history/?page_size=100'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(self.grow_items, lambda: self.request(
+            'get', f'/api/orders/{self.order.pk}/'))
+
+    def test_statistics(self):
+        self.assertConstantQueries(self.grow_items, lambda: self.request('get', '/api/orders/statistics/'))
+
+    def test_cancel(self):
+        self.assertConstantQueries(self.new_pending_order, lambda: self.request(
+            'patch', f'/api/orders/{self.order.pk}/cancel/'))
+
+    def test_create_order(self):
+        def call():
+            response = self.request('post', '/api/orders/create_order/', {
+                'payment_method': 'cash', 'shipping_address': 'Av. Prueba 123',
+                'shipping_city': 'Lima', 'shipping_postal_code': '15001', 'phone': '999999999',
+            })
+            # El checkout vacía el carrito: volver a llenarlo para la siguiente medición
+            self.seeded = 0
+            return response
+        self.assertConstantQueries(self.grow_cart, call)
+
+
+# ===== RÉPLICA =====
+
+class FileReplicaRouter(ReplicaRouter):
+    primary = 'file_primary'
+    replica = 'file_replica'
+
+
+@override_settings(ALLOWED_HOSTS=['*'], CATALOG_CACHE_TIMEOUT=0,
+                   DATABASE_ROUTERS=['products.tests.FileReplicaRouter'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    Dos archivos SQLite: la primaria y una copia (la réplica) tomada antes de
+    agregar `self.recent`, que representa el retraso de replicación.
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = Path(tempfile.mkdtemp())
+        base = connections.settings['default']
+        primary, replica = cls.tmpdir / 'primary.sqlite3', cls.tmpdir / 'replica.sqlite3'
+        # El perfil de un despliegue con SQLITE_WAL (settings.py)
+        init_command = f"{base['OPTIONS']['init_command']};PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL"
+        connections.settings['file_primary'] = {
+            **base, 'NAME': str(primary), 'TEST': {},
+            'OPTIONS': {**base['OPTIONS'], 'init_command': init_command},
+        }
+        connections.settings['file_replica'] = {
+            **base, 'NAME': f'file:{replica}?mode=ro', 'TEST': {},
+            'OPTIONS': {**base['OPTIONS'], 'transaction_mode': None},
+        }
+        call_command('migrate', database='file_primary', verbosity=0)
+
+        cls.category = Category.objects.using('file_primary').create(name='Réplica', slug='replica')
+        cls.replicated = cls.create_product('Libro replicado', 'replica-1')
+        with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+            source.backup(target)
+        # Después de la copia: solo existen en la primaria
+        cls.recent = cls.create_product('Libro reciente', 'replica-2')
+        cls.user = User.objects.db_manager('file_primary').create_user('replica-user', password='clave-segura-1')
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in ('file_primary', 'file_replica'):
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        shutil.rmtree(cls.tmpdir)
+
+    @classmethod
+    def create_product(cls, title, isbn):
+        return Product.objects.using('file_primary').create(
+            category=cls.category, title=title, author='Autor', isbn=isbn,
+            description='Libro de prueba', price=10, stock=100,
+        )
+
+    def titles(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return {product['title'] for product in response.json()['results']}
+
+    def test_catalog_reads_from_replica(self):
+        self.assertEqual(self.titles('/api/products/'), {'Libro replicado'})
+        self.assertEqual(self.titles('/api/async/products/'), {'Libro replicado'})
+        self.assertEqual(self.client.get(f'/api/products/{self.recent.pk}/').status_code, 404)
+
+    def test_pin_cookie_reads_from_primary(self):
+        self.client.cookies[REPLICA_PIN_COOKIE] = '1'
+        self.assertEqual(self.titles('/api/products/'), {'Libro replicado', 'Libro reciente'})
+
+    def test_cart_and_auth_use_primary(self):
+        # El usuario y el producto todavía no llegaron a la réplica
+        response = self.client.post('/api/auth/login/', {
+            'username': 'replica-user', 'password': 'clave-segura-1'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {response.json()["access"]}'}
+        response = self.client.post('/api/cart/add_item/', {'product_id': self.recent.pk, 'quantity': 1},
+                                    content_type='application/json', **auth)
+        self.assertLess(response.status_code, 400, response.content[:500])
+
+        # Leer lo propio: después de escribir, el catálogo se lee de la primaria
+        self.assertIn(REPLICA_PIN_COOKIE, response.cookies)
+        self.assertIn('Libro reciente', self.titles('/api/products/'))
+
+    def test_write_pins_rest_of_request(self):
+        router = FileReplicaRouter()
+        request = self.client.get('/api/products/').wsgi_request
+        token = _routing.set(RoutingState(request))
+        try:
+            self.assertEqual(router.db_for_read(Product), 'file_replica')
+            self.assertEqual(router.db_for_read(Cart), 'file_primary')
+            self.assertEqual(router.db_for_write(Product), 'file_primary')
+            self.assertEqual(router.db_for_read(Product), 'file_primary')
+        finally:
+            _routing.reset(token)
+        # Fuera de una petición todo va a la primaria
+        self.assertEqual(router.db_for_read(Product), 'file_primary')
+
+    def test_sqlite_profile(self):
+        with connections['file_primary'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA mmap_size')
+            self.assertGreater(cursor.fetchone()[0], 0)
+        with self.assertRaisesMessage(Exception, 'readonly'):
+            Category.objects.using('file_replica').create(name='Escritura', slug='escritura')
+
+    def test_wal_is_opt_in(self):
+        # Sin SQLITE_WAL la conexión no cambia el modo del archivo (db.sqlite3 está en el repositorio)
+        init_command = settings.DATABASES['default']['OPTIONS']['init_command']
+        self.assertEqual('journal_mode=WAL' in init_command, settings.SQLITE_WAL)
+        self.assertIn('synchronous=NORMAL' if settings.SQLITE_WAL else 'synchronous=FULL', init_command)
+
+
+# ===== LISTADOS SIN SERIALIZERS =====
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class FastRowsParityTests(TestCase):
+    """Los listados de rows.py devuelven los mismos bytes que los serializers"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categories, products = seed_catalog(products=12, categories=2, prefix='parity')
+        # Texto que el renderer escapa o no: acentos, emoji, comillas, U+2028/U+2029
+        products[0].title = 'Línea\u2028párrafo\u2029 "cita" \\ 🐉'
+        products[0].isbn = None
+        products[0].image_url = None
+        products[1].price = Decimal('0.10')
+        # Más larga que el resumen de ProductListSerializer
+        products[2].description = 'dragón ' * 80
+        for product, rating in zip(products, ['4.00', '4.99', '4.50']):
+            product.rating = Decimal(rating)
+        Product.objects.bulk_update(products[:3], ['title', 'isbn', 'image_url', 'price', 'rating', 'description'])
+        cls.category = categories[0]
+        cls.user = seed_user('parity-user')
+        User.objects.filter(pk=cls.user.pk).update(first_name='Ñandú', last_name='')
+        orders = seed_orders([cls.user], products, orders_per_user=6)
+        # Un item cuyo producto se eliminó (product = NULL)
+        OrderItem.objects.filter(order=orders[0]).update(product=None)
+        with cls.captureOnCommitCallbacks(execute=True):
+            record_sales((product.pk, 1, timezone.now()) for product in products[:5])
+        refresh_featured()
+
+    def setUp(self):
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def get(self, path):
+        response = self.client.get(path, **self.auth)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response
+
+    def assertSameBytes(self, path):
+        with override_settings(FAST_ROWS=False):
+            expected = self.get(path)
+        with override_settings(FAST_ROWS=True), \
+                mock.patch.object(RowMapper, 'data', autospec=True, side_effect=RowMapper.data) as data:
+            response = self.get(path)
+        self.assertTrue(data.called, f'{path} no usó RowMapper')
+        self.assertEqual(response.content, expected.content, path)
+        # El renderer con orjson produce lo mismo que JSONRenderer con estos datos
+        self.assertEqual(FastJSONRenderer().render(response.data), response.content, path)
+        return response
+
+    def test_mappers_compile(self):
+        for serializer_class in (ProductListSerializer, ProductSerializer, OrderSerializer):
+            self.assertIsNotNone(row_mapper(serializer_class), serializer_class.__name__)
+
+    def test_product_list(self):
+        for query in ['', '?page_size=5', '?page=1', '?ordering=price', '?ordering=-rating',
+                      '?search=espada', f'?category={self.category.pk}',
+                      '?fields=id,title,description,created_at,category_name', '?omit=isbn,rating']:
+            self.assertSameBytes(f'/api/products/{query}')
+        next_page = self.assertSameBytes('/api/products/?page_size=5').json()['next']
+        self.assertSameBytes(next_page)
+
+    def test_catalog_actions(self):
+        for path in ['/api/products/featured/', '/api/products/featured/?fields=id,title,price',
+                     '/api/products/bestsellers/', f'/api/products/bestsellers/?category_id={self.category.pk}',
+                     f'/api/products/by_category/?category_id={self.category.pk}']:
+            self.assertSameBytes(path)
+
+    def test_order_history(self):
+        for query in ['', '?status=pending', '?page_size=2', '?pagination=page']:
+            self.assertSameBytes(f'/api/orders/history/{query}')
+        next_page = self.assertSameBytes('/api/orders/history/?page_size=2').json()['next']
+        self.assertSameBytes(next_page)
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    """Dónde FastJSONRenderer coincide con JSONRenderer y dónde no (ver renderers.py)"""
+
+    def render(self, data):
+        return FastJSONRenderer().render(data), JSONRenderer().render(data)
+
+    def test_same_bytes(self):
+        data = {
+            'texto': 'Línea\u2028párrafo\u2029 "cita" \\ 🐉 </script>', 'vacío': '', 'nulo': None,
+            'enteros': [0, -1, 2 ** 63 - 1], 'bool': [True, False], 'precio': Decimal('10.50'),
+            'fecha': timezone.now(), 'floats': [0.1 + 0.2, 1.0, -0.0, 100.0, 5e-324, 123456789.123],
+            'anidado': [{'a': [{}]}],
+        }
+        fast, expected = self.render(data)
+        self.assertEqual(fast, expected)
+        # Claves que no son texto y enteros de más de 64 bits: JSONRenderer tal cual
+        for data in [{1: 'a'}, {'grande': 2 ** 64}]:
+            self.assertEqual(*self.render(data))
+
+    def test_float_exponents_differ_in_format_only(self):
+        for value, fast, expected in [
+            (1e-07, b'1e-7', b'1e-07'),
+            (1e16, b'1e16', b'1e+16'),
+            (1.7976931348623157e308, b'1.7976931348623157e308', b'1.7976931348623157e+308'),
+        ]:
+            self.assertEqual(self.render([value]), (b'[%s]' % fast, b'[%s]' % expected))
+            self.assertEqual(json.loads(b'[%s]' % fast), [value])
+
+    def test_nan_and_infinity(self):
+        for value in [float('nan'), float('inf'), float('-inf')]:
+            self.assertEqual(FastJSONRenderer().render({'v': value}), b'{"v":null}')
+            with self.assertRaises(ValueError):
+                JSONRenderer().render({'v': value})
+
+    def test_json_renderer_is_the_default(self):
+        self.assertEqual(api_settings.DEFAULT_RENDERER_CLASSES[0], JSONRenderer)
+
+
+# ===== SNAPSHOT ESTÁTICO =====
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class CatalogSnapshotTests(TestCase):
+    PAGE_SIZE = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(products=25, categories=2, prefix='snapshot')
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def export(self):
+        return export_snapshot(self.tmpdir, self.PAGE_SIZE, '/snapshot/')
+
+    def shard(self, path):
+        return json.loads((self.tmpdir / path).read_bytes())
+
+    def test_pages_match_api(self):
+        self.export()
+        category = self.categories[0]
+        for api, path in [
+            ('/api/products/', 'products'),
+            ('/api/categories/', 'categories'),
+            (f'/api/categories/{category.pk}/products/', f'categories/{category.pk}/products'),
+        ]:
+            response = self.client.get(f'{api}?page_size={self.PAGE_SIZE}')
+            self.assertEqual(self.shard(f'{path}/page-1.json')['results'], response.json()['results'], api)
+        # Las páginas siguientes tienen lo mismo que seguir los cursores
+        response = self.client.get(self.client.get(f'/api/products/?page_size={self.PAGE_SIZE}').json()['next'])
+        page = self.shard('products/page-2.json')
+        self.assertEqual(page['results'], response.json()['results'])
+        self.assertEqual((page['previous'], page['next']),
+                         ('/snapshot/products/page-1.json', '/snapshot/products/page-3.json'))
+        raw = (self.tmpdir / 'products/page-2.json').read_bytes()
+        self.assertEqual(gzip.decompress((self.tmpdir / 'products/page-2.json.gz').read_bytes()), raw)
+        manifest = self.shard('manifest.json')
+        self.assertEqual(manifest['shards']['products/page-2.json']['bytes'], len(raw))
+
+    def test_only_changed_pages_are_rewritten(self):
+        written, unchanged, removed = self.export()
+        self.assertEqual((unchanged, removed), (0, 0))
+        self.assertEqual(self.export(), (0, written, 0))
+
+        # Un producto cambia: su página del listado y la de su categoría
+        product = self.products[0]
+        product.price += 1
+        product.save()
+        self.assertEqual(self.export(), (2, written - 2, 0))
+        self.assertIn(str(product.price), (self.tmpdir / 'products/page-3.json').read_text())
+
+        # Sin los últimos productos sobran páginas: se reescriben las que cambian y se borran las demás
+        Product.objects.filter(pk__in=[p.pk for p in self.products[:10]]).update(is_active=False)
+        self.assertGreater(self.export()[2], 0)
+        self.assertFalse((self.tmpdir / 'products/page-3.json').exists())
+        self.assertFalse((self.tmpdir / 'products/page-3.json.gz').exists())
+
+
+# ===== FEED DE CAMBIOS =====
+
+@override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+class CatalogChangesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(products=12, categories=2, prefix='changes')
+
+    def changes(self, cursor=None, limit=5):
+        query = f'?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+        response = self.client.get(f'/api/catalog/changes/{query}')
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response.json()
+
+    def sync(self, cursor=None):
+        """Sigue las páginas hasta el final; devuelve (ids de productos, de categorías, bajas, cursor)"""
+        products, categories, deleted = [], [], {'products': [], 'categories': []}
+        while True:
+            page = self.changes(cursor)
+            self.assertLessEqual(len(page['products']) + len(page['categories'])
+                                 + sum(map(len, page['deleted'].values())), 5)
+            products += [product['id'] for product in page['products']]
+            categories += [category['id'] for category in page['categories']]
+            for kind in deleted:
+                deleted[kind] += page['deleted'][kind]
+            cursor = page['cursor']
+            if not page['has_more']:
+                self.assertIsNone(page['next'])
+                return products, categories, deleted, cursor
+
+    def test_initial_sync_then_deltas(self):
+        products, categories, deleted, cursor = self.sync()
+        self.assertCountEqual(products, [product.pk for product in self.products])
+        self.assertCountEqual(categories, [category.pk for category in self.categories])
+        self.assertEqual(deleted, {'products': [], 'categories': []})
+        self.assertEqual(self.sync(cursor)[:3], ([], [], {'products': [], 'categories': []}))
+
+        changed = self.products[3]
+        changed.price = Decimal('99.90')
+        changed.save()
+        page = self.changes(cursor)
+        self.assertEqual([product['id'] for product in page['products']], [changed.pk])
+        self.assertEqual(page['products'][0]['price'], '99.90')
+        self.assertNotIn('reserved_stock', page['products'][0])
+
+    def test_tombstones(self):
+        cursor = self.sync()[3]
+        deactivated, removed, category = self.products[0], self.products[2], self.categories[1]
+        expected = {
+            'products': {deactivated.pk, removed.pk, *category.products.values_list('pk', flat=True)},
+            'categories': {category.pk},
+        }
+        deactivated.is_active = False
+        deactivated.save()
+        removed.delete()
+        category.delete()
+
+        products, categories, deleted, _ = self.sync(cursor)
+        self.assertEqual((products, categories), ([], []))
+        self.assertEqual({kind: set(ids) for kind, ids in deleted.items()}, expected)
+        self.assertEqual(len(deleted['products']), len(expected['products']))
+
+    def test_invalid_and_expired_cursor(self):
+        self.assertEqual(self.client.get('/api/catalog/changes/?cursor=basura').status_code, 404)
+        cursor = self.changes()['cursor']
+        with override_settings(CHANGE_FEED_RETENTION_DAYS=0):
+            self.assertEqual(self.client.get(f'/api/catalog/changes/?cursor={cursor}').status_code, 410)
+        CatalogTombstone.objects.create(kind=CatalogTombstone.PRODUCT, object_id=1,
+                                        deleted_at=timezone.now() - timedelta(days=60))
+        call_command('prune_catalog_tombstones', stdout=StringIO())
+        self.assertFalse(CatalogTombstone.objects.exists())
+
+
+
+# ===== CHECKOUT =====
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class CheckoutTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.products = seed_catalog(products=2, categories=1, stock=5, prefix='checkout')
+        cls.user = seed_user('checkout-user')
+
+    def stock(self, product):
+        return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+    def fill_cart(self, quantities):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity) for product, quantity in quantities
+        ])
+        return cart
+
+    def checkout(self):
+        return checkout_cart(self.user, payment_method='cash', shipping_address='Av. Prueba 123',
+                             shipping_city='Lima', shipping_postal_code='15001', phone='999999999')
+
+    def test_concurrent_buyers_cannot_oversell(self):
+        # Los dos compradores leyeron stock=5 y piden 3: solo el primer UPDATE cumple la condición
+        product = self.products[0]
+        decrement_stock({product.pk: 3})
+        with self.assertRaises(InsufficientStock) as ctx:
+            decrement_stock({product.pk: 3})
+        self.assertEqual(ctx.exception.products, [product])
+        self.assertEqual(ctx.exception.available_for(product), 2)
+        self.assertEqual(self.stock(product), 2)
+
+    def test_decrement_is_all_or_nothing(self):
+        first, second = self.products
+        with self.assertRaises(InsufficientStock) as ctx:
+            decrement_stock({first.pk: 2, second.pk: 6})
+        self.assertEqual(ctx.exception.products, [second])
+        self.assertEqual((self.stock(first), self.stock(second)), (5, 5))
+
+    def test_checkout(self):
+        first, second = self.products
+        cart = self.fill_cart([(first, 2), (second, 1)])
+        order = self.checkout()
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity')), [(first.pk, 2), (second.pk, 1)]
+        )
+        self.assertEqual(order.subtotal, first.price * 2 + second.price)
+        self.assertEqual((self.stock(first), self.stock(second)), (3, 4))
+        self.assertFalse(cart.items.exists())
+
+    def test_checkout_rolls_back_when_stock_runs_out(self):
+        first, second = self.products
+        cart = self.fill_cart([(first, 2), (second, 3)])
+        # Otro comprador se llevó el stock del segundo producto después de armar el carrito
+        Product.objects.filter(pk=second.pk).update(stock=1)
+        with self.assertRaises(InsufficientStock):
+            self.checkout()
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+        self.assertEqual((self.stock(first), self.stock(second)), (5, 1))
+        self.assertEqual(cart.items.count(), 2)
+
+    def test_create_order_without_items(self):
+        url = '/api/orders/create_order/'
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        response = self.client.post(url, SHIPPING, content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['non_field_errors'], ['No se encontró un carrito'])
+        Cart.objects.create(user=self.user)
+        response = self.client.post(url, SHIPPING, content_type='application/json', **auth)
+        self.assertEqual(response.json()['non_field_errors'], ['El carrito está vacío'])
+
+
+# ===== ESTADÍSTICAS DE ÓRDENES =====
+
+@override_settings(ORDER_STATISTICS_MATERIALIZED=True)
+class OrderStatisticsTests(TestCase):
+
+    def setUp(self):
+        self.user = seed_user('stats-user')
+
+    def create_order(self, total, status='pending'):
+        return Order.objects.create(
+            user=self.user, status=status, payment_method='cash', subtotal=total, total=total,
+            shipping_address='Av. Prueba 123', shipping_city='Lima',
+            shipping_postal_code='15001', phone='999999999',
+        )
+
+    def assertMatchesLive(self):
+        """La fila materializada coincide con la agregación en vivo"""
+        stats = OrderStatistics.objects.get(user=self.user)
+        live = compute_order_statistics(self.user)
+        self.assertEqual({field: getattr(stats, field) for field in live}, live)
+        return stats
+
+    def test_counters_follow_creates_status_changes_and_deletes(self):
+        first = self.create_order(Decimal('10.00'))
+        second = self.create_order(Decimal('25.50'))
+        stats = self.assertMatchesLive()
+        self.assertEqual((stats.total_orders, stats.pending_count, stats.last_order_id), (2, 2, second.pk))
+
+        first.status = 'processing'
+        first.save()
+        second = Order.objects.get(pk=second.pk)
+        second.status = 'cancelled'
+        second.save()
+        stats = self.assertMatchesLive()
+        self.assertEqual((stats.pending_count, stats.processing_count, stats.cancelled_count), (0, 1, 1))
+
+        second.delete()
+        stats = self.assertMatchesLive()
+        self.assertEqual((stats.total_orders, stats.total_spent, stats.last_order_id), (1, Decimal('10.00'), first.pk))
+
+    def test_endpoint_reads_materialized_row(self):
+        self.create_order(Decimal('10.00'), status='delivered')
+        with override_settings(ORDER_STATISTICS_MATERIALIZED=False):
+            live = get_order_statistics(self.user)
+        materialized = get_order_statistics(self.user)
+        self.assertEqual(materialized, live)
+        self.assertEqual(materialized['orders_by_status']['delivered'], 1)
+
+    def test_user_delete_removes_row(self):
+        self.create_order(Decimal('10.00'))
+        self.user.delete()
+        self.assertFalse(OrderStatistics.objects.exists())
+
+
+# ===== TRANSICIONES DE ÓRDENES =====
+
+@override_settings(ORDER_STATISTICS_MATERIALIZED=True)
+class OrderTransitionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.products = seed_catalog(products=2, categories=1, stock=10, prefix='transition')
+        cls.user = seed_user('transition-user')
+
+    def place_order(self, quantity=2):
+        """Orden pendiente creada por el checkout (descuenta stock y suma popularidad)"""
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=quantity)
+                                      for product in self.products])
+        with self.captureOnCommitCallbacks(execute=True):
+            return checkout_cart(self.user, payment_method='cash', shipping_address='Av. Prueba 123',
+                                 shipping_city='Lima', shipping_postal_code='15001', phone='999999999')
+
+    def statuses(self, *orders):
+        return [Order.objects.values_list('status', flat=True).get(pk=order.pk) for order in orders]
+
+    def test_only_allowed_transitions_change(self):
+        pending, processing, delivered = self.place_order(), self.place_order(), self.place_order()
+        transition_orders(Order.objects.filter(pk=processing.pk), 'processing')
+        transition_orders(Order.objects.filter(pk=delivered.pk), 'processing')
+        transition_orders(Order.objects.filter(pk=delivered.pk), 'shipped')
+        transition_orders(Order.objects.filter(pk=delivered.pk), 'delivered')
+
+        # Solo la orden en proceso puede pasar a enviada
+        self.assertEqual(transition_orders(Order.objects.all(), 'shipped'), 1)
+        self.assertEqual(self.statuses(pending, processing, delivered), ['pending', 'shipped', 'delivered'])
+        self.assertEqual(transition_orders(Order.objects.filter(pk=delivered.pk), 'cancelled'), 0)
+
+    def test_from_statuses_narrows_the_allowed_states(self):
+        pending, processing = self.place_order(), self.place_order()
+        transition_orders(Order.objects.filter(pk=processing.pk), 'processing')
+        self.assertEqual(transition_orders(Order.objects.all(), 'cancelled', from_statuses=['pending']), 1)
+        self.assertEqual(self.statuses(pending, processing), ['cancelled', 'processing'])
+
+    def test_delivered_sets_delivered_at(self):
+        order = self.place_order()
+        for status in ('processing', 'shipped', 'delivered'):
+            transition_orders(Order.objects.filter(pk=order.pk), status)
+        order.refresh_from_db()
+        self.assertIsNotNone(order.delivered_at)
+        self.assertEqual(order.updated_at, order.delivered_at)
+
+    def test_cancel_restores_stock_and_popularity(self):
+        first, second = self.place_order(quantity=2), self.place_order(quantity=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            changed = transition_orders(Order.objects.filter(pk__in=[first.pk, second.pk]), 'cancelled')
+        self.assertEqual(changed, 2)
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[p.pk for p in self.products]).values_list('stock', flat=True)),
+            [10, 10]
+        )
+        popularity = ProductPopularity.objects.filter(product__in=self.products)
+        self.assertEqual(list(popularity.values_list('units', flat=True)), [0, 0])
+        for score in popularity.values_list('score', flat=True):
+            self.assertAlmostEqual(score, 0)
+
+    def test_statistics_counters_move(self):
+        orders = [self.place_order(), self.place_order(), self.place_order()]
+        transition_orders(Order.objects.filter(pk=orders[0].pk), 'processing')
+        transition_orders(Order.objects.all(), 'cancelled')
+        stats = OrderStatistics.objects.get(user=self.user)
+        live = compute_order_statistics(self.user)
+        self.assertEqual({field: getattr(stats, field) for field in live}, live)
+        self.assertEqual((stats.pending_count, stats.processing_count, stats.cancelled_count), (0, 0, 3))
+
+    def test_admin_action_reports_skipped_orders(self):
+        pending, delivered = self.place_order(), self.place_order()
+        for status in ('processing', 'shipped', 'delivered'):
+            transition_orders(Order.objects.filter(pk=delivered.pk), status)
+        admin = User.objects.create_superuser('transition-admin', 'admin@example.com', 'admin-password')
+        self.client.force_login(admin)
+        response = self.client.post('/admin/products/order/', {
+            'action': 'cancel_orders', '_selected_action': [pending.pk, delivered.pk],
+        }, follow=True)
+        messages = [str(message) for message in response.context['messages']]
+        self.assertEqual(messages, [
+            '1 orden(es) marcadas como "Cancelado".',
+            '1 orden(es) omitidas: su estado no permite pasar a "Cancelado".',
+        ])
+        self.assertEqual(self.statuses(pending, delivered), ['cancelled', 'delivered'])
+
+
+# ===== RANKINGS =====
+
+class RankingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.products = seed_catalog(products=3, categories=1, stock=10, prefix='ranking')
+        cls.user = seed_user('ranking-user')
+
+    def listed(self, kind):
+        return list(ProductRanking.objects.filter(kind=kind, category=None)
+                    .order_by('position').values_list('product_id', flat=True))
+
+    def test_sales_update_bestsellers_after_commit(self):
+        first, second, _ = self.products
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=first, quantity=1),
+                                      CartItem(cart=cart, product=second, quantity=3)])
+        with self.captureOnCommitCallbacks() as callbacks:
+            checkout_cart(self.user, payment_method='cash', shipping_address='Av. Prueba 123',
+                          shipping_city='Lima', shipping_postal_code='15001', phone='999999999')
+        # Nada se recalcula dentro de la transacción del checkout
+        self.assertFalse(ProductPopularity.objects.exists())
+        self.assertEqual(self.listed(ProductRanking.BESTSELLERS), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.listed(ProductRanking.BESTSELLERS), [second.pk, first.pk])
+
+    def refreshes(self):
+        return mock.patch('products.rankings.refresh_featured', wraps=refresh_featured)
+
+    def test_featured_refreshed_once_per_transaction(self):
+        with self.refreshes() as refresh, self.captureOnCommitCallbacks(execute=True):
+            for product, rating in zip(self.products, ['4.50', '4.90', '4.20']):
+                product.rating = Decimal(rating)
+                product.save()
+            refresh.assert_not_called()
+        refresh.assert_called_once()
+        first, second, third = self.products
+        self.assertEqual(self.listed(ProductRanking.FEATURED), [second.pk, first.pk, third.pk])
+
+    def test_featured_follows_products_leaving_the_list(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(rating=Decimal('4.50'))
+        refresh_featured()
+        product = Product.objects.get(pk=product.pk)
+        product.rating = Decimal('1.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.listed(ProductRanking.FEATURED), [])
+
+        # Un producto que no estaba ni entra no recalcula la lista
+        product.stock = 3
+        with self.refreshes() as refresh, self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        refresh.assert_not_called()
+
+    def test_featured_refresh_survives_rollback(self):
+        product = self.products[0]
+        product.rating = Decimal('4.50')
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            product.save()
+            raise DatabaseError('revertida')
+        # El callback descartado no deja bloqueado el siguiente recálculo
+        product.rating = Decimal('4.60')
+        with self.refreshes() as refresh, self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        refresh.assert_called_once()
+        self.assertEqual(self.listed(ProductRanking.FEATURED), [product.pk])
+
+    def test_failed_sales_refresh_does_not_fail_the_commit(self):
+        with mock.patch('products.rankings.apply_sales', side_effect=DatabaseError('bloqueada')), \
+                self.assertLogs('django', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                record_sales([(self.products[0].pk, 1, timezone.now())])
+        self.assertEqual(self.listed(ProductRanking.BESTSELLERS), [])
+
+    def test_decay_weight_is_bounded(self):
+        far = EPOCH + timedelta(days=365 * 200)
+        self.assertEqual(decay_weight(far), 2.0 ** MAX_EXPONENT)
+        self.assertLess(decay_weight(EPOCH + timedelta(days=7)), decay_weight(EPOCH + timedelta(days=14)))
+        with self.captureOnCommitCallbacks(execute=True):
+            record_sales([(self.products[0].pk, 10 ** 6, far)])
+        self.assertLess(ProductPopularity.objects.get().score, float('inf'))
+
+    def test_migration_backfills_rankings(self):
+        first, second, third = self.products
+        Product.objects.filter(pk=first.pk).update(rating=Decimal('4.50'))
+        seed_orders([self.user], [second, third, second], orders_per_user=4, items_per_order=2, prefix='ranking')
+        Order.objects.filter(pk=Order.objects.order_by('pk').values('pk')[:1]).update(status='cancelled')
+
+        backfill = import_module('products.migrations.0009_rankings').backfill_rankings
+        backfill(django_apps, None)
+        backfilled = set(ProductRanking.objects.values_list('kind', 'category_id', 'position', 'product_id'))
+        popularity = set(ProductPopularity.objects.values_list('product_id', 'units'))
+
+        ProductPopularity.objects.all().delete()
+        ProductRanking.objects.all().delete()
+        rebuild_rankings()
+        self.assertEqual(backfilled, set(ProductRanking.objects.values_list(
+            'kind', 'category_id', 'position', 'product_id')))
+        self.assertEqual(popularity, set(ProductPopularity.objects.values_list('product_id', 'units')))
+        self.assertIn((ProductRanking.FEATURED, None, 1, first.pk), backfilled)
+
+
+# ===== BÚSQUEDA =====
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0, SEARCH_BACKEND='auto')
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Manga', slug='search-manga', description='Historietas')
+        cls.dragon, cls.academy, cls.pirate = [
+            Product.objects.create(category=cls.category, title=title, author=author, isbn=isbn,
+                                   description=description, price=10, stock=5)
+            for title, author, isbn, description in [
+                ('Dragón Azul Vol. 1', 'Akira Sato', 'search-1', 'Un dragón y una espada'),
+                ('Academia de Magia', 'Rumi Kato', 'search-2', 'Escuela de hechiceros'),
+                ('Piratas del Norte', 'Ken Ito', 'search-3', 'Aventura en el océano con un dragón'),
+            ]
+        ]
+
+    def search(self, term):
+        response = self.client.get('/api/products/', {'search': term})
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return [product['id'] for product in response.json()['results']]
+
+    def test_ranks_title_matches_first(self):
+        # Sin acentos y por prefijo; el título pesa más que la descripción
+        self.assertEqual(self.search('dragon'), [self.dragon.pk, self.pirate.pk])
+        self.assertEqual(self.search('acad'), [self.academy.pk])
+        self.assertEqual(self.search('norte ito'), [self.pirate.pk])
+
+    def test_index_follows_writes(self):
+        self.academy.title = 'Academia de Dragones'
+        self.academy.save()
+        self.assertIn(self.academy.pk, self.search('dragones'))
+        self.pirate.delete()
+        self.assertEqual(self.search('oceano'), [])
+
+    def test_engine_syntax_is_escaped(self):
+        for term in ['"dragón', 'dragón OR', 'NEAR(a b)', '*', 'title:magia']:
+            self.search(term)
+        self.assertEqual(self.search('(magia)*'), [self.academy.pk])
+
+    def test_icontains_fallback(self):
+        with override_settings(SEARCH_BACKEND='icontains'):
+            self.assertCountEqual(self.search('dragón'), [self.dragon.pk, self.pirate.pk])
+
+
+# ===== VISTAS ASYNC =====
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class AsyncFilterParityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(products=30, categories=3, prefix='async-filters')
+        # Algunos productos en otro idioma e inactivos, para que los filtros descarten algo
+        Product.objects.filter(pk__in=[p.pk for p in cls.products[::4]]).update(language='Inglés')
+        Product.objects.filter(pk__in=[p.pk for p in cls.products[::7]]).update(is_active=False)
+
+    def get_both(self, path, params):
+        sync = self.client.get(f'/api/{path}', params)
+        run_async = self.client.get(f'/api/async/{path}', params)
+        return sync, run_async
+
+    def assertSameResponse(self, path, params):
+        sync, run_async = self.get_both(path, params)
+        self.assertEqual((sync.status_code, run_async.status_code), (200, 200), params)
+        self.assertEqual(sync.json(), run_async.json(), params)
+        return sync.json()
+
+    def test_filters_match_the_viewset(self):
+        category = self.categories[1]
+        cases = [
+            {},
+            {'category': category.pk},
+            {'author': 'Autor 3'},
+            {'publisher': 'Editorial 5'},
+            {'language': 'Inglés'},
+            {'category': category.pk, 'language': 'Español', 'ordering': '-price'},
+            {'author': 'Autor 3', 'ordering': 'title', 'page_size': 2},
+            {'publisher': 'Editorial 5', 'fields': 'id,title,price'},
+            {'language': 'Inglés', 'search': 'edición'},
+            {'author': ''},
+        ]
+        for params in cases:
+            with self.subTest(params=params):
+                self.assertTrue(self.assertSameResponse('products/', {'page_size': 100, **params})['results'])
+        self.assertEqual(self.assertSameResponse('products/', {'author': 'Autor sin libros'})['results'], [])
+
+    def test_category_filter(self):
+        self.assertSameResponse('categories/', {'page_size': 100, 'search': 'categoría', 'ordering': '-name'})
+        # Un id que no es número: el mismo 400 que DjangoFilterBackend
+        sync, run_async = self.get_both('products/', {'category': 'abc'})
+        self.assertEqual((sync.status_code, run_async.status_code), (400, 400))
+        self.assertEqual(sync.json(), run_async.json())
+        # Categoría inexistente: la vista async no la valida (ver async_views.py)
+        sync, run_async = self.get_both('products/', {'category': 999999})
+        self.assertEqual((sync.status_code, run_async.status_code), (400, 200))
+        self.assertEqual(run_async.json()['results'], [])
+
+
+# ===== CACHÉ DEL CATÁLOGO =====
+
+@override_settings(CATALOG_CACHE_TIMEOUT=300)
+class CatalogCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories, cls.products = seed_catalog(products=3, categories=1, stock=5, prefix='cache')
+        cls.user = seed_user('cache-user')
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.product = self.products[0]
+        self.detail = f'/api/products/{self.product.pk}/'
+
+    def get(self, path, **headers):
+        response = self.client.get(path, **headers)
+        self.assertIn(response.status_code, (200, 304), response.content[:500])
+        return response
+
+    def test_etag_and_not_modified(self):
+        first = self.get(self.detail)
+        etag = first['ETag']
+        with self.assertNumQueries(0):
+            cached = self.get(self.detail)
+            not_modified = self.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(cached['ETag'], etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        # Otra query string es otra entrada
+        self.assertNotEqual(self.get(f'{self.detail}?fields=id,title')['ETag'], etag)
+
+    def test_saves_invalidate(self):
+        etag = self.get(self.detail)['ETag']
+        categories = self.get('/api/categories/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('77.00')
+            self.product.save()
+        response = self.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['price'], '77.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            category = self.categories[0]
+            category.name = 'Otra'
+            category.save()
+        self.assertNotEqual(self.get('/api/categories/')['ETag'], categories)
+
+    def test_invalidation_waits_for_commit(self):
+        etag = self.get(self.detail)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('77.00')
+            self.product.save()
+            # Un lector antes del commit sigue con la versión anterior: no puede
+            # guardar filas sin confirmar bajo la versión nueva
+            self.assertEqual(self.get(self.detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.get(self.detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['price'], '77.00')
+
+    def test_checkout_and_cancel_invalidate(self):
+        self.get(self.detail)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = checkout_cart(self.user, payment_method='cash', shipping_address='Av. Prueba 123',
+                                  shipping_city='Lima', shipping_postal_code='15001', phone='999999999')
+        self.assertEqual(self.get(self.detail).json()['stock'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_orders(Order.objects.filter(pk=order.pk), 'cancelled')
+        self.assertEqual(self.get(self.detail).json()['stock'], 5)
+
+
+# ===== IMPORTACIÓN DEL CATÁLOGO =====
+
+class ImportCatalogTests(TestCase):
+    HEADER = ['isbn', 'category', 'category_name', 'title', 'author', 'price', 'stock']
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = self.tmpdir / 'catalogo.csv'
+
+    def write(self, rows, extra_columns=()):
+        with open(self.path, 'w', newline='', encoding='utf-8') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(self.HEADER + list(extra_columns))
+            writer.writerows(rows)
+
+    def row(self, i, price='10.00'):
+        return [f'978000000{i:04d}', 'manga', 'Manga', f'Libro {i}', 'Autor', price, '5']
+
+    def run_import(self, *args):
+        out = StringIO()
+        self.errors = StringIO()
+        call_command('import_catalog', str(self.path), '--create-categories', *args, stdout=out, stderr=self.errors)
+        return out.getvalue()
+
+    def test_upsert_by_isbn(self):
+        self.write([self.row(i) for i in range(3)])
+        self.assertIn('nuevas: 3 | actualizadas: 0', self.run_import())
+        before = dict(Product.objects.values_list('isbn', 'created_at'))
+
+        self.write([self.row(i, price='12.50') for i in range(4)])
+        self.assertIn('nuevas: 1 | actualizadas: 3', self.run_import())
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertEqual(set(Product.objects.values_list('price', flat=True)), {Decimal('12.50')})
+        # El upsert conserva la fila (y su created_at)
+        for isbn, created_at in before.items():
+            self.assertEqual(Product.objects.get(isbn=isbn).created_at, created_at)
+        self.assertEqual(Category.objects.get(slug='manga').name, 'Manga')
+
+    def test_resume_after_errors(self):
+        rows = [self.row(i) for i in range(5)]
+        rows[3][5] = 'gratis'
+        self.write(rows)
+        with self.assertRaises(CommandError):
+            self.run_import('--batch-size', '2', '--max-errors', '1')
+        # Solo el primer lote quedó confirmado
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(json.loads(self.path.with_name('catalogo.csv.checkpoint').read_text()), {'rows': 2})
+
+        rows[3][5] = '10.00'
+        self.write(rows)
+        self.assertIn('nuevas: 3 | actualizadas: 0 | con error: 0 | omitidas (resume): 2',
+                      self.run_import('--batch-size', '2', '--resume'))
+        self.assertEqual(Product.objects.count(), 5)
+        self.assertFalse(self.path.with_name('catalogo.csv.checkpoint').exists())
+
+    def test_invalid_pages_and_image_url_are_row_errors(self):
+        # Sin validar, la base los rechazaría en el bulk_create y abortaría el lote entero
+        self.write([
+            self.row(0) + ['120', 'https://example.com/0.jpg'],
+            self.row(1) + ['-3', ''],
+            self.row(2) + ['', 'no es una url'],
+            self.row(3) + ['', ''],
+        ], extra_columns=['pages', 'image_url'])
+        self.assertIn('nuevas: 2 | actualizadas: 0 | con error: 2', self.run_import())
+        self.assertEqual(self.errors.getvalue().splitlines(), [
+            'Línea 3: pages no puede ser negativo',
+            "Línea 4: image_url inválida: 'no es una url'",
+        ])
+        self.assertEqual(sorted(Product.objects.values_list('pages', flat=True), key=str), [120, None])
+
+    def test_dry_run_writes_nothing(self):
+        self.write([self.row(i) for i in range(2)])
+        self.assertIn('[dry-run] Filas leídas: 2 | nuevas: 2', self.run_import('--dry-run'))
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+
+# ===== PLANES DE CONSULTA =====
+
+class ExplainQueriesTests(TestCase):
+
+    def explain(self, *args):
+        out = StringIO()
+        call_command('explain_queries', *args, stdout=out)
+        return out.getvalue()
+
+    def test_all_queries_use_indexes(self):
+        output = self.explain('--seed', '300', '--fail-on-issues')
+        self.assertIn('Todas las consultas usan índices', output)
+        # Cada grupo de variantes se explicó
+        for name in ['products.list_cursor', 'products.search', 'categories.products', 'orders.history_status',
+                     'cart.my_cart', 'changes.product_cursor']:
+            self.assertRegex(output, rf'(?m)^{re.escape(name)} ')
+        # Lo que siembra --seed se revierte
+        self.assertFalse(Product.objects.exists())
+
+    def test_unexpected_scan_is_reported(self):
+        unindexed = ExplainVariant('products.sin_indice', lambda c: Product.objects.filter(description='x'))
+        with mock.patch('products.management.commands.explain_queries.product_variants',
+                        return_value=[unindexed]):
+            output = self.explain('--seed', '10', '--only', 'products.')
+            self.assertRegex(output, r'products\.sin_indice\s+escaneo completo')
+            self.assertIn('1 consulta(s) con escaneos completos', output)
+            with self.assertRaisesMessage(CommandError, '1 consulta(s)'):
+                self.explain('--seed', '10', '--only', 'products.', '--fail-on-issues')
+
+    def test_requires_data(self):
+        with self.assertRaisesMessage(CommandError, 'usar --seed N'):
+            self.explain()
+
+    def test_problem_patterns(self):
+        def labels(vendor, line):
+            return [label for pattern, label in EXPLAIN_PROBLEMS[vendor] if pattern.search(line)]
+
+        for vendor, line, expected in [
+            ('sqlite', 'SCAN products_product', ['escaneo completo']),
+            ('sqlite', 'SCAN products_product USING INDEX product_active_price_idx', []),
+            ('sqlite', 'SCAN products_order USING COVERING INDEX order_user_created_idx', []),
+            ('sqlite', 'SCAN fts VIRTUAL TABLE INDEX 0:M3', []),
+            ('sqlite', 'SEARCH products_product USING INTEGER PRIMARY KEY (rowid=?)', []),
+            ('sqlite', 'USE TEMP B-TREE FOR ORDER BY', ['ordenamiento temporal']),
+            ('sqlite', 'USE TEMP B-TREE FOR RIGHT PART OF ORDER BY', ['ordenamiento temporal']),
+            ('postgresql', '  ->  Seq Scan on products_product  (cost=0.00..1.10 rows=1)', ['escaneo completo']),
+            ('postgresql', 'Index Scan using product_active_price_idx on products_product', []),
+            ('postgresql', '  ->  Sort  (cost=1.11..1.12 rows=1 width=8)', ['ordenamiento temporal']),
+            ('postgresql', 'Incremental Sort  (cost=1.11..1.12 rows=1 width=8)', ['ordenamiento temporal']),
+            ('postgresql', '        Sort Key: price', []),
+            ('postgresql', '        Sort Method: quicksort  Memory: 25kB', []),
+            ('postgresql', '  ->  Merge Append  (cost=0.30..8.35 rows=1 width=8)', []),
+        ]:
+            with self.subTest(vendor=vendor, line=line):
+                self.assertEqual(labels(vendor, line), expected)
+
+
+# ===== BENCHMARK DE ENDPOINTS =====
+
+class BenchmarkGateTests(SimpleTestCase):
+    """check_budgets y check_baseline: el control que corre en CI"""
+
+    def setUp(self):
+        tmpdir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.budgets = tmpdir / 'budgets.json'
+        self.budgets.write_text(json.dumps({'products.list': 2, 'orders.list': 3}))
+        self.baseline = tmpdir / 'baseline.json'
+        self.baseline.write_text(json.dumps([
+            {'endpoint': 'products.list', 'size': 100, 'p95_ms': 10.0},
+            {'endpoint': 'orders.list', 'size': 100, 'p95_ms': 10.0},
+        ]))
+        self.command = BenchmarkEndpointsCommand(stdout=StringIO())
+        self.options = {'budgets': str(self.budgets), 'baseline': str(self.baseline),
+                        'threshold': 0.25, 'min_delta_ms': 2.0}
+
+    def result(self, endpoint, queries=1, p95_ms=10.0, status=200, expected_status=200):
+        return {'endpoint': endpoint, 'size': 100, 'queries': queries, 'p95_ms': p95_ms,
+                'status': status, 'expected_status': expected_status}
+
+    def test_within_budget(self):
+        results = [self.result('products.list', queries=2), self.result('orders.list', queries=3)]
+        self.assertEqual(self.command.check_budgets(results, self.options), [])
+
+    def test_over_budget_and_unexpected_status(self):
+        results = [self.result('products.list', queries=3),
+                   self.result('orders.list', status=200, expected_status=201)]
+        self.assertEqual(self.command.check_budgets(results, self.options), [
+            'products.list (tamaño 100): 3 consultas, presupuesto 2',
+            'orders.list (tamaño 100): HTTP 200, se esperaba 201',
+        ])
+
+    def test_missing_budget_fails(self):
+        self.assertEqual(self.command.check_budgets([self.result('cart.new_action')], self.options),
+                         ['cart.new_action: sin presupuesto en budgets.json'])
+
+    def test_every_scenario_has_a_budget(self):
+        budgets = json.loads(Path(settings.BASE_DIR, 'benchmark_budgets.json').read_text())
+        self.assertEqual(sorted(budgets), sorted(scenario.name for scenario in BENCHMARK_SCENARIOS))
+
+    def test_baseline_regressions(self):
+        results = [
+            self.result('products.list', p95_ms=12.4),  # +24%: dentro del umbral
+            self.result('orders.list', p95_ms=13.0),  # +30% y +3ms: regresión
+        ]
+        self.assertEqual(self.command.check_baseline(results, self.options), [
+            'orders.list (tamaño 100): p95 13.00ms, baseline 10.00ms (+25% máx.)',
+        ])
+        # Diferencias menores a min_delta_ms son ruido aunque superen el porcentaje
+        self.assertEqual(self.command.check_baseline(results, {**self.options, 'min_delta_ms': 5.0}), [])
+        # Sin baseline o sin la fila en el baseline no hay nada que comparar
+        self.assertEqual(self.command.check_baseline(results, {**self.options, 'baseline': None}), [])
+        self.assertEqual(self.command.check_baseline([self.result('cart.clear', p95_ms=99.0)], self.options), [])
+
+
+# ===== MÉTRICAS POR PETICIÓN =====
+
+@override_settings(REQUEST_METRICS=True, CATALOG_CACHE_TIMEOUT=0, METRICS_TOKEN='')
+class RequestMetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(products=3, categories=1, prefix='metrics')
+        cls.staff = seed_user('metrics-staff')
+        cls.staff.is_staff = True
+        cls.staff.save()
+        cls.customer = seed_user('metrics-customer')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Los hooks se instalan en ready() solo si REQUEST_METRICS ya estaba activo
+        install_query_wrapper(None, connection)
+        install_serializer_timing()
+
+    def setUp(self):
+        REGISTRY.reset()
+
+    def get(self, path, user=None):
+        headers = {}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        return self.client.get(path, **headers)
+
+    def test_middleware_records_each_action(self):
+        self.get('/api/products/')
+        self.get('/api/products/')
+        self.get('/api/categories/')
+        product_list = REGISTRY.actions['product.list', 'GET']
+        self.assertEqual(product_list.count, 2)
+        self.assertEqual(product_list.statuses, {'2xx': 2})
+        self.assertGreater(product_list.queries, 0)
+        self.assertEqual(len(product_list.samples), 2)
+        self.assertIn(('category.list', 'GET'), REGISTRY.actions)
+
+    def test_disabled_by_default(self):
+        with override_settings(REQUEST_METRICS=False, DEBUG=True):
+            response = self.get('/api/products/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(REGISTRY.actions, {})
+
+    def test_server_timing_only_for_staff_or_debug(self):
+        self.assertNotIn('Server-Timing', self.get('/api/products/'))
+        self.assertNotIn('Server-Timing', self.get('/api/products/', self.customer))
+        self.assertRegex(self.get('/api/products/', self.staff)['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, render;dur=[\d.]+, total;dur=')
+        with override_settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.get('/api/products/'))
+
+    async def test_server_timing_under_asgi(self):
+        # El middleware corre en el event loop: no debe evaluar el usuario de la sesión
+        response = await self.async_client.get('/api/async/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(REGISTRY.actions['async-product-list', 'GET'].count, 1)
+
+    def test_prometheus_text(self):
+        now = [1000.0]
+        registry = MetricsRegistry(window=60, clock=lambda: now[0])
+        for duration, queries in [(0.1, 1), (0.2, 3), (0.4, 2), (0.3, 4)]:
+            stats = RequestStats()
+            stats.queries = queries
+            registry.observe('product.list', 'GET', 200, stats, duration)
+        registry.observe('say "hi"', 'BREW', 418, RequestStats(), 0.5)
+
+        text = registry.render()
+        labels = 'action="product.list",method="GET"'
+        for line in [
+            '# TYPE http_request_duration_seconds summary',
+            f'http_request_duration_seconds{{{labels},quantile="0.5"}} 0.2',
+            f'http_request_duration_seconds{{{labels},quantile="0.99"}} 0.4',
+            f'http_request_duration_seconds_count{{{labels}}} 4',
+            f'http_request_db_queries{{{labels},quantile="0.5"}} 2',
+            f'http_request_db_queries_sum{{{labels}}} 10',
+            f'http_requests_total{{{labels},status="2xx"}} 4',
+            'http_requests_total{action="say \\"hi\\"",method="OTHER",status="4xx"} 1',
+        ]:
+            self.assertIn(line, text.splitlines())
+
+        # Fuera de la ventana los cuantiles quedan vacíos; los acumulados siguen
+        now[0] += 61
+        lines = registry.render().splitlines()
+        self.assertIn(f'http_request_duration_seconds{{{labels},quantile="0.5"}} NaN', lines)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 4', lines)
+
+    def test_reservoir_is_bounded(self):
+        registry = MetricsRegistry(size=3)
+        for duration in [5.0, 1.0, 2.0, 3.0]:
+            registry.observe('product.list', 'GET', 200, RequestStats(), duration)
+        self.assertIn('http_request_duration_seconds{action="product.list",method="GET",quantile="0.99"} 3.0',
+                      registry.render().splitlines())
+
+    def test_metrics_view_access(self):
+        self.get('/api/products/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+        with override_settings(DEBUG=True):
+            response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('action="product.list",method="GET"', response.content.decode())
+
+        with override_settings(METRICS_TOKEN='secreto', DEBUG=True):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer otro').status_code, 404)
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
+
+
+# ===== CARRITOS ANÓNIMOS EN CACHÉ =====
+
+SHIPPING = {
+    'payment_method': 'cash', 'shipping_address': 'Av. Prueba 123', 'shipping_city': 'Lima',
+    'shipping_postal_code': '15001', 'phone': '999999999',
+}
+
+
+@override_settings(ANONYMOUS_CART_STORE='cache', CATALOG_CACHE_TIMEOUT=0, STOCK_RESERVATION_TTL=900)
+class AnonymousCartTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.products = seed_catalog(products=2, categories=1, stock=5, prefix='anon-cart')
+        cls.user = seed_user('anon-cart-user')
+
+    def setUp(self):
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def add(self, product, quantity, **headers):
+        response = self.client.post('/api/cart/add_item/', {'product_id': product.pk, 'quantity': quantity},
+                                    content_type='application/json', **headers)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response
+
+    def login(self):
+        response = self.client.post('/api/auth/login/', {'username': self.user.username, 'password': 'bench-password'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response
+
+    def user_cart(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def reserved(self):
+        return dict(StockReservation.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_anonymous_cart_stays_out_of_the_database(self):
+        first = self.products[0]
+        response = self.add(first, 2)
+        self.assertIn(settings.ANONYMOUS_CART_COOKIE, response.cookies)
+        self.assertEqual(response.json()['cart']['total_items'], 2)
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.client.get('/api/cart/my_cart/').json()['items'][0]['quantity'], 2)
+
+    def test_merge_on_login(self):
+        first, second = self.products
+        self.add(first, 2)
+        self.add(second, 1)
+        # El usuario ya tenía el primer producto en su carrito (con su reserva)
+        self.add(first, 1, **self.auth)
+
+        response = self.login()
+        self.assertEqual(response.cookies[settings.ANONYMOUS_CART_COOKIE].value, '')
+        self.assertEqual(self.user_cart(), {first.pk: 3, second.pk: 1})
+        self.assertEqual(self.reserved(), {first.pk: 3, second.pk: 1})
+        self.assertEqual(Product.objects.get(pk=first.pk).reserved_stock, 3)
+
+    def test_merge_caps_at_available_stock(self):
+        first = self.products[0]
+        self.add(first, 3)
+        # Otro comprador aparta después de que el anónimo agregó sus unidades
+        other = Cart.objects.create(session_key='otro-comprador')
+        reserve_stock(other, {first.pk: 4})
+        self.login()
+        self.assertEqual(self.user_cart(), {first.pk: 1})
+        self.assertEqual(Product.objects.get(pk=first.pk).reserved_stock, 5)
+
+    def test_add_item_checks_available_stock(self):
+        first = self.products[0]
+        other = Cart.objects.create(session_key='otro-comprador')
+        reserve_stock(other, {first.pk: 4})
+        self.add(first, 1)
+        # El carrito en caché no aparta nada: solo entra la unidad libre
+        response = self.client.post('/api/cart/add_item/', {'product_id': first.pk, 'quantity': 1},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Stock insuficiente. Disponible: 1')
+
+    def test_merge_survives_stock_taken_during_login(self):
+        first, second = self.products
+        self.add(first, 4)
+        self.add(second, 1)
+        other = Cart.objects.create(session_key='otro-comprador')
+        # Antes de cada uno de los dos primeros intentos otro carrito aparta más unidades
+        taken = iter([3, 4])
+
+        def contested(cart, quantities):
+            amount = next(taken, None)
+            if amount is not None:
+                reserve_stock(other, {first.pk: amount})
+            return reserve_stock(cart, quantities)
+
+        with mock.patch('products.carts.reserve_stock', side_effect=contested):
+            self.login()
+        # Pidió 4 con 2 libres (se recorta a 2); al reintentar quedaba 1: la línea se descarta
+        self.assertEqual(self.user_cart(), {second.pk: 1})
+        self.assertEqual(self.reserved(), {second.pk: 1})
+
+    def test_failed_merge_keeps_the_anonymous_cart(self):
+        first = self.products[0]
+        self.add(first, 2)
+        with mock.patch('products.carts.reserve_stock', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                self.login()
+        self.assertEqual(self.user_cart(), {})
+        self.assertEqual(self.client.get('/api/cart/my_cart/').json()['items'][0]['quantity'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.login()
+        self.assertEqual(self.user_cart(), {first.pk: 2})
+        self.assertEqual(self.client.get('/api/cart/my_cart/').json()['items'], [])
+
+    def test_checkout_with_cached_cart(self):
+        first = self.products[0]
+        self.add(first, 2)
+        response = self.client.post('/api/orders/create_order/', SHIPPING, content_type='application/json',
+                                    **self.auth)
+        self.assertEqual(response.status_code, 201, response.content[:500])
+        self.assertEqual([(item['product'], item['quantity']) for item in response.json()['order']['items']],
+                         [(first.pk, 2)])
+        product = Product.objects.get(pk=first.pk)
+        self.assertEqual((product.stock, product.reserved_stock), (3, 0))
+        self.assertEqual(self.user_cart(), {})
+
+
+# ===== LIMPIEZA DE CARRITOS =====
+
+@override_settings(STOCK_RESERVATION_TTL=900)
+class CleanupCartsTests(TestCase):
+
+    def setUp(self):
+        _, self.products = seed_catalog(products=2, categories=1, stock=10, prefix='cleanup')
+        self.old = timezone.now() - timedelta(days=60)
+        self.future = timezone.now() + timedelta(days=1)
+
+    def session(self, key, expire_date):
+        return Session.objects.create(session_key=key, session_data='', expire_date=expire_date)
+
+    def cart(self, old=False, **kwargs):
+        cart = Cart.objects.create(**kwargs)
+        for product in self.products:
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+        reserve_stock(cart, {product.pk: 1 for product in self.products})
+        if old:
+            Cart.objects.filter(pk=cart.pk).update(updated_at=self.old)
+            CartItem.objects.filter(cart=cart).update(updated_at=self.old)
+        return cart
+
+    def cleanup(self, *args):
+        out = StringIO()
+        call_command('cleanup_carts', '--sleep', '0', '--anonymous-days', '14', *args, stdout=out)
+        return out.getvalue()
+
+    def test_cleanup(self):
+        self.session('vencida', self.old)
+        orphan = self.cart(session_key='sin-sesion')
+        self.session('abandonada', self.future)
+        abandoned = self.cart(old=True, session_key='abandonada')
+        self.session('activa', self.future)
+        active = self.cart(old=True, session_key='activa')
+        CartItem.objects.filter(cart=active).update(updated_at=timezone.now())
+        stale_user = self.cart(old=True, user=seed_user('cleanup-stale'))
+        fresh_user = self.cart(user=seed_user('cleanup-fresh'))
+
+        self.assertIn('[dry-run] Sesiones vencidas: 1 | carritos huérfanos: 1 | '
+                      'carritos anónimos abandonados: 1 | items de carritos de usuario: 2',
+                      self.cleanup('--user-days', '30', '--dry-run'))
+        self.assertEqual(Cart.objects.count(), 5)
+
+        self.cleanup('--user-days', '30')
+        self.assertFalse(Session.objects.filter(session_key='vencida').exists())
+        self.assertCountEqual(Cart.objects.values_list('pk', flat=True),
+                              [active.pk, stale_user.pk, fresh_user.pk])
+        self.assertFalse(Cart.objects.filter(pk__in=[orphan.pk, abandoned.pk]).exists())
+        # El carrito del usuario inactivo se conserva vacío
+        self.assertFalse(stale_user.items.exists())
+        self.assertEqual(fresh_user.items.count(), 2)
+        # Solo quedan apartadas las unidades de los carritos que siguen con items
+        self.assertEqual(set(StockReservation.objects.values_list('cart_id', flat=True)),
+                         {active.pk, fresh_user.pk})
+        self.assertEqual(set(Product.objects.values_list('reserved_stock', flat=True)), {2})
+
+    def test_purge_queries_do_not_grow_with_carts(self):
+        def purge_queries(count):
+            for _ in range(count):
+                self.cart(session_key=None)
+            with CaptureQueriesContext(connection) as ctx:
+                self.cleanup()
+            self.assertFalse(Cart.objects.exists())
+            return len(ctx.captured_queries)
+
+        # Sin el pre_delete por carrito el lote cuesta lo mismo con 1 o con 5
+        self.assertEqual(purge_queries(1), purge_queries(5))
+        self.assertEqual(set(Product.objects.values_list('reserved_stock', flat=True)), {0})
+
+
+# ===== OPERACIONES EN LOTE DEL CARRITO =====
+
+@override_settings(STOCK_RESERVATION_TTL=900)
+class CartBatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.products = seed_catalog(products=3, categories=1, stock=5, prefix='batch')
+        cls.user = seed_user('batch-user')
+
+    def setUp(self):
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        self.cart = Cart.objects.create(user=self.user)
+        first, second, _ = self.products
+        self.batch([{'op': 'add', 'product_id': first.pk, 'quantity': 1},
+                    {'op': 'add', 'product_id': second.pk, 'quantity': 2}])
+
+    def batch(self, operations, expected=200):
+        response = self.client.post('/api/cart/batch/', {'operations': operations},
+                                    content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, expected, response.content[:500])
+        return response.json()
+
+    def items(self):
+        return dict(self.cart.items.values_list('product_id', 'quantity'))
+
+    def reserved(self):
+        return dict(StockReservation.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def test_operations_apply_in_order(self):
+        first, second, third = self.products
+        data = self.batch([
+            {'op': 'add', 'product_id': first.pk, 'quantity': 2},
+            {'op': 'set', 'product_id': second.pk, 'quantity': 4},
+            {'op': 'add', 'product_id': third.pk, 'quantity': 1},
+            {'op': 'add', 'product_id': third.pk, 'quantity': 1},
+            {'op': 'remove', 'product_id': first.pk},
+        ])
+        expected = {second.pk: 4, third.pk: 2}
+        self.assertEqual(self.items(), expected)
+        self.assertEqual(self.reserved(), expected)
+        self.assertEqual(data['cart']['total_items'], 6)
+        # set a 0 elimina
+        self.batch([{'op': 'set', 'product_id': third.pk, 'quantity': 0}])
+        self.assertEqual(self.items(), {second.pk: 4})
+
+    def test_insufficient_stock_changes_nothing(self):
+        first, second, third = self.products
+        data = self.batch([
+            {'op': 'add', 'product_id': third.pk, 'quantity': 1},
+            {'op': 'remove', 'product_id': first.pk},
+            {'op': 'set', 'product_id': second.pk, 'quantity': 6},
+        ], expected=400)
+        self.assertEqual(data['product_ids'], [second.pk])
+        self.assertEqual(self.items(), {first.pk: 1, second.pk: 2})
+        self.assertEqual(self.reserved(), {first.pk: 1, second.pk: 2})
+        self.assertEqual(Product.objects.get(pk=third.pk).reserved_stock, 0)
+
+    def test_unknown_product(self):
+        data = self.batch([{'op': 'add', 'product_id': 0, 'quantity': 1}], expected=404)
+        self.assertEqual(data['product_ids'], [0])
+
+    def test_validation(self):
+        first = self.products[0]
+        self.batch([], expected=400)
+        self.batch([{'op': 'add', 'product_id': first.pk}], expected=400)
+        self.batch([{'op': 'swap', 'product_id': first.pk, 'quantity': 1}], expected=400)
+        operations = [{'op': 'set', 'product_id': first.pk, 'quantity': 1}]
+        self.batch(operations * 200)
+        self.batch(operations * 201, expected=400)
+
+
+# ===== RESERVAS DE STOCK =====
+
+@override_settings(STOCK_RESERVATION_TTL=900, CATALOG_CACHE_TIMEOUT=0)
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        _, (self.product,) = seed_catalog(products=1, categories=1, stock=5, prefix='reservations')
+        self.user = seed_user('reservations-user')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def add(self, quantity, expected=200, **headers):
+        response = self.client.post('/api/cart/add_item/', {'product_id': self.product.pk, 'quantity': quantity},
+                                    content_type='application/json', **(headers or self.auth))
+        self.assertEqual(response.status_code, expected, response.content[:500])
+        return response
+
+    def reserved_stock(self):
+        return Product.objects.values_list('reserved_stock', flat=True).get(pk=self.product.pk)
+
+    def expire(self):
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_reservation_holds_stock_for_other_carts(self):
+        self.add(3)
+        self.assertEqual(self.reserved_stock(), 3)
+        other = Cart.objects.create(session_key='otro-comprador')
+        with self.assertRaises(InsufficientStock), transaction.atomic():
+            reserve_stock(other, {self.product.pk: 3})
+        reserve_stock(other, {self.product.pk: 2})
+        self.assertEqual(self.reserved_stock(), 5)
+
+    def test_expired_reservations_are_released(self):
+        self.add(3)
+        self.expire()
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertEqual(self.reserved_stock(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+        # El item sigue en el carrito: el próximo cambio vuelve a reservar
+        self.add(1)
+        self.assertEqual(self.reserved_stock(), 4)
+
+    def test_expired_reservations_do_not_block_other_carts(self):
+        self.add(4)
+        self.expire()
+        # Sin pasar el barrido: la reserva que falla libera las vencidas y reintenta
+        other = Cart.objects.create(session_key='otro-comprador')
+        reserve_stock(other, {self.product.pk: 5})
+        self.assertEqual(self.reserved_stock(), 5)
+        self.assertEqual(list(StockReservation.objects.values_list('cart_id', flat=True)), [other.pk])
+
+    def test_line_checks_count_what_the_cart_holds(self):
+        other = Cart.objects.create(session_key='otro-comprador')
+        reserve_stock(other, {self.product.pk: 3})
+        self.assertEqual(self.add(3, expected=400).json()['error'], 'Stock insuficiente. Disponible: 2')
+        self.add(2)
+        # Las 2 unidades ya apartadas por este carrito cuentan como disponibles
+        self.assertEqual(self.add(1, expected=400).json()['error'], 'Stock insuficiente. Disponible: 2')
+        item = CartItem.objects.get(cart__user=self.user)
+        response = self.client.patch('/api/cart/update_item/', {'item_id': item.pk, 'quantity': 3},
+                                     content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Stock insuficiente. Disponible: 2')
+        self.assertEqual(self.reserved_stock(), 5)
+
+    def test_changes_renew_the_expiry(self):
+        self.add(1)
+        self.expire()
+        self.add(1)
+        self.assertGreater(StockReservation.objects.get().expires_at, timezone.now())
+
+    def test_checkout_consumes_reservations(self):
+        self.add(2)
+        response = self.client.post('/api/orders/create_order/', SHIPPING, content_type='application/json',
+                                    **self.auth)
+        self.assertEqual(response.status_code, 201, response.content[:500])
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.stock, product.reserved_stock), (3, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_reserved_stock_is_not_public(self):
+        self.add(2)
+        detail = f'/api/products/{self.product.pk}/'
+        self.assertNotIn('reserved_stock', self.client.get(detail).json())
+        self.assertEqual(self.client.get(f'{detail}?fields=id,reserved_stock').status_code, 400)
+
+    def test_deleting_cart_or_user_releases(self):
+        self.add(2)
+        Cart.objects.get(user=self.user).delete()
+        self.assertEqual(self.reserved_stock(), 0)
+
+        self.add(3)
+        self.user.delete()
+        self.assertEqual(self.reserved_stock(), 0)
+        self.assertFalse(StockReservation.objects.exists())
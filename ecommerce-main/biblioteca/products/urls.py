@@ -1,10 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
+from .async_views import (
+    CategoryListView, FeaturedProductsView, ProductDetailView, ProductListView,
+    ProductsByCategoryView
+)
 from .views import (
     CategoryViewSet, ProductViewSet, CartViewSet, lista_productos,
     RegisterView, CustomTokenObtainPairView, user_profile,
-    OrderViewSet
+    OrderViewSet, catalog_changes, metrics
 )
 
 router = DefaultRouter()
@@ -19,11 +23,25 @@ urlpatterns = [
 
     path('lista/', lista_productos),
 
+    # Lecturas del catálogo con vistas async para ASGI (ver async_views.py)
+    path('async/products/', ProductListView.as_view(), name='async-product-list'),
+    path('async/products/featured/', FeaturedProductsView.as_view(), name='async-product-featured'),
+    path('async/products/by_category/', ProductsByCategoryView.as_view(),
+         name='async-product-by-category'),
+    path('async/products/<int:pk>/', ProductDetailView.as_view(), name='async-product-detail'),
+    path('async/categories/', CategoryListView.as_view(), name='async-category-list'),
+
+    # Cambios del catálogo desde un cursor (ver changes.py)
+    path('catalog/changes/', catalog_changes, name='catalog-changes'),
+
      # Autenticación
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('auth/login/', CustomTokenObtainPairView.as_view(), name='login'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/profile/', user_profile, name='user_profile'),
+
+    # Métricas para Prometheus (ver metrics.py)
+    path('metrics/', metrics, name='metrics'),
 ]
 
 urlpatterns += router.urls
@@ -1,17 +1,42 @@
 from rest_framework import viewsets, filters, status, generics
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.crypto import constant_time_compare
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Category, Cart, CartItem, Product, Order, OrderItem
+from .models import (
+    Category, Cart, CartItem, Product, ProductRanking, Order, OrderItem, StockReservation
+)
 from .serializers import (
-    CategorySerializer, CategoryListSerializer, ProductSerializer, CartSerializer,
-    CartItemSerializer, RegisterSerializer, UserSerializer, CustomTokenObtainPairSerializer,
+    CategorySerializer, CategoryListSerializer, ProductSerializer, ProductListSerializer, CartSerializer,
+    CartItemSerializer, CartBatchSerializer, RegisterSerializer, UserSerializer, CustomTokenObtainPairSerializer,
     OrderSerializer, CreateOrderSerializer
 )
+from .cache import cache_catalog_response
+from .changes import DEFAULT_LIMIT as DEFAULT_CHANGES, MAX_LIMIT as MAX_CHANGES, read_changes
+from .carts import (
+    CachedCart, get_cart_token, persist_anonymous_cart, set_cart_cookie, uses_cache_store
+)
+from .fieldsets import SparseFieldsetMixin
+from .metrics import REGISTRY
+from .pagination import KeysetPagination
+from .rankings import ranking
+from .reservations import release_cart_reservations, reserve_stock
+from .rows import FastRowsMixin
+from .search import FullTextSearchFilter
+from .services import (
+    InsufficientStock, ProductUnavailable, apply_cart_operations, get_order_statistics,
+    transition_orders
+)
 
 # ===== AUTENTICACIÓN =====
 
@@ -34,6 +59,15 @@ class RegisterView(generics.CreateAPIView):
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        # Al iniciar sesión el carrito anónimo en caché pasa al carrito del usuario
+        token = get_cart_token(request)
+        if token and response.status_code == status.HTTP_200_OK:
+            persist_anonymous_cart(token, response.data['user']['id'])
+            response.delete_cookie(settings.ANONYMOUS_CART_COOKIE)
+        return response
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -45,26 +79,36 @@ def user_profile(request):
 
 # ===== ÓRDENES =====
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(FastRowsMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    # Historial desde values_list() (ver rows.py)
+    fast_row_actions = ('history',)
 
     def get_queryset(self):
-        # Solo mostrar las órdenes del usuario actual
-        return Order.objects.filter(user=self.request.user)
+        # Solo mostrar las órdenes del usuario actual (con lo que OrderSerializer lee de cada una)
+        return Order.objects.filter(user=self.request.user).select_related('user').prefetch_related('items')
 
     @action(detail=False, methods=['post'])
     def create_order(self, request):
         """Crear una orden desde el carrito actual"""
+        # Si todavía hay un carrito anónimo en caché se vuelca antes de validar
+        # (el checkout solo lee el Cart de la base)
+        token = get_cart_token(request)
+        persist_anonymous_cart(token, request.user.pk)
         serializer = CreateOrderSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         
         order_serializer = OrderSerializer(order)
-        return Response({
+        response = Response({
             'message': 'Orden creada exitosamente',
             'order': order_serializer.data
         }, status=status.HTTP_201_CREATED)
+        if token:
+            response.delete_cookie(settings.ANONYMOUS_CART_COOKIE)
+        return response
 
     @action(detail=False, methods=['get'])
     def history(self, request):
@@ -75,6 +119,10 @@ class OrderViewSet(viewsets.ModelViewSet):
         status_filter = request.query_params.get('status', None)
         if status_filter:
             orders = orders.filter(status=status_filter)
+
+        mapper = self.get_row_mapper()
+        if mapper is not None:
+            return self.row_response(mapper, orders)
         
         # Paginación
         page = self.paginate_queryset(orders)
@@ -89,22 +137,16 @@ class OrderViewSet(viewsets.ModelViewSet):
     def cancel(self, request, pk=None):
         """Cancelar una orden (solo si está pendiente)"""
         order = self.get_object()
-        
-        if order.status != 'pending':
+
+        # El filtro por estado del UPDATE evita cancelar dos veces en peticiones simultáneas
+        if not transition_orders(Order.objects.filter(pk=order.pk), 'cancelled', from_statuses=['pending']):
             return Response(
                 {'error': 'Solo se pueden cancelar órdenes pendientes'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        order.status = 'cancelled'
-        order.save()
-        
-        # Devolver stock
-        for item in order.items.all():
-            if item.product:
-                item.product.stock += item.quantity
-                item.product.save()
-        
+        # Los items ya vienen precargados y no cambian al cancelar
+        order.refresh_from_db(fields=['status', 'updated_at'])
+
         serializer = self.get_serializer(order)
         return Response({
             'message': 'Orden cancelada exitosamente',
@@ -114,67 +156,120 @@ class OrderViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """Estadísticas de compras del usuario"""
-        orders = self.get_queryset()
+        stats = get_order_statistics(request.user)
         
-        stats = {
-            'total_orders': orders.count(),
-            'total_spent': sum(order.total for order in orders),
-            'orders_by_status': {
-                'pending': orders.filter(status='pending').count(),
-                'processing': orders.filter(status='processing').count(),
-                'shipped': orders.filter(status='shipped').count(),
-                'delivered': orders.filter(status='delivered').count(),
-                'cancelled': orders.filter(status='cancelled').count(),
-            },
-            'last_order': None
-        }
-        
-        last_order = orders.first()
-        if last_order:
-            stats['last_order'] = OrderSerializer(last_order).data
+        if stats['last_order']:
+            stats['last_order'] = OrderSerializer(stats['last_order']).data
         
         return Response(stats)
 
 class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    queryset = Category.objects.with_product_count()
+    read_replica = True
+    filter_backends = [FullTextSearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
+    search_index = 'category'
+    pagination_class = KeysetPagination
     ordering_fields = ['name', 'created_at']
     
     def get_serializer_class(self):
         if self.action == 'list':
             return CategoryListSerializer
         return CategorySerializer
+
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_active_products(self, category):
+        return (
+            Product.objects.filter(category=category, is_active=True)
+            .select_related('category')
+        )
+
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        """Datos de la categoría más la primera página de sus productos"""
+        category = self.get_object()
+        data = self.get_serializer(category).data
+
+        # La página siguiente se pide a /categories/{id}/products/?cursor=...
+        paginator = KeysetPagination()
+        paginator.base_url = reverse('category-products', args=[category.pk], request=request)
+        page = paginator.paginate_queryset(self.get_active_products(category), request, view=self)
+        data['products'] = ProductListSerializer(page, many=True).data
+        data['products_next'] = paginator.get_next_link()
+        return Response(data)
     
     @action(detail=True, methods=['get'])
+    @cache_catalog_response
     def products(self, request, pk=None):
+        """Productos activos de la categoría, paginados"""
         category = self.get_object()
-        products = category.products.filter(is_active=True)
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(self.get_active_products(category))
+        serializer = ProductListSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True)
+class ProductViewSet(FastRowsMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
+    # ProductSerializer lee category.name
+    queryset = Product.objects.filter(is_active=True).select_related('category')
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # Listados compactos por defecto; ?fields= y ?omit= en las lecturas (ver fieldsets.py)
+    list_serializer_class = ProductListSerializer
+    # Listados desde values_list() (ver rows.py)
+    fast_row_actions = ('list', 'by_category', 'featured', 'bestsellers')
+    read_replica = True
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'author', 'publisher', 'language']
     search_fields = ['title', 'author', 'description', 'isbn']
+    search_index = 'product'
+    pagination_class = KeysetPagination
     ordering_fields = ['price', 'created_at', 'rating', 'title']
+
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     @action(detail=False, methods=['get'])
+    @cache_catalog_response
     def by_category(self, request):
         category_id = request.query_params.get('category_id')
         if category_id:
-            products = self.queryset.filter(category_id=category_id)
+            mapper = self.get_row_mapper()
+            if mapper is not None:
+                return self.row_response(mapper, self.get_queryset().filter(category_id=category_id),
+                                         paginate=False)
+            products = self.restrict_columns(self.get_queryset().filter(category_id=category_id))
             serializer = self.get_serializer(products, many=True)
             return Response(serializer.data)
         return Response({'error': 'category_id parameter is required'}, status=400)
     
     @action(detail=False, methods=['get'])
+    @cache_catalog_response
     def featured(self, request):
-        products = self.queryset.filter(rating__gte=4.0).order_by('-rating')[:10]
-        serializer = self.get_serializer(products, many=True)
+        # Lista precalculada (ver rankings.py)
+        return self.ranked_response(ProductRanking.FEATURED)
+
+    # Sin cache_catalog_response: las ventas cambian la lista sin cambiar la
+    # versión del catálogo. Es una lectura por índice de RANKING_SIZE filas.
+    @action(detail=False, methods=['get'])
+    def bestsellers(self, request):
+        category_id = request.query_params.get('category_id') or None
+        if category_id is not None and not category_id.isdigit():
+            return Response({'category_id': ['Debe ser un número entero.']}, status=400)
+        return self.ranked_response(ProductRanking.BESTSELLERS, category_id)
+
+    def ranked_response(self, kind, category_id=None):
+        mapper = self.get_row_mapper()
+        if mapper is not None:
+            return self.row_response(mapper, ranking(kind, category_id), paginate=False, prefix='product__')
+        entries = self.restrict_columns(ranking(kind, category_id), 'product__')
+        serializer = self.get_serializer([entry.product for entry in entries], many=True)
         return Response(serializer.data)
     
 class CartViewSet(viewsets.ModelViewSet):
@@ -183,30 +278,79 @@ class CartViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            return Cart.objects.filter(user=self.request.user)
+            return Cart.objects.with_totals().filter(user=self.request.user)
+        elif uses_cache_store():
+            # Los carritos anónimos no están en la base (ver carts.py)
+            return Cart.objects.none()
         else:
             session_key = self.request.session.session_key
             if not session_key:
                 self.request.session.create()
                 session_key = self.request.session.session_key
-            return Cart.objects.filter(session_key=session_key)
+            return Cart.objects.with_totals().filter(session_key=session_key)
 
-    def get_or_create_cart(self):
+    def get_or_create_cart(self, with_totals=False):
         """Obtiene o crea un carrito para el usuario o sesión actual"""
+        if not self.request.user.is_authenticated and uses_cache_store():
+            self.cached_cart = CachedCart.load(get_cart_token(self.request))
+            return self.cached_cart
+        carts = Cart.objects.with_totals() if with_totals else Cart.objects.all()
         if self.request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=self.request.user)
+            cart, created = carts.get_or_create(user=self.request.user)
         else:
             session_key = self.request.session.session_key
             if not session_key:
                 self.request.session.create()
                 session_key = self.request.session.session_key
-            cart, created = Cart.objects.get_or_create(session_key=session_key)
+            cart, created = carts.get_or_create(session_key=session_key)
         return cart
 
+    def get_cart_data(self, cart):
+        """Serializa el carrito con un número fijo de consultas (totales + items)"""
+        if not isinstance(cart, CachedCart):
+            cart = Cart.objects.with_totals().get(pk=cart.pk)
+        return CartSerializer(cart).data
+
+    def cart_items(self, cart):
+        """Items del carrito con `held`: las unidades que ya tienen reservadas"""
+        return CartItem.objects.filter(cart=cart).annotate(held=Subquery(
+            StockReservation.objects.filter(cart=cart, product=OuterRef('product')).values('quantity')
+        ))
+
+    def get_cart_item(self, cart, item_id):
+        """Item del carrito por id, o None"""
+        if isinstance(cart, CachedCart):
+            return cart.get_item(item_id)
+        return self.cart_items(cart).select_related('product').filter(id=item_id).first()
+
+    def line_available(self, product, cart_item):
+        """Unidades que admite la línea: el stock libre más lo que el carrito ya apartó"""
+        # Los items en caché no reservan: no tienen `held`
+        return product.available_stock + (getattr(cart_item, 'held', None) or 0)
+
+    def reserve_line(self, cart, product_id, quantity):
+        """Reserva stock para la línea; devuelve un Response de error si no alcanza"""
+        try:
+            reserve_stock(cart, {product_id: quantity})
+        except InsufficientStock as exc:
+            return Response(
+                {'error': f'Stock insuficiente. Disponible: {exc.available_for(exc.products[0])}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Un carrito anónimo nuevo en caché: enviar su token en la cookie
+        cart = getattr(self, 'cached_cart', None)
+        if cart is not None and cart.token and cart.token != get_cart_token(request):
+            set_cart_cookie(response, cart.token)
+        return response
+
     @action(detail=False, methods=['get'])
     def my_cart(self, request):
         """Obtiene el carrito actual del usuario/sesión"""
-        cart = self.get_or_create_cart()
+        cart = self.get_or_create_cart(with_totals=True)
         serializer = self.get_serializer(cart)
         return Response(serializer.data)
 
@@ -232,32 +376,42 @@ class CartViewSet(viewsets.ModelViewSet):
             )
 
         # Verificar stock
-        cart_item = CartItem.objects.filter(cart=cart, product=product).first()
+        if isinstance(cart, CachedCart):
+            cart_item = cart.get_item(product.pk)
+        else:
+            cart_item = self.cart_items(cart).filter(product=product).first()
         new_quantity = quantity if not cart_item else cart_item.quantity + quantity
 
-        if new_quantity > product.stock:
+        available = self.line_available(product, cart_item)
+        if new_quantity > available:
             return Response(
-                {'error': f'Stock insuficiente. Disponible: {product.stock}'}, 
+                {'error': f'Stock insuficiente. Disponible: {available}'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Crear o actualizar item
-        if cart_item:
-            cart_item.quantity = new_quantity
-            cart_item.save()
-            message = 'Cantidad actualizada'
-        else:
-            cart_item = CartItem.objects.create(
-                cart=cart,
-                product=product,
-                quantity=quantity
-            )
-            message = 'Producto agregado al carrito'
+        # Crear o actualizar item (junto con la reserva de stock)
+        with transaction.atomic():
+            error = self.reserve_line(cart, product.pk, new_quantity)
+            if error:
+                return error
+            if cart_item:
+                cart_item.quantity = new_quantity
+                cart_item.save()
+                message = 'Cantidad actualizada'
+            elif isinstance(cart, CachedCart):
+                cart_item = cart.add_item(product, quantity)
+                message = 'Producto agregado al carrito'
+            else:
+                cart_item = CartItem.objects.create(
+                    cart=cart,
+                    product=product,
+                    quantity=quantity
+                )
+                message = 'Producto agregado al carrito'
 
-        serializer = CartSerializer(cart)
         return Response({
             'message': message,
-            'cart': serializer.data
+            'cart': self.get_cart_data(cart)
         }, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['patch'])
@@ -273,31 +427,35 @@ class CartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-        except CartItem.DoesNotExist:
+        cart_item = self.get_cart_item(cart, item_id)
+        if cart_item is None:
             return Response(
                 {'error': 'Item no encontrado en el carrito'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        if quantity <= 0:
-            cart_item.delete()
-            message = 'Producto eliminado del carrito'
-        else:
-            if quantity > cart_item.product.stock:
-                return Response(
-                    {'error': f'Stock insuficiente. Disponible: {cart_item.product.stock}'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            cart_item.quantity = quantity
-            cart_item.save()
-            message = 'Cantidad actualizada'
+        available = self.line_available(cart_item.product, cart_item)
+        if quantity > 0 and quantity > available:
+            return Response(
+                {'error': f'Stock insuficiente. Disponible: {available}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            error = self.reserve_line(cart, cart_item.product.pk, max(quantity, 0))
+            if error:
+                return error
+            if quantity <= 0:
+                cart_item.delete()
+                message = 'Producto eliminado del carrito'
+            else:
+                cart_item.quantity = quantity
+                cart_item.save()
+                message = 'Cantidad actualizada'
 
-        serializer = CartSerializer(cart)
         return Response({
             'message': message,
-            'cart': serializer.data
+            'cart': self.get_cart_data(cart)
         }, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['delete'])
@@ -312,34 +470,94 @@ class CartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            cart_item.delete()
-        except CartItem.DoesNotExist:
+        cart_item = self.get_cart_item(cart, item_id)
+        if cart_item is None:
             return Response(
                 {'error': 'Item no encontrado'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        with transaction.atomic():
+            self.reserve_line(cart, cart_item.product.pk, 0)
+            cart_item.delete()
 
-        serializer = CartSerializer(cart)
         return Response({
             'message': 'Producto eliminado del carrito',
-            'cart': serializer.data
+            'cart': self.get_cart_data(cart)
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Aplica varias operaciones add/set/remove en una sola petición (todo o nada)"""
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = self.get_or_create_cart()
+
+        try:
+            apply_cart_operations(cart, serializer.validated_data['operations'])
+        except ProductUnavailable as exc:
+            return Response(
+                {'error': 'Producto no encontrado', 'product_ids': exc.product_ids},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except InsufficientStock as exc:
+            return Response(
+                {'error': str(exc), 'product_ids': [product.pk for product in exc.products]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'message': 'Carrito actualizado',
+            'cart': self.get_cart_data(cart)
         }, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['delete'])
     def clear(self, request):
         """Vacía el carrito"""
         cart = self.get_or_create_cart()
-        cart.items.all().delete()
+        if isinstance(cart, CachedCart):
+            cart.clear()
+        else:
+            with transaction.atomic():
+                release_cart_reservations(cart)
+                cart.items.all().delete()
         
-        serializer = CartSerializer(cart)
         return Response({
             'message': 'Carrito vaciado',
-            'cart': serializer.data
+            'cart': self.get_cart_data(cart)
         }, status=status.HTTP_200_OK)
     
 from django.http import JsonResponse
 
 def lista_productos(request):
     return JsonResponse({"mensaje": "funciona"})
+
+
+# ===== FEED DE CAMBIOS =====
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def catalog_changes(request):
+    """Productos y categorías cambiados o eliminados desde ?cursor= (ver changes.py)"""
+    try:
+        limit = min(max(int(request.query_params['limit']), 1), MAX_CHANGES)
+    except (KeyError, ValueError):
+        limit = DEFAULT_CHANGES
+    feed = read_changes(request.query_params.get('cursor'), limit)
+    next_url = None
+    if feed['has_more']:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', feed['cursor'])
+    return Response({'next': next_url, **feed})
+
+
+# ===== MÉTRICAS =====
+
+def metrics(request):
+    """Histogramas por acción en formato Prometheus (ver metrics.py)"""
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = settings.DEBUG
+    if not allowed:
+        raise Http404
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')